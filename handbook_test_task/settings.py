@@ -45,7 +45,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'terminology.metrics.MetricsMiddleware',
+    'terminology.replicas.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'django.middleware.http.ConditionalGetMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -90,6 +93,184 @@ DATABASES = {
     }
 }
 
+DATABASE_ROUTERS = ['terminology.replicas.ReplicaRouter']
+
+
+# Read replicas, see terminology.replicas
+
+# Aliases of DATABASES entries reads of read-only requests are spread over, with
+# their weights, e.g. {"replica1": 2, "replica2": 1}. Give replica entries
+# "TEST": {"MIRROR": "default"}.
+DATABASE_REPLICAS = {}
+
+# Reads of a client stay on the primary this long after it wrote, keep it above
+# REPLICA_MAX_LAG_SECONDS
+REPLICA_STICKY_SECONDS = 10
+
+# Replicas lagging behind the primary more than this are out of rotation
+REPLICA_MAX_LAG_SECONDS = 5
+
+# Seconds between health checks of a replica, per process
+REPLICA_CHECK_INTERVAL = 10
+
+
+# Upper bound for the limit query param of list endpoints
+
+MAX_PAGE_SIZE = 1000
+
+
+# In-process cache of handbook -> version id resolution, see terminology.version_cache
+
+VERSION_CACHE_SIZE = 10000
+
+VERSION_CACHE_TTL = 300  # seconds
+
+
+# Element validation, see terminology.validation
+
+# Payloads larger than this are validated with the bounded memory merge strategy
+VALIDATION_MERGE_THRESHOLD = 100000
+
+# Rows fetched per database round trip while streaming reference elements
+VALIDATION_CHUNK_SIZE = 2000
+
+# Upper bound of items per batch validation request
+VALIDATION_BATCH_MAX_ITEMS = 10000
+
+
+# Bulk element upload, see terminology.bulk
+
+# Upper bound of elements per bulk upload request
+BULK_MAX_ELEMENTS = 100000
+
+# Rows per INSERT statement
+BULK_CREATE_BATCH_SIZE = 1000
+
+
+# Rows per COPY or bulk_create round trip of the import_handbook command, see terminology.imports
+
+IMPORT_CHUNK_SIZE = 50000
+
+
+# Upper bound of add, remove and replace items of a version fork, see terminology.fork
+
+FORK_MAX_PATCH_ITEMS = 10000
+
+
+# Streaming element export, see terminology.export
+
+# Rows fetched per server-side cursor round trip
+EXPORT_CHUNK_SIZE = 2000
+
+# Approximate number of characters sent per response chunk
+EXPORT_BUFFER_SIZE = 65536
+
+
+# Upper bound of codes per element lookup request
+
+LOOKUP_MAX_CODES = 5000
+
+
+# Encode element lists with orjson when it is installed, see terminology.rendering.
+# Output is then compact JSON with non-ASCII characters unescaped instead of byte
+# for byte JsonResponse output, so clients comparing raw bodies must allow it.
+
+FAST_JSON_RENDERING = False
+
+
+# MessagePack and CBOR are negotiated by the Accept header when msgpack and cbor2
+# are installed, and accepted as request bodies, see terminology.rendering
+
+REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': [
+        'rest_framework.renderers.JSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+        'terminology.rendering.MessagePackRenderer',
+        'terminology.rendering.CBORRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'rest_framework.parsers.JSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+        'terminology.rendering.MessagePackParser',
+        'terminology.rendering.CBORParser',
+    ],
+}
+
+
+# In-process snapshots of version elements, see terminology.snapshots
+
+SNAPSHOTS_ENABLED = True
+
+# Upper bound of estimated memory held by snapshots, per process
+SNAPSHOT_MAX_BYTES = 256 * 1024 * 1024
+
+SNAPSHOT_TTL = 600  # seconds
+
+
+# Admin changelists of PostgreSQL tables with more rows than this show the
+# planner estimate instead of COUNT(*), see terminology.admin
+ADMIN_ESTIMATED_COUNT_MIN = 100000
+
+# Versions offered by the element changelist version filter: those of the
+# selected version's handbook or the latest created, up to this many
+ADMIN_VERSION_FILTER_CHOICES = 20
+
+
+# Element search, see terminology.search
+
+# Upper bound of estimated memory held by search indexes of other backends
+# than PostgreSQL, per process. They expire after SNAPSHOT_TTL too.
+SEARCH_INDEX_MAX_BYTES = 512 * 1024 * 1024
+
+
+# Async views under ASGI, see terminology.async_views
+
+# Threads running ORM work, bounds database connections per worker
+ASYNC_DB_THREADS = 16
+
+# Processes diffing recent element validation
+ASYNC_CPU_WORKERS = 2
+
+# Smaller validation payloads are diffed in the DB threads instead
+ASYNC_CPU_MIN_ELEMENTS = 5000
+
+# Reference versions sent to the processes at most, larger ones and versions
+# without a snapshot are diffed in the DB threads
+ASYNC_CPU_MAX_REFERENCE_ROWS = 50000
+
+# Requests in progress per worker, the rest wait
+ASYNC_MAX_CONCURRENCY = 256
+
+
+# Handbook versions in effect warmed up by the serve command, see terminology.warmup
+
+WARMUP_VERSIONS = 100
+
+
+# Change feed, see terminology.changes
+
+# Upper bound and default of changes per feed response
+CHANGE_FEED_BATCH_SIZE = 1000
+
+# Longest expected write transaction, gaps in sequence numbers are waited for that long.
+# Changes of longer transactions may be missed by feed readers, see terminology.changes
+CHANGE_FEED_SETTLE_SECONDS = 60
+
+# Superseded changes older than this are dropped by compact_changes
+CHANGE_LOG_COMPACT_AFTER = 24 * 60 * 60  # seconds
+
+# Changes older than this are dropped by compact_changes, clients behind have to resync
+CHANGE_LOG_RETENTION = 30 * 24 * 60 * 60  # seconds
+
+
+# Per-route request metrics served on /metrics, see terminology.metrics
+
+METRICS_ENABLED = True
+
+# Upper bounds of latency histogram buckets, in seconds
+METRICS_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
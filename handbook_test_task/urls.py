@@ -1,16 +1,28 @@
 from django.contrib import admin
-from django.urls import path
+from django.urls import include, path
+from terminology import async_views
 from terminology.views import (
     GetHandbooksShort,
     PostHandbook,
     GetHandbooksFull,
     GetRecentHandbookElements,
     GetVersionHandbookElements,
+    GetHandbookVersionDiff,
+    ExportVersionHandbookElements,
+    LookupHandbookElements,
+    SearchHandbookElements,
     GetHandbooksActualForDate,
     RecentHandbookElementsValidation,
     ElementHandbookValidation,
+    BatchElementHandbookValidation,
     PostHandbookVersion,
     PostHandbookElement,
+    PostHandbookElements,
+    PostHandbookVersionFork,
+    GetSnapshotStats,
+    GetChanges,
+    GetReadiness,
+    GetMetrics,
 )
 
 from rest_framework import permissions
@@ -27,6 +39,22 @@ schema_view = get_schema_view(
     permission_classes=(permissions.AllowAny,),
 )
 
+async_urlpatterns = [
+    path("handbook/", async_views.get_handbooks_full),
+    path("handbook/actual", async_views.get_handbooks_actual_for_date),
+    path("element/actual/<int:handbook_id>/", async_views.get_recent_handbook_elements),
+    path("element/version/<int:handbook_id>/", async_views.get_version_handbook_elements),
+    path("element/diff/<int:handbook_id>/", async_views.get_handbook_version_diff),
+    path("element/lookup/<int:handbook_id>/", async_views.lookup_handbook_elements),
+    path("element/search/<int:handbook_id>/", async_views.search_handbook_elements),
+
+    path("element/validate_recent/<int:handbook_id>/", async_views.recent_handbook_elements_validation),
+    path("element/validate/<int:handbook_id>/", async_views.element_handbook_validation),
+    path("element/validate_batch/", async_views.batch_element_handbook_validation),
+
+    path("changes", async_views.get_changes),
+]
+
 urlpatterns = [
     path("admin/", admin.site.urls),
 
@@ -34,16 +62,33 @@ urlpatterns = [
     path("handbook/actual", GetHandbooksActualForDate.as_view()),
     path("element/actual/<int:handbook_id>/", GetRecentHandbookElements.as_view()),
     path("element/version/<int:handbook_id>/", GetVersionHandbookElements.as_view()),
+    path("element/diff/<int:handbook_id>/", GetHandbookVersionDiff.as_view()),
+    path("element/export/<int:handbook_id>/", ExportVersionHandbookElements.as_view()),
+    path("element/lookup/<int:handbook_id>/", LookupHandbookElements.as_view()),
+    path("element/search/<int:handbook_id>/", SearchHandbookElements.as_view()),
 
 
     path("element/validate_recent/<int:handbook_id>/", RecentHandbookElementsValidation.as_view()),
     path("element/validate/<int:handbook_id>/", ElementHandbookValidation.as_view()),
+    path("element/validate_batch/", BatchElementHandbookValidation.as_view()),
+
+    path("element/bulk/", PostHandbookElements.as_view()),
+    path("version/fork/<int:handbook_id>/", PostHandbookVersionFork.as_view()),
+
+    path("changes", GetChanges.as_view()),
+
+    path("ready/", GetReadiness.as_view()),
+    path("metrics", GetMetrics.as_view()),
+
+    # Same endpoints for ASGI servers, see terminology.async_views
+    path("async/", include(async_urlpatterns)),
 
     # FOR DEBUG PURPOSES ONLY
     path("handbook/short/", GetHandbooksShort.as_view()),
     path("post_handbook/", PostHandbook.as_view()),
     path("post_handbook_version/", PostHandbookVersion.as_view()),
     path("post_handbook_element/", PostHandbookElement.as_view()),
+    path("snapshots/stats/", GetSnapshotStats.as_view()),
 
     #drf-yasg part
     path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
@@ -1,11 +1,95 @@
+from django.conf import settings
 from django.contrib import admin
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Exists, OuterRef, Prefetch
+from django.utils.functional import cached_property
 
 from terminology.models import Handbook, HandbookVersion, HandbookElement
 
+# Registers the ilike_prefix lookup of search_fields
+from terminology import search  # noqa
+
+ElementVersions = HandbookElement.handbook.through
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Counts unfiltered PostgreSQL tables by the planner estimate, COUNT(*)
+    scans the whole table. Small tables and filtered querysets are counted.
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor == 'postgresql' and not queryset.query.where:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT reltuples FROM pg_class WHERE oid = %s::regclass',
+                    [queryset.model._meta.db_table],
+                )
+                row = cursor.fetchone()
+            # -1 for tables never analyzed
+            if row is not None and row[0] >= settings.ADMIN_ESTIMATED_COUNT_MIN:
+                return int(row[0])
+        return super().count
+
+
+class VersionListFilter(admin.SimpleListFilter):
+    title = 'Версия'
+    parameter_name = 'version'
+
+    def lookups(self, request, model_admin):
+        # Listing every version would not scale, others are still filtered by
+        # ?version=<id>
+        versions_qs = HandbookVersion.objects.select_related('handbook_identifier')
+        selected = None
+        if self.value() and self.value().isdigit():
+            selected = versions_qs.filter(id=self.value()).first()
+        if selected is not None:
+            versions_qs = versions_qs.filter(
+                handbook_identifier=selected.handbook_identifier_id
+            )
+        limit = settings.ADMIN_VERSION_FILTER_CHOICES
+        versions = list(versions_qs.order_by('-created', '-id')[:limit])
+        if selected is not None and selected not in versions:
+            versions.append(selected)
+        versions.sort(key=lambda v: (v.handbook_identifier_id, v.starting_date, v.id))
+        return [(version.id, str(version)) for version in versions]
+
+    def queryset(self, request, queryset):
+        if self.value() is None:
+            return queryset
+        if not self.value().isdigit():
+            raise IncorrectLookupParameters(f'Unknown version {self.value()!r}')
+        # Exists instead of a join, which would need DISTINCT
+        return queryset.filter(
+            Exists(
+                ElementVersions.objects.filter(
+                    handbookelement_id=OuterRef('id'),
+                    handbookversion_id=self.value(),
+                )
+            )
+        )
+
 
 class HandbookElementAdmin(admin.ModelAdmin):
     model = HandbookElement
     list_display = ('element_code', 'element_value', 'list_handbooks', )
+    list_filter = (VersionListFilter, )
+    # Prefix matches served by element_code_trgm_idx and element_value_trgm_idx
+    search_fields = ('element_code__ilike_prefix', 'element_value__ilike_prefix', )
+    autocomplete_fields = ('handbook', )
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_queryset(self, request):
+        versions_qs = HandbookVersion.objects.select_related('handbook_identifier')
+        return super().get_queryset(request).prefetch_related(
+            Prefetch('handbook', queryset=versions_qs)
+        )
 
 
 class HandbookVersionAdmin(admin.ModelAdmin):
@@ -17,11 +101,20 @@ class HandbookVersionAdmin(admin.ModelAdmin):
     readonly_fields = ('created',)
     model = HandbookVersion
     list_display = ('version', 'handbook_identifier', 'starting_date', 'created', )
+    search_fields = ('version', 'handbook_identifier__name', )
+    autocomplete_fields = ('handbook_identifier', )
+    ordering = ('handbook_identifier', 'starting_date', )
+
+    def get_queryset(self, request):
+        # Versions render with their handbook, in autocomplete results too
+        return super().get_queryset(request).select_related('handbook_identifier')
 
 
 class HandbookAdmin(admin.ModelAdmin):
     model = Handbook
     list_display = ('name', 'short_name', 'description', )
+    search_fields = ('name', 'short_name', )
+    ordering = ('name', )
 
 
 admin.site.register(HandbookElement, HandbookElementAdmin)
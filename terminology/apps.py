@@ -1,6 +1,37 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
 
 
 class TerminologyConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'terminology'
+
+    def ready(self):
+        from terminology import changes, fingerprint, metrics, search, snapshots
+        from terminology.models import Handbook, HandbookElement, HandbookVersion
+        from terminology.version_cache import invalidate_version
+
+        post_save.connect(invalidate_version, sender=HandbookVersion)
+        post_delete.connect(invalidate_version, sender=HandbookVersion)
+
+        post_save.connect(fingerprint.element_changed, sender=HandbookElement)
+        pre_delete.connect(fingerprint.element_changed, sender=HandbookElement)
+        pre_delete.connect(fingerprint.version_deleted, sender=HandbookVersion)
+        m2m_changed.connect(
+            fingerprint.membership_changed, sender=HandbookElement.handbook.through
+        )
+
+        post_delete.connect(snapshots.version_deleted, sender=HandbookVersion)
+        fingerprint.fingerprints_reset.connect(snapshots.fingerprints_reset)
+        post_delete.connect(search.version_deleted, sender=HandbookVersion)
+        fingerprint.fingerprints_reset.connect(search.fingerprints_reset)
+
+        connection_created.connect(metrics.install_query_counter)
+
+        for model in (Handbook, HandbookVersion, HandbookElement):
+            post_save.connect(changes.saved, sender=model)
+            post_delete.connect(changes.deleted, sender=model)
+        m2m_changed.connect(
+            changes.membership_changed, sender=HandbookElement.handbook.through
+        )
@@ -0,0 +1,163 @@
+"""
+Async variants of the read and validation endpoints for ASGI servers.
+
+Under ASGI, Django runs sync views one at a time on a single thread, so a
+slow query stalls every other request of the worker. These views keep the
+event loop free instead: ORM work of the sync views runs in a pool of
+ASYNC_DB_THREADS threads, which also bounds the database connections
+opened by a worker. Recent element validation streams the reference rows
+in a DB thread too. Only payloads of ASYNC_CPU_MIN_ELEMENTS and more checked
+against a snapshot of at most ASYNC_CPU_MAX_REFERENCE_ROWS elements, which
+keep the GIL busy without waiting on the database, are diffed in a pool of
+ASYNC_CPU_WORKERS processes. At most ASYNC_MAX_CONCURRENCY requests per
+worker are in progress, the rest wait for a slot.
+"""
+
+import asyncio
+import functools
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.http import HttpResponse, JsonResponse
+
+from terminology import rendering, validation, views
+from terminology.version_cache import get_current_version_id
+
+_db_executor = ThreadPoolExecutor(
+    max_workers=settings.ASYNC_DB_THREADS, thread_name_prefix="terminology-db"
+)
+_cpu_executor = None
+_semaphores = {}
+
+
+def _get_cpu_executor():
+    global _cpu_executor
+    if _cpu_executor is None:
+        _cpu_executor = ProcessPoolExecutor(max_workers=settings.ASYNC_CPU_WORKERS)
+    return _cpu_executor
+
+
+def _get_semaphore():
+    # Semaphores are bound to the event loop they are first used in.
+    loop = asyncio.get_event_loop()
+    if loop not in _semaphores:
+        _semaphores[loop] = asyncio.Semaphore(settings.ASYNC_MAX_CONCURRENCY)
+    return _semaphores[loop]
+
+
+def _with_connections(func):
+    # Pool threads do not see request_started/request_finished, so they
+    # release connections past CONN_MAX_AGE themselves.
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        close_old_connections()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+
+    return wrapper
+
+
+def run_db(func, *args, **kwargs):
+    """Awaitable running blocking ORM work in the bounded DB thread pool."""
+    return sync_to_async(
+        _with_connections(func), thread_sensitive=False, executor=_db_executor
+    )(*args, **kwargs)
+
+
+def run_cpu(func, *args):
+    """Awaitable running a picklable CPU bound function in the process pool."""
+    return asyncio.get_event_loop().run_in_executor(_get_cpu_executor(), func, *args)
+
+
+def csrf_exempt(view):
+    # django.views.decorators.csrf.csrf_exempt of Django 3.2 hides coroutines
+    view.csrf_exempt = True
+    return view
+
+
+def as_async_view(view_class):
+    """Async view running a sync APIView in the DB thread pool."""
+    sync_view = view_class.as_view()
+
+    async def view(request, *args, **kwargs):
+        async with _get_semaphore():
+            return await run_db(sync_view, request, *args, **kwargs)
+
+    view.view_class = view_class
+    return csrf_exempt(view)
+
+
+def _get_recent_version(request, handbook_id):
+    """Id and snapshot, if any, of the actual version."""
+    version_id = get_current_version_id(handbook_id)
+    return version_id, views.get_version_snapshot(request, version_id)
+
+
+def _validate(view, version_id, snapshot, received_elements, strategy):
+    # Reference rows are streamed from the snapshot or a database cursor
+    return validation.validate_elements(
+        view.get_reference_rows(version_id, snapshot), received_elements, strategy
+    )
+
+
+def _is_cpu_bound(snapshot, received_elements):
+    return (
+        snapshot is not None
+        and len(snapshot) <= settings.ASYNC_CPU_MAX_REFERENCE_ROWS
+        and len(received_elements) >= settings.ASYNC_CPU_MIN_ELEMENTS
+    )
+
+
+@csrf_exempt
+async def recent_handbook_elements_validation(request, handbook_id):
+    """Async RecentHandbookElementsValidation, takes JSON, MessagePack or CBOR."""
+    if request.method != "POST":
+        return HttpResponse(status=405)
+    try:
+        received_elements = rendering.loads(request)["elements"]
+    except (ValueError, KeyError, TypeError):
+        return HttpResponse(status=400)
+    if not isinstance(received_elements, list):
+        return HttpResponse(status=400)
+
+    view = views.RecentHandbookElementsValidation()
+    strategy = view.get_strategy(received_elements)
+    async with _get_semaphore():
+        version_id, snapshot = await run_db(_get_recent_version, request, handbook_id)
+        try:
+            if _is_cpu_bound(snapshot, received_elements):
+                report = await run_cpu(
+                    validation.validate_elements,
+                    list(snapshot.reference_rows()),
+                    received_elements,
+                    strategy,
+                )
+            else:
+                report = await run_db(
+                    _validate, view, version_id, snapshot, received_elements, strategy
+                )
+        except (KeyError, TypeError):
+            return HttpResponse(status=400)
+        error_dict = await run_db(view.get_errors, report, snapshot)
+    return rendering.response(
+        request, {"validation_errors": error_dict}, json_response=JsonResponse
+    )
+
+
+recent_handbook_elements_validation.replica_reads = True
+
+
+get_handbooks_full = as_async_view(views.GetHandbooksFull)
+get_handbooks_actual_for_date = as_async_view(views.GetHandbooksActualForDate)
+get_recent_handbook_elements = as_async_view(views.GetRecentHandbookElements)
+get_version_handbook_elements = as_async_view(views.GetVersionHandbookElements)
+get_handbook_version_diff = as_async_view(views.GetHandbookVersionDiff)
+lookup_handbook_elements = as_async_view(views.LookupHandbookElements)
+search_handbook_elements = as_async_view(views.SearchHandbookElements)
+element_handbook_validation = as_async_view(views.ElementHandbookValidation)
+batch_element_handbook_validation = as_async_view(views.BatchElementHandbookValidation)
+get_changes = as_async_view(views.GetChanges)
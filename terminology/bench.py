@@ -0,0 +1,402 @@
+"""
+End-to-end benchmark of every endpoint, run by the bench management command.
+
+seed_dataset creates a synthetic dataset in which consecutive versions of a
+handbook share elements through the M2M, like versions of real handbooks
+do. run_cases drives each endpoint through the test client, timing repeated
+requests of a warmed process and counting queries and traced peak memory of
+one more instrumented request. Queries of async views are not counted.
+"""
+
+import itertools
+import math
+import random
+import time
+import tracemalloc
+from dataclasses import dataclass, field
+from datetime import timedelta
+
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLResolver, get_resolver
+from django.utils import timezone
+
+from terminology.bulk import bulk_create_elements
+from terminology.models import Handbook, HandbookElement, HandbookVersion
+
+WRITES_HANDBOOK = "bench writes"
+WRITES_VERSION = "bench"
+SAMPLE_SIZE = 100
+
+
+@dataclass
+class Case:
+    name: str
+    route: str
+    path: str
+    method: str = "get"
+    data: dict = None  # or a callable returning the data of each request
+    statuses: tuple = (200,)
+    # Queries of async views run on connections of pool threads
+    count_queries: bool = True
+
+
+@dataclass
+class Dataset:
+    handbook_ids: list
+    version_names: list
+    writes_handbook_id: int
+    element_rows: int = 0
+    # (id, element_code, element_value) of the version in effect of the
+    # first handbook, which read cases target
+    actual_elements: list = field(default_factory=list)
+
+
+def _version_name(index):
+    return f"{index + 1}.0"
+
+
+def seed_dataset(handbooks, versions, elements, shared=0.5):
+    """
+    Creates handbooks x versions x elements. Each version keeps the shared
+    fraction of the elements of its predecessor, so elements belong to up to
+    ceil(1 / (1 - shared)) versions. The last version of each handbook is the
+    one in effect.
+    """
+    now = timezone.now()
+    kept = min(int(elements * shared), elements - 1)
+    step = elements - kept
+    version_names = [_version_name(v) for v in range(versions)]
+
+    handbook_ids, rows = [], []
+    for h in range(handbooks):
+        handbook = Handbook.objects.create(
+            name=f"handbook {h}", short_name=f"hb{h}", description="synthetic"
+        )
+        handbook_ids.append(handbook.id)
+        version_ids = [
+            HandbookVersion.objects.create(
+                handbook_identifier=handbook,
+                version=name,
+                starting_date=now - timedelta(days=versions - v),
+            ).id
+            for v, name in enumerate(version_names)
+        ]
+        # Element i belongs to versions v with v * step <= i < v * step + elements
+        for i in range((versions - 1) * step + elements):
+            first = max(0, math.ceil((i - elements + 1) / step))
+            last = min(versions - 1, i // step)
+            rows.append((f"C{i:08d}", f"value {h} {i}", version_ids[first : last + 1]))
+    bulk_create_elements(rows)
+
+    writes = Handbook.objects.create(
+        name=WRITES_HANDBOOK, short_name="bench", description="bench writes"
+    )
+    HandbookVersion.objects.create(
+        handbook_identifier=writes, version=WRITES_VERSION, starting_date=now
+    )
+
+    actual_elements = list(
+        HandbookElement.objects.filter(
+            handbook__handbook_identifier=handbook_ids[0],
+            handbook__version=version_names[-1],
+        )
+        .order_by("id")
+        .values_list("id", "element_code", "element_value")
+    )
+    return Dataset(
+        handbook_ids=handbook_ids,
+        version_names=version_names,
+        writes_handbook_id=writes.id,
+        element_rows=len(rows),
+        actual_elements=actual_elements,
+    )
+
+
+def _element_dict(row):
+    return dict(zip(("id", "element_code", "element_value"), row))
+
+
+def build_cases(dataset, seed=0):
+    rnd = random.Random(seed)
+    handbook_id = dataset.handbook_ids[0]
+    actual = dataset.version_names[-1]
+    previous = dataset.version_names[max(0, len(dataset.version_names) - 2)]
+    sample = rnd.sample(
+        dataset.actual_elements, min(SAMPLE_SIZE, len(dataset.actual_elements))
+    )
+    date = timezone.localtime().strftime("%Y-%m-%d %X")
+    forks = itertools.count()
+
+    reads = [
+        Case("handbooks", "handbook/", "handbook/?limit=100"),
+        Case("handbooks cursor", "handbook/", "handbook/?limit=100&cursor="),
+        Case("handbooks sparse", "handbook/", "handbook/?limit=100&fields=id,name"),
+        Case("actual for date", "handbook/actual", f"handbook/actual?date={date}"),
+        Case(
+            "actual elements",
+            "element/actual/<int:handbook_id>/",
+            f"element/actual/{handbook_id}/?limit=100",
+        ),
+        Case(
+            "version elements",
+            "element/version/<int:handbook_id>/",
+            f"element/version/{handbook_id}/?version={previous}&limit=100&cursor=",
+        ),
+        Case(
+            "version diff",
+            "element/diff/<int:handbook_id>/",
+            f"element/diff/{handbook_id}/?from={previous}&to={actual}&limit=100",
+        ),
+        Case(
+            "lookup",
+            "element/lookup/<int:handbook_id>/",
+            f"element/lookup/{handbook_id}/",
+            method="post",
+            data={"codes": [code for _, code, _ in sample]},
+        ),
+        Case(
+            "search prefix",
+            "element/search/<int:handbook_id>/",
+            f"element/search/{handbook_id}/?q={sample[0][1][:-2]}&mode=prefix",
+        ),
+        Case(
+            "search fuzzy",
+            "element/search/<int:handbook_id>/",
+            # Code with a digit dropped
+            f"element/search/{handbook_id}/?q={sample[0][1][:3] + sample[0][1][4:]}",
+        ),
+        Case(
+            "validate recent",
+            "element/validate_recent/<int:handbook_id>/",
+            f"element/validate_recent/{handbook_id}/",
+            method="post",
+            data={"elements": [_element_dict(row) for row in dataset.actual_elements]},
+        ),
+        Case(
+            "validate element",
+            "element/validate/<int:handbook_id>/",
+            f"element/validate/{handbook_id}/",
+            method="post",
+            data={"version": actual, "element": _element_dict(sample[0])},
+        ),
+        Case(
+            "validate batch",
+            "element/validate_batch/",
+            "element/validate_batch/",
+            method="post",
+            data={
+                "items": [
+                    {
+                        "handbook_id": handbook_id,
+                        "version": rnd.choice(dataset.version_names),
+                        "element": _element_dict(row),
+                    }
+                    for row in sample
+                ]
+            },
+        ),
+        Case("changes", "changes", "changes?since=0&limit=100"),
+    ]
+    cases = reads + [
+        Case(
+            f"async {case.name}",
+            "async/" + case.route,
+            "async/" + case.path,
+            case.method,
+            case.data,
+            case.statuses,
+            count_queries=False,
+        )
+        for case in reads
+    ]
+    cases += [
+        Case(
+            "export",
+            "element/export/<int:handbook_id>/",
+            f"element/export/{handbook_id}/?version={actual}&output=ndjson",
+        ),
+        Case("handbooks short", "handbook/short/", "handbook/short/?limit=100"),
+        Case("snapshot stats", "snapshots/stats/", "snapshots/stats/"),
+        Case("ready", "ready/", "ready/", statuses=(200, 503)),
+        Case("metrics", "metrics", "metrics"),
+        Case("swagger", "swagger/", "swagger/?format=openapi"),
+        # Writes go last and to their own handbook, reads stay unaffected
+        Case(
+            "post handbook",
+            "post_handbook/",
+            "post_handbook/",
+            method="post",
+            data={"handbook": {"name": "bench", "short_name": "b", "description": "-"}},
+            statuses=(201,),
+        ),
+        Case(
+            "post version",
+            "post_handbook_version/",
+            "post_handbook_version/",
+            method="post",
+            data={
+                "handbook_version": {
+                    "handbook_identifier": dataset.writes_handbook_id,
+                    "version": "bench posted",
+                    "description": "-",
+                }
+            },
+            statuses=(201,),
+        ),
+        Case(
+            "post element",
+            "post_handbook_element/",
+            "post_handbook_element/",
+            method="post",
+            data={
+                "handbook_element": {
+                    "handbook": [WRITES_VERSION],
+                    "element_code": "bench",
+                    "element_value": "bench",
+                }
+            },
+            statuses=(201,),
+        ),
+        Case(
+            "fork version",
+            "version/fork/<int:handbook_id>/",
+            f"version/fork/{dataset.writes_handbook_id}/",
+            method="post",
+            data=lambda: {
+                "from_version": WRITES_VERSION,
+                "version": f"bench fork {next(forks)}",
+                "remove": ["bench"],
+            },
+            statuses=(201,),
+        ),
+        Case(
+            "bulk elements",
+            "element/bulk/",
+            "element/bulk/",
+            method="post",
+            data={
+                "handbook_elements": [
+                    {
+                        "handbook": [WRITES_VERSION],
+                        "element_code": f"bench {i}",
+                        "element_value": "bench",
+                    }
+                    for i in range(SAMPLE_SIZE)
+                ]
+            },
+            statuses=(201,),
+        ),
+    ]
+    return cases
+
+
+def _routes(patterns, prefix=""):
+    for pattern in patterns:
+        route = prefix + str(pattern.pattern)
+        if isinstance(pattern, URLResolver):
+            yield from _routes(pattern.url_patterns, route)
+        else:
+            yield route
+
+
+def uncovered_routes(cases):
+    """Routes without a case, includes fully uncovered as "<prefix>*"."""
+    covered = {case.route for case in cases}
+    uncovered = []
+    for pattern in get_resolver().url_patterns:
+        routes = list(_routes([pattern]))
+        missing = [route for route in routes if route not in covered]
+        if len(routes) > 1 and len(missing) == len(routes):
+            uncovered.append(f"{pattern.pattern}*")
+        else:
+            uncovered.extend(missing)
+    return uncovered
+
+
+def _request(client, case):
+    if case.method == "get":
+        response = client.get("/" + case.path)
+    else:
+        data = case.data() if callable(case.data) else case.data
+        response = client.post("/" + case.path, data, content_type="application/json")
+    if response.streaming:
+        b"".join(response.streaming_content)
+    return response
+
+
+def _percentile(sorted_values, percent):
+    # Nearest rank
+    index = max(0, math.ceil(percent / 100 * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+def run_case(client, case, requests):
+    errors = 0
+    _request(client, case)  # warms caches and snapshots
+    timings = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        response = _request(client, case)
+        timings.append(time.perf_counter() - start)
+        if response.status_code not in case.statuses:
+            errors += 1
+
+    tracemalloc.start()
+    try:
+        with CaptureQueriesContext(connection) as queries:
+            _request(client, case)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    timings.sort()
+    return {
+        "name": case.name,
+        "method": case.method.upper(),
+        "route": case.route,
+        "p50_ms": _percentile(timings, 50) * 1e3,
+        "p90_ms": _percentile(timings, 90) * 1e3,
+        "p99_ms": _percentile(timings, 99) * 1e3,
+        "max_ms": timings[-1] * 1e3,
+        "queries": len(queries) if case.count_queries else None,
+        "peak_kib": peak / 1024,
+        "errors": errors,
+    }
+
+
+def run_cases(cases, requests):
+    client = Client()
+    return [run_case(client, case, requests) for case in cases]
+
+
+def find_regressions(results, baseline, tolerance):
+    """
+    Differences from the endpoints of a baseline result: more queries, or
+    p50 latency or peak memory worse by more than the tolerance fraction.
+    """
+    previous = {endpoint["name"]: endpoint for endpoint in baseline["endpoints"]}
+    regressions = []
+    for endpoint in results["endpoints"]:
+        before = previous.get(endpoint["name"])
+        if before is None:
+            continue
+        if (
+            endpoint["queries"] is not None
+            and before["queries"] is not None
+            and endpoint["queries"] > before["queries"]
+        ):
+            regressions.append(
+                f"{endpoint['name']}: {endpoint['queries']} queries, "
+                f"was {before['queries']}"
+            )
+        for key in ("p50_ms", "peak_kib"):
+            if endpoint[key] > before[key] * (1 + tolerance):
+                regressions.append(
+                    f"{endpoint['name']}: {key} {endpoint[key]:.2f}, "
+                    f"was {before[key]:.2f}"
+                )
+        if endpoint["errors"] > before["errors"]:
+            regressions.append(f"{endpoint['name']}: {endpoint['errors']} errors")
+    return regressions
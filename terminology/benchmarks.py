@@ -0,0 +1,241 @@
+"""
+In-process microbenchmarks run by the microbench management command.
+
+Each benchmark takes the list of problem sizes and returns a list of result
+dicts, one per size and variant, holding at least "variant", "size" and
+"seconds" (best of several repeats). Results measuring something else than
+size items also hold the item count in "items".
+"""
+
+import asyncio
+import json
+import random
+import time
+import timeit
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.test import AsyncClient
+
+from terminology import rendering, search, validation
+from terminology.models import HandbookElement, HandbookVersion
+from terminology.serializers import HandbookElementSerializer
+
+REPEAT = 5
+
+
+def _best_time(func, repeat=REPEAT):
+    return min(timeit.repeat(func, number=1, repeat=repeat))
+
+
+def _synthetic_elements(size, seed=0):
+    rnd = random.Random(seed)
+    reference_rows = [
+        (element_id, f"C{element_id:08d}", f"value {element_id}")
+        for element_id in range(1, size + 1)
+    ]
+    received = [
+        {"id": element_id, "element_code": code, "element_value": value}
+        for element_id, code, value in reference_rows
+    ]
+    # A few percent of mismatches, unknown ids and omitted ids.
+    for element in rnd.sample(received, size // 50):
+        element["element_value"] += " changed"
+    for element in rnd.sample(received, size // 50):
+        element["id"] += size
+    rnd.shuffle(received)
+    return reference_rows, received[: size - size // 100]
+
+
+def bench_validation(sizes):
+    results = []
+    for size in sizes:
+        reference_rows, received = _synthetic_elements(size)
+        for strategy in (validation.HASH, validation.MERGE):
+            seconds = _best_time(
+                lambda: validation.validate_elements(
+                    iter(reference_rows), list(received), strategy
+                )
+            )
+            results.append({"variant": strategy, "size": size, "seconds": seconds})
+    return results
+
+
+def _prefetched_elements(size):
+    """Unsaved elements with their versions in the prefetch cache, no DB needed."""
+    versions = [HandbookVersion(id=version_id) for version_id in (1, 2)]
+    elements = []
+    for element_id in range(1, size + 1):
+        element = HandbookElement(
+            id=element_id,
+            element_code=f"C{element_id:08d}",
+            element_value=f"value {element_id}",
+        )
+        versions_qs = HandbookVersion.objects.all()
+        versions_qs._result_cache = versions[: element_id % 2 + 1]
+        versions_qs._prefetch_done = True
+        element._prefetched_objects_cache = {"handbook": versions_qs}
+        elements.append(element)
+    return elements
+
+
+def bench_render(sizes):
+    """
+    CPU cost of rendering an element page. Excludes queries, the DRF path
+    additionally costs one query per element without prefetching.
+    """
+    results = []
+    for size in sizes:
+        elements = _prefetched_elements(size)
+        rows = [
+            {
+                "id": element.id,
+                "element_code": element.element_code,
+                "element_value": element.element_value,
+                "handbook": [v.id for v in element.handbook.all()],
+            }
+            for element in elements
+        ]
+        variants = {
+            "drf": lambda: json.dumps(
+                {"elements": HandbookElementSerializer(elements, many=True).data},
+                cls=DjangoJSONEncoder,
+            ),
+            "rows+json": lambda: json.dumps(
+                {"elements": [dict(row) for row in rows]}, cls=DjangoJSONEncoder
+            ),
+        }
+        if rendering.orjson is not None:
+            variants["rows+orjson"] = lambda: rendering.orjson.dumps(
+                {"elements": [dict(row) for row in rows]}
+            )
+        for variant, func in variants.items():
+            results.append(
+                {"variant": variant, "size": size, "seconds": _best_time(func)}
+            )
+    return results
+
+
+ASYNC_REQUESTS = 512
+
+
+async def _get_concurrently(paths, concurrency):
+    client = AsyncClient()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def get(path):
+        async with semaphore:
+            response = await client.get(path)
+        if response.status_code != 200:
+            raise RuntimeError(f"GET {path} answered {response.status_code}")
+
+    await asyncio.gather(*(get(paths[i % len(paths)]) for i in range(ASYNC_REQUESTS)))
+
+
+def bench_async(sizes):
+    """
+    Wall time of ASYNC_REQUESTS requests to the sync views and their /async/
+    counterparts through the ASGI handler, sizes are concurrency levels. Runs
+    against the configured database, which needs at least one element.
+    """
+    handbook_id = (
+        HandbookVersion.objects.filter(handbookelement__isnull=False)
+        .values_list("handbook_identifier_id", flat=True)
+        .first()
+    )
+    if handbook_id is None:
+        raise RuntimeError("the async benchmark needs elements in the database")
+    paths = ["/handbook/", f"/element/actual/{handbook_id}/"]
+
+    results = []
+    for concurrency in sizes:
+        for variant, prefix in (("sync", ""), ("async", "/async")):
+            prefixed = [prefix + path for path in paths]
+            start = time.perf_counter()
+            asyncio.run(_get_concurrently(prefixed, concurrency))
+            results.append(
+                {
+                    "variant": variant,
+                    "size": concurrency,
+                    "items": ASYNC_REQUESTS,
+                    "seconds": time.perf_counter() - start,
+                }
+            )
+    return results
+
+
+SEARCH_QUERIES = 20
+SEARCH_LETTERS = "абвгдежзийклмнопрстуфхцчшщыэюя"
+
+
+def _search_rows(size, rnd):
+    """Elements with values of words from a vocabulary, like diagnosis names."""
+    vocabulary = [
+        "".join(rnd.choice(SEARCH_LETTERS) for _ in range(rnd.randint(4, 11)))
+        for _ in range(5000)
+    ]
+    rows = [
+        (
+            element_id,
+            f"{chr(ord('A') + element_id % 26)}{element_id:07d}",
+            " ".join(rnd.choice(vocabulary) for _ in range(rnd.randint(2, 5))),
+        )
+        for element_id in range(1, size + 1)
+    ]
+    return rows, vocabulary
+
+
+def bench_search(sizes):
+    """
+    In-process search index of other backends than PostgreSQL: build time
+    and time of SEARCH_QUERIES queries per mode, items are the queries.
+    """
+    results = []
+    for size in sizes:
+        rnd = random.Random(0)
+        rows, vocabulary = _search_rows(size, rnd)
+        start = time.perf_counter()
+        index = search.SearchIndex(0, "", rows)
+        results.append(
+            {
+                "variant": "build",
+                "size": size,
+                "seconds": time.perf_counter() - start,
+            }
+        )
+
+        words = rnd.sample(vocabulary, SEARCH_QUERIES)
+        queries = {
+            "prefix": [(word[:3], search.PREFIX) for word in words],
+            "code prefix": [
+                (rnd.choice(rows)[1][:5], search.PREFIX) for _ in range(SEARCH_QUERIES)
+            ],
+            "fuzzy": [(word, search.FUZZY) for word in words],
+            # One letter dropped
+            "typo": [(word[:2] + word[3:], search.FUZZY) for word in words],
+        }
+        for variant, variant_queries in queries.items():
+            seconds = _best_time(
+                lambda: [index.search(query, mode) for query, mode in variant_queries]
+            )
+            results.append(
+                {
+                    "variant": variant,
+                    "size": size,
+                    "items": len(variant_queries),
+                    "seconds": seconds,
+                }
+            )
+    return results
+
+
+BENCHMARKS = {
+    "async": bench_async,
+    "render": bench_render,
+    "search": bench_search,
+    "validation": bench_validation,
+}
+
+DEFAULT_SIZES = {
+    "async": (1, 8, 32, 128),
+    "search": (250000, 500000, 1000000),
+}
@@ -0,0 +1,69 @@
+"""
+Bulk writes of handbook elements and their version membership.
+"""
+
+from django.conf import settings
+from django.db import connections, router, transaction
+
+from terminology.changes import record_many
+from terminology.fingerprint import reset_fingerprints
+from terminology.models import Change, HandbookElement
+
+ElementVersions = HandbookElement.handbook.through
+
+
+def bulk_create_elements(rows, batch_size=None):
+    """
+    Creates elements with their version links in a single transaction.
+
+    rows is a list of (element_code, element_value, version_ids) tuples.
+    Elements are inserted with bulk_create, and through table rows in bulk
+    right after them. Returns the ids of the created elements in row order.
+    """
+    batch_size = batch_size or settings.BULK_CREATE_BATCH_SIZE
+    db = router.db_for_write(HandbookElement)
+    elements = [
+        HandbookElement(element_code=code, element_value=value)
+        for code, value, _ in rows
+    ]
+
+    changes = []
+    with transaction.atomic(using=db):
+        if connections[db].features.can_return_rows_from_bulk_insert:
+            for i in range(0, len(elements), batch_size):
+                HandbookElement.objects.using(db).bulk_create(
+                    elements[i : i + batch_size]
+                )
+            # bulk_create sends no post_save signals
+            changes += [
+                (Change.ELEMENT, Change.CREATED, element.id, 0) for element in elements
+            ]
+        else:
+            # Ids of bulk inserted rows are unknown on this backend.
+            for element in elements:
+                element.save(using=db)
+
+        links = (
+            ElementVersions(handbookelement_id=element.id, handbookversion_id=v_id)
+            for element, (_, _, version_ids) in zip(elements, rows)
+            for v_id in set(version_ids)
+        )
+        batch = []
+        for link in links:
+            batch.append(link)
+            if len(batch) == batch_size:
+                ElementVersions.objects.using(db).bulk_create(batch)
+                batch = []
+        if batch:
+            ElementVersions.objects.using(db).bulk_create(batch)
+
+        # bulk_create sends no m2m_changed signals
+        reset_fingerprints(v_id for _, _, version_ids in rows for v_id in version_ids)
+        changes += [
+            (Change.MEMBERSHIP, Change.CREATED, element.id, v_id)
+            for element, (_, _, version_ids) in zip(elements, rows)
+            for v_id in set(version_ids)
+        ]
+        record_many(changes)
+
+    return [element.id for element in elements]
@@ -0,0 +1,198 @@
+"""
+Change feed for incremental sync of mirrors.
+
+Every change of a handbook, version, element or element version membership
+appends a Change with a global sequence number. Clients read the feed
+after the last seq they have seen and refetch the objects named by the
+entries: created and updated are both upserts, deleted of an unknown object
+is a no-op.
+
+Sequence numbers are allocated when rows are inserted, not when they are
+committed, so a slow transaction may commit an entry below seqs already
+read. get_changes therefore stops before a gap until the entry following it
+is CHANGE_FEED_SETTLE_SECONDS old. Gaps older than that come from rolled
+back transactions or compaction and are skipped. So write transactions have
+to commit within CHANGE_FEED_SETTLE_SECONDS: entries of a longer one
+are missed by readers which went past them meanwhile, and those readers
+have to resync in full to see its changes.
+
+compact() bounds the log. Entries older than CHANGE_LOG_COMPACT_AFTER that
+a later entry of the same object supersedes are dropped, which mirrors
+replaying the feed do not notice. Entries older than CHANGE_LOG_RETENTION
+are dropped altogether, clients behind them have to resync in full: note
+head_seq of the ResyncRequired, refetch everything, then read the feed
+after head_seq.
+"""
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, Max, OuterRef
+from django.utils import timezone
+
+from terminology.models import (
+    Change,
+    ChangeFeedState,
+    Handbook,
+    HandbookElement,
+    HandbookVersion,
+)
+
+ElementVersions = HandbookElement.handbook.through
+
+KIND_OF_MODEL = {
+    Handbook: Change.HANDBOOK,
+    HandbookVersion: Change.VERSION,
+    HandbookElement: Change.ELEMENT,
+}
+
+
+class ResyncRequired(Exception):
+    """
+    The requested changes were dropped by retention. Changes through
+    head_seq are committed, a full resync sees them.
+    """
+
+    def __init__(self, pruned_through, head_seq):
+        super().__init__(pruned_through, head_seq)
+        self.pruned_through = pruned_through
+        self.head_seq = head_seq
+
+
+def record_many(entries):
+    """Appends (kind, action, object_id, related_id) entries in bulk."""
+    now = timezone.now()
+    Change.objects.bulk_create(
+        (
+            Change(
+                created=now,
+                kind=kind,
+                action=action,
+                object_id=object_id,
+                related_id=related_id,
+            )
+            for kind, action, object_id, related_id in entries
+        ),
+        batch_size=settings.BULK_CREATE_BATCH_SIZE,
+    )
+
+
+def saved(sender, instance, created, **kwargs):
+    """post_save of Handbook, HandbookVersion and HandbookElement."""
+    action = Change.CREATED if created else Change.UPDATED
+    record_many([(KIND_OF_MODEL[sender], action, instance.pk, 0)])
+
+
+def deleted(sender, instance, **kwargs):
+    """post_delete of Handbook, HandbookVersion and HandbookElement."""
+    record_many([(KIND_OF_MODEL[sender], Change.DELETED, instance.pk, 0)])
+
+
+def membership_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """m2m_changed of HandbookElement.handbook."""
+    if action == "post_add":
+        change_action = Change.CREATED
+    elif action in ("post_remove", "pre_clear"):
+        change_action = Change.DELETED
+    else:
+        return
+    if action == "pre_clear":
+        if reverse:
+            pk_set = instance.handbookelement_set.values_list("id", flat=True)
+        else:
+            pk_set = instance.handbook.values_list("id", flat=True)
+    if reverse:
+        # instance is a version, pk_set are ids of elements
+        pairs = [(element_id, instance.pk) for element_id in pk_set]
+    else:
+        pairs = [(instance.pk, version_id) for version_id in pk_set]
+    record_many(
+        (Change.MEMBERSHIP, change_action, element_id, version_id)
+        for element_id, version_id in pairs
+    )
+
+
+def _pruned_through():
+    state = ChangeFeedState.objects.filter(id=1).first()
+    return state.pruned_through if state is not None else 0
+
+
+def _settled_before():
+    return timezone.now() - timedelta(seconds=settings.CHANGE_FEED_SETTLE_SECONDS)
+
+
+def _settled_head(pruned_through):
+    """Last seq of the entries old enough that no earlier one is in flight."""
+    last_settled = Change.objects.filter(created__lte=_settled_before()).aggregate(
+        seq=Max("seq")
+    )["seq"]
+    return max(pruned_through, last_settled or 0)
+
+
+def render(change):
+    record = {
+        "seq": change["seq"],
+        "kind": change["kind"],
+        "action": change["action"],
+        "id": change["object_id"],
+    }
+    if change["kind"] == Change.MEMBERSHIP:
+        record["version_id"] = change["related_id"]
+    return record
+
+
+def get_changes(since, limit):
+    """
+    Up to limit change records after seq since, in seq order, and whether
+    more may follow. Raises ResyncRequired when since is behind retention.
+    """
+    pruned_through = _pruned_through()
+    if since < pruned_through:
+        raise ResyncRequired(pruned_through, _settled_head(pruned_through))
+    rows = list(
+        Change.objects.filter(seq__gt=since)
+        .order_by("seq")
+        .values("seq", "created", "kind", "action", "object_id", "related_id")[
+            : limit + 1
+        ]
+    )
+    settled = _settled_before()
+    records = []
+    expected = since + 1
+    for row in rows[:limit]:
+        if row["seq"] != expected and row["created"] > settled:
+            # The missing seqs may belong to a transaction still in flight
+            return records, True
+        records.append(render(row))
+        expected = row["seq"] + 1
+    return records, len(rows) > limit
+
+
+def compact(now=None):
+    """Applies compaction and retention, returns (compacted, pruned) counts."""
+    now = now or timezone.now()
+    compact_before = now - timedelta(seconds=settings.CHANGE_LOG_COMPACT_AFTER)
+    retain_after = now - timedelta(seconds=settings.CHANGE_LOG_RETENTION)
+
+    superseded = Change.objects.filter(
+        kind=OuterRef("kind"),
+        object_id=OuterRef("object_id"),
+        related_id=OuterRef("related_id"),
+        seq__gt=OuterRef("seq"),
+        created__lt=compact_before,
+    )
+    with transaction.atomic():
+        compacted, _ = Change.objects.filter(
+            Exists(superseded), created__lt=compact_before
+        ).delete()
+
+        expired = Change.objects.filter(created__lt=retain_after)
+        last_expired = expired.aggregate(seq=Max("seq"))["seq"]
+        pruned = 0
+        if last_expired is not None:
+            state, _ = ChangeFeedState.objects.select_for_update().get_or_create(id=1)
+            state.pruned_through = max(state.pruned_through, last_expired)
+            state.save()
+            pruned, _ = Change.objects.filter(seq__lte=last_expired).delete()
+    return compacted, pruned
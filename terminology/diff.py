@@ -0,0 +1,107 @@
+"""
+Differences between two versions of a handbook, computed in the database.
+
+Elements linked to exactly one of the versions are found with EXISTS and NOT
+EXISTS on the through table, which PostgreSQL plans as semi and anti joins
+over the (version, element) index, and only they are read. Changes are matched by element_code:
+
+    added    linked to the new version only, no old-only element has its code
+    removed  linked to the old version only, no new-only element has its code
+    changed  linked to the new version only, old-only elements have its code
+             but not its value; they are reported as "previous"
+
+Elements linked to both versions never show up, so responses grow with the
+change rather than with the handbook.
+"""
+
+from django.db.models import Exists, OuterRef, Q
+
+from terminology.models import HandbookElement
+
+ElementVersions = HandbookElement.handbook.through
+
+ADDED = "added"
+REMOVED = "removed"
+CHANGED = "changed"
+
+DIFF_FIELDS = ("id", "element_code", "element_value", "in_new", "code_in_old")
+
+
+def _linked_to(*version_ids):
+    return Exists(
+        ElementVersions.objects.filter(
+            handbookelement_id=OuterRef("id"), handbookversion_id__in=version_ids
+        )
+    )
+
+
+def _only_in(version_id, other_version_id):
+    # NOT IN would not be planned as an anti join
+    return HandbookElement.objects.filter(
+        _linked_to(version_id), ~_linked_to(other_version_id)
+    )
+
+
+def version_diff(old_version_id, new_version_id):
+    """Queryset of changed element rows, see change_of for their kind."""
+    old_only = _only_in(old_version_id, new_version_id)
+    new_only = _only_in(new_version_id, old_version_id)
+    return (
+        HandbookElement.objects.filter(_linked_to(old_version_id, new_version_id))
+        .annotate(in_old=_linked_to(old_version_id), in_new=_linked_to(new_version_id))
+        .filter(Q(in_old=True, in_new=False) | Q(in_old=False, in_new=True))
+        .annotate(
+            code_in_old=Exists(old_only.filter(element_code=OuterRef("element_code"))),
+            code_in_new=Exists(new_only.filter(element_code=OuterRef("element_code"))),
+            same_in_old=Exists(
+                old_only.filter(
+                    element_code=OuterRef("element_code"),
+                    element_value=OuterRef("element_value"),
+                )
+            ),
+        )
+        .filter(Q(in_new=True, same_in_old=False) | Q(in_new=False, code_in_new=False))
+        .values(*DIFF_FIELDS)
+    )
+
+
+def change_of(row):
+    if not row["in_new"]:
+        return REMOVED
+    return CHANGED if row["code_in_old"] else ADDED
+
+
+def previous_elements(old_version_id, new_version_id, codes):
+    """Maps codes to [{id, element_value}] of their old-only elements."""
+    previous = {}
+    rows = (
+        _only_in(old_version_id, new_version_id)
+        .filter(element_code__in=codes)
+        .order_by("id")
+        .values_list("id", "element_code", "element_value")
+    )
+    for element_id, code, value in rows:
+        previous.setdefault(code, []).append({"id": element_id, "element_value": value})
+    return previous
+
+
+def render_changes(rows, old_version_id, new_version_id):
+    """Change dicts of a page of version_diff rows."""
+    changed_codes = {row["element_code"] for row in rows if change_of(row) == CHANGED}
+    previous = (
+        previous_elements(old_version_id, new_version_id, changed_codes)
+        if changed_codes
+        else {}
+    )
+    changes = []
+    for row in rows:
+        change = {
+            "change": change_of(row),
+            "id": row["id"],
+            "element_code": row["element_code"],
+            "element_value": row["element_value"],
+        }
+        if change["change"] == CHANGED:
+            change["previous"] = previous.get(row["element_code"], [])
+        changes.append(change)
+    return changes
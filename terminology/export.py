@@ -0,0 +1,55 @@
+"""
+Streaming encoders of element rows for full version exports.
+
+Rows are (id, element_code, element_value) tuples, normally read through a
+server-side cursor. Encoded lines are joined into chunks of roughly
+EXPORT_BUFFER_SIZE characters, so neither side holds more than a chunk.
+"""
+
+import csv
+import json
+
+from django.conf import settings
+
+FIELDS = ("id", "element_code", "element_value")
+
+
+class _Echo:
+    """File-like object handing back what csv.writer writes."""
+
+    def write(self, value):
+        return value
+
+
+def _buffered(lines):
+    buffer, size = [], 0
+    for line in lines:
+        buffer.append(line)
+        size += len(line)
+        if size >= settings.EXPORT_BUFFER_SIZE:
+            yield "".join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield "".join(buffer)
+
+
+def iter_ndjson(rows):
+    dumps = json.JSONEncoder(ensure_ascii=False, separators=(",", ":")).encode
+    return _buffered(dumps(dict(zip(FIELDS, row))) + "\n" for row in rows)
+
+
+def iter_csv(rows):
+    writer = csv.writer(_Echo())
+
+    def lines():
+        yield writer.writerow(FIELDS)
+        for row in rows:
+            yield writer.writerow(row)
+
+    return _buffered(lines())
+
+
+FORMATS = {
+    "ndjson": (iter_ndjson, "application/x-ndjson; charset=utf-8"),
+    "csv": (iter_csv, "text/csv; charset=utf-8"),
+}
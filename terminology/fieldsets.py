@@ -0,0 +1,116 @@
+"""
+Sparse fieldsets of handbook and version endpoints.
+
+The fields param is a comma separated list of fields to render, and
+relation.field names select fields of an embedded relation. The expand
+param lists the relations to embed. Without expand, the relations fields
+mentions are embedded, and without both params all of them are, as before.
+A relation that is not embedded renders as its id if it is a foreign key
+and is left out otherwise.
+
+Querysets load only the columns of the selected fields, and relations that
+are not embedded are neither joined nor prefetched.
+"""
+
+from dataclasses import dataclass, field
+
+from django.db.models import Prefetch
+
+from terminology.models import Handbook, HandbookVersion
+
+HANDBOOK_FIELDS = ("id", "name", "short_name", "description")
+VERSION_FIELDS = (
+    "id",
+    "handbook_identifier",
+    "version",
+    "starting_date",
+    "created",
+    "updated",
+)
+
+# Relations of the endpoints, {relation: fields of the related model}
+HANDBOOK_RELATIONS = {"versions": VERSION_FIELDS}
+VERSION_RELATIONS = {"handbook_identifier": HANDBOOK_FIELDS}
+
+
+@dataclass
+class Fieldset:
+    fields: frozenset
+    expand: dict = field(default_factory=dict)  # {relation: Fieldset}
+
+
+def _param_list(request, name):
+    if name not in request.GET:
+        return None
+    return [item.strip() for item in request.GET[name].split(",") if item.strip()]
+
+
+def parse_fieldset(request, field_names, relations=None):
+    """
+    Fieldset of the fields and expand params, raises ValueError on unknown
+    fields or relations.
+    """
+    relations = relations or {}
+    requested = _param_list(request, "fields")
+    expand = _param_list(request, "expand")
+
+    fields, nested = set(), {}
+    for name in requested if requested is not None else field_names:
+        relation, _, nested_name = name.partition(".")
+        if nested_name:
+            if nested_name not in relations.get(relation, ()):
+                raise ValueError(f"unknown field {name!r}")
+            nested.setdefault(relation, set()).add(nested_name)
+            fields.add(relation)
+        elif name in field_names or name in relations:
+            fields.add(name)
+        else:
+            raise ValueError(f"unknown field {name!r}")
+
+    if expand is None:
+        expand = relations if requested is None else fields & set(relations)
+    for relation in expand:
+        if relation not in relations:
+            raise ValueError(f"unknown relation {relation!r}")
+        fields.add(relation)
+    for relation in nested:
+        if relation not in expand:
+            raise ValueError(f"fields of {relation!r} need it expanded")
+
+    return Fieldset(
+        frozenset(fields),
+        {
+            relation: Fieldset(frozenset(nested.get(relation, relations[relation])))
+            for relation in expand
+        },
+    )
+
+
+def _columns(fieldset, field_names):
+    return ["id", *(name for name in field_names if name in fieldset.fields)]
+
+
+def handbooks_queryset(fieldset):
+    handbooks_qs = Handbook.objects.only(*_columns(fieldset, HANDBOOK_FIELDS))
+    versions = fieldset.expand.get("versions")
+    if versions is not None:
+        versions_qs = HandbookVersion.objects.order_by("id").only(
+            *_columns(versions, VERSION_FIELDS), "handbook_identifier"
+        )
+        handbooks_qs = handbooks_qs.prefetch_related(
+            Prefetch("versions", queryset=versions_qs)
+        )
+    return handbooks_qs
+
+
+def versions_queryset(versions_qs, fieldset):
+    # The foreign key is kept for select_related and keyset pagination
+    columns = _columns(fieldset, VERSION_FIELDS) + ["handbook_identifier"]
+    handbook = fieldset.expand.get("handbook_identifier")
+    if handbook is not None:
+        versions_qs = versions_qs.select_related("handbook_identifier")
+        columns += [
+            f"handbook_identifier__{name}"
+            for name in _columns(handbook, HANDBOOK_FIELDS)
+        ]
+    return versions_qs.only(*columns)
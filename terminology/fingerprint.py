@@ -0,0 +1,123 @@
+"""
+Content fingerprints of handbook versions for conditional GET.
+
+A fingerprint digests the elements of a version together with the versions
+each of them belongs to, i.e. everything element endpoints render. It is
+computed on first use and stored in HandbookVersion.fingerprint. Changes of
+elements or of their membership reset the stored fingerprint and bump
+HandbookVersion.updated of every affected version.
+"""
+
+import hashlib
+
+from django.conf import settings
+from django.dispatch import Signal
+from django.utils import timezone
+
+from terminology.models import HandbookElement, HandbookVersion
+
+ElementVersions = HandbookElement.handbook.through
+
+# Sent with version_ids whenever their content changes
+fingerprints_reset = Signal()
+
+
+def compute_fingerprint(version_id):
+    digest = hashlib.sha256()
+    chunk_size = settings.EXPORT_CHUNK_SIZE
+    elements_qs = (
+        HandbookElement.objects.filter(handbook__id=version_id)
+        .order_by("id")
+        .values_list("id", "element_code", "element_value")
+    )
+    for row in elements_qs.iterator(chunk_size=chunk_size):
+        digest.update(repr(row).encode())
+    links_qs = (
+        ElementVersions.objects.filter(handbookelement__handbook__id=version_id)
+        .order_by("handbookelement_id", "handbookversion_id")
+        .values_list("handbookelement_id", "handbookversion_id")
+    )
+    for row in links_qs.iterator(chunk_size=chunk_size):
+        digest.update(repr(row).encode())
+    return digest.hexdigest()
+
+
+def get_version_state(version_id):
+    """
+    (fingerprint, last modified) of a version, computing and storing a missing
+    fingerprint. Raises HandbookVersion.DoesNotExist for unknown ids.
+
+    A version which has started is last modified at its starting_date at the
+    earliest: "actual" endpoints serve it from then on instead of the version
+    before, whose updated may be later than that of this one.
+    """
+    fingerprint, updated, starting_date = HandbookVersion.objects.values_list(
+        "fingerprint", "updated", "starting_date"
+    ).get(id=version_id)
+    if not fingerprint:
+        fingerprint = compute_fingerprint(version_id)
+        # Skipped if elements changed while computing, next request retries.
+        HandbookVersion.objects.filter(
+            id=version_id, updated=updated, fingerprint=""
+        ).update(fingerprint=fingerprint)
+    if starting_date is not None and updated < starting_date <= timezone.now():
+        return fingerprint, starting_date
+    return fingerprint, updated
+
+
+def reset_fingerprints(version_ids):
+    version_ids = set(version_ids)
+    if version_ids:
+        HandbookVersion.objects.filter(id__in=version_ids).update(
+            fingerprint="", updated=timezone.now()
+        )
+        fingerprints_reset.send(sender=HandbookVersion, version_ids=version_ids)
+
+
+def reset_sharing_fingerprints(version_id):
+    """Resets the version and versions sharing elements with it."""
+    reset_fingerprints(
+        ElementVersions.objects.filter(
+            handbookelement_id__in=ElementVersions.objects.filter(
+                handbookversion_id=version_id
+            ).values("handbookelement_id")
+        )
+        .values_list("handbookversion_id", flat=True)
+        .distinct()
+    )
+
+
+def _versions_of_elements(element_ids):
+    return ElementVersions.objects.filter(
+        handbookelement_id__in=element_ids
+    ).values_list("handbookversion_id", flat=True)
+
+
+def element_changed(sender, instance, created=False, **kwargs):
+    """post_save/pre_delete of HandbookElement."""
+    if not created:
+        reset_fingerprints(_versions_of_elements([instance.id]))
+
+
+def membership_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """m2m_changed of HandbookElement.handbook."""
+    if action not in ("post_add", "post_remove", "pre_clear"):
+        return
+    if reverse:
+        # instance is a version, pk_set are ids of elements
+        if pk_set is None:
+            pk_set = instance.handbookelement_set.values_list("id", flat=True)
+        version_ids = set(_versions_of_elements(pk_set))
+        version_ids.add(instance.id)
+    else:
+        version_ids = set(_versions_of_elements([instance.id]))
+        version_ids.update(pk_set or ())
+    reset_fingerprints(version_ids)
+
+
+def version_deleted(sender, instance, **kwargs):
+    """pre_delete of HandbookVersion, shared elements lose it from their lists."""
+    element_ids = instance.handbookelement_set.values_list("id", flat=True)
+    version_ids = set(_versions_of_elements(element_ids))
+    version_ids.discard(instance.id)
+    reset_fingerprints(version_ids)
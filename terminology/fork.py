@@ -0,0 +1,101 @@
+"""
+Forking of handbook versions.
+
+A fork is a new version linked to the same element rows as its source, with
+a small patch applied on top. Links are copied by a single INSERT ... SELECT
+on the through table, so no element is read into Python or rewritten and
+the database copies index entries only.
+
+The change feed gets a version created entry for the fork and a membership
+created entry per copied link, appended by another INSERT ... SELECT in the
+same transaction, followed by membership entries of the patch.
+"""
+
+from django.db import connections, router, transaction
+from django.utils import timezone
+
+from terminology.bulk import bulk_create_elements
+from terminology.changes import record_many
+from terminology.fingerprint import reset_sharing_fingerprints
+from terminology.models import Change, HandbookElement
+
+ElementVersions = HandbookElement.handbook.through
+
+
+def copy_links(source_version_id, version_id, using):
+    """Links version_id to every element of source_version_id, returns the count."""
+    opts = ElementVersions._meta
+    connection = connections[using]
+    qn = connection.ops.quote_name
+    element_column = qn(opts.get_field("handbookelement").column)
+    version_column = qn(opts.get_field("handbookversion").column)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {qn(opts.db_table)} ({element_column}, {version_column}) "
+            f"SELECT {element_column}, %s FROM {qn(opts.db_table)} "
+            f"WHERE {version_column} = %s",
+            [version_id, source_version_id],
+        )
+        return cursor.rowcount
+
+
+def record_copied_links(version_id, using):
+    """Appends a membership created change per link of version_id."""
+    opts = ElementVersions._meta
+    connection = connections[using]
+    qn = connection.ops.quote_name
+    change_opts = Change._meta
+    change_columns = ", ".join(
+        qn(change_opts.get_field(name).column)
+        for name in ("created", "kind", "action", "object_id", "related_id")
+    )
+    element_column = qn(opts.get_field("handbookelement").column)
+    version_column = qn(opts.get_field("handbookversion").column)
+    created = connection.ops.adapt_datetimefield_value(timezone.now())
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {qn(change_opts.db_table)} ({change_columns}) "
+            f"SELECT %s, %s, %s, {element_column}, {version_column} "
+            f"FROM {qn(opts.db_table)} WHERE {version_column} = %s",
+            [created, Change.MEMBERSHIP, Change.CREATED, version_id],
+        )
+
+
+def unlink_codes(version_id, codes):
+    """Unlinks elements with the given codes from the version, returns the count."""
+    links = ElementVersions.objects.filter(
+        handbookversion_id=version_id, handbookelement__element_code__in=codes
+    )
+    element_ids = list(links.values_list("handbookelement_id", flat=True))
+    ElementVersions.objects.filter(
+        handbookversion_id=version_id, handbookelement_id__in=element_ids
+    ).delete()
+    record_many(
+        (Change.MEMBERSHIP, Change.DELETED, element_id, version_id)
+        for element_id in element_ids
+    )
+    return len(element_ids)
+
+
+def fork_version(source_version_id, version, add=(), remove=(), replace=()):
+    """
+    Saves the unsaved version as a fork of source_version_id and patches it.
+
+    add and replace are (element_code, element_value) pairs of new elements,
+    replace also unlinks the elements of their codes first. remove holds
+    codes to unlink. Returns counts of copied, removed and added links.
+    """
+    using = router.db_for_write(HandbookElement)
+    with transaction.atomic(using=using):
+        version.save(using=using)
+        copied = copy_links(source_version_id, version.id, using)
+        record_copied_links(version.id, using)
+
+        unlinked_codes = set(remove) | {code for code, _ in replace}
+        removed = unlink_codes(version.id, unlinked_codes) if unlinked_codes else 0
+        new_rows = [(code, value, [version.id]) for code, value in [*add, *replace]]
+        added = len(bulk_create_elements(new_rows)) if new_rows else 0
+
+        # Shared elements now list the fork among their versions
+        reset_sharing_fingerprints(version.id)
+    return {"copied": copied, "removed": removed, "added": added}
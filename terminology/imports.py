@@ -0,0 +1,397 @@
+"""
+Bulk import of handbook version releases, run by the import_handbook command.
+
+An import streams the elements of a CSV or NDJSON file, the formats element
+exports are written in, into StagedElement rows: by COPY on PostgreSQL and
+by chunked bulk_create elsewhere. Each chunk commits together with the
+count of staged rows of its ImportJob, so a failed run resumes after the
+last committed chunk.
+
+Staged rows are then merged in a single transaction, readers see the whole
+release or nothing of it:
+
+    1. the version is created unless it exists
+    2. elements of other versions of the handbook with a staged code and
+       value are linked to the version, as versions share unchanged elements
+    3. elements are created for the remaining staged rows and linked, by a
+       single statement with RETURNING on PostgreSQL and INSERT ... SELECT
+       statements elsewhere
+
+Merging is idempotent, rows already linked are skipped. The change feed gets
+entries of the created elements and links.
+"""
+
+import csv
+import gzip
+import io
+import itertools
+import json
+import os
+
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.db.models import (
+    CharField,
+    DateTimeField,
+    Exists,
+    IntegerField,
+    Max,
+    OuterRef,
+    Value,
+)
+from django.utils import timezone
+
+from terminology.fingerprint import reset_sharing_fingerprints
+from terminology.models import (
+    Change,
+    HandbookElement,
+    HandbookVersion,
+    ImportJob,
+    StagedElement,
+)
+
+ElementVersions = HandbookElement.handbook.through
+
+FORMATS = ("csv", "ndjson")
+EXTENSIONS = {".csv": "csv", ".ndjson": "ndjson", ".jsonl": "ndjson"}
+MAX_LENGTH = 255
+
+
+class InvalidRow(ValueError):
+    """A row of the imported file is not a valid element."""
+
+
+def format_of(path):
+    """Format named by the extension of path, ignoring a .gz suffix."""
+    root, extension = os.path.splitext(path)
+    if extension == ".gz":
+        root, extension = os.path.splitext(root)
+    return EXTENSIONS.get(extension)
+
+
+def _open(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8", newline="")
+    return open(path, encoding="utf-8", newline="")
+
+
+def _records(file, file_format):
+    if file_format == "csv":
+        yield from csv.DictReader(file)
+        return
+    for line in file:
+        if line.strip():
+            try:
+                yield json.loads(line)
+            except ValueError:
+                yield None
+
+
+def read_rows(path, file_format):
+    """
+    Iterates (element_code, element_value) of the rows of the file, raises
+    InvalidRow on the first invalid one. Other columns are ignored.
+    """
+    with _open(path) as file:
+        for number, record in enumerate(_records(file, file_format), 1):
+            try:
+                row = (record["element_code"], record["element_value"])
+            except (KeyError, TypeError):
+                raise InvalidRow(
+                    f"row {number}: element_code and element_value expected"
+                )
+            for value in row:
+                if not isinstance(value, str) or not 0 < len(value) <= MAX_LENGTH:
+                    raise InvalidRow(
+                        f"row {number}: expected strings of 1 to {MAX_LENGTH} characters"
+                    )
+            yield row
+
+
+def get_job(handbook_id, version, path, starting_date=None, restart=False):
+    """
+    Unfinished job importing path into the version, a new one without it.
+    Raises ValueError when the file changed since the job started, restart
+    drops the job instead.
+    """
+    source = os.path.abspath(path)
+    size = os.path.getsize(path)
+    job = ImportJob.objects.filter(
+        handbook_id=handbook_id, version=version, source=source, finished=None
+    ).first()
+    if job is not None and (restart or job.source_size != size):
+        if not restart:
+            raise ValueError(f"{path} changed since the import started")
+        job.delete()
+        job = None
+    if job is None:
+        job = ImportJob.objects.create(
+            handbook_id=handbook_id,
+            version=version,
+            starting_date=starting_date,
+            source=source,
+            source_size=size,
+        )
+    return job
+
+
+def _copy_staged(job, rows, first_row, using):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for number, (code, value) in enumerate(rows, first_row):
+        writer.writerow((job.id, number, code, value))
+    buffer.seek(0)
+
+    opts = StagedElement._meta
+    connection = connections[using]
+    qn = connection.ops.quote_name
+    columns = ", ".join(
+        qn(opts.get_field(name).column)
+        for name in ("job", "row", "element_code", "element_value")
+    )
+    with connection.cursor() as cursor:
+        cursor.copy_expert(
+            f"COPY {qn(opts.db_table)} ({columns}) FROM STDIN WITH (FORMAT csv)",
+            buffer,
+        )
+
+
+def stage(job, rows, chunk_size=None, progress=None):
+    """
+    Stages the rows of the file not staged by earlier runs of the job.
+    progress is called with the count of staged rows after each chunk.
+    """
+    chunk_size = chunk_size or settings.IMPORT_CHUNK_SIZE
+    using = router.db_for_write(StagedElement)
+    use_copy = connections[using].vendor == "postgresql"
+    rows = itertools.islice(rows, job.staged_rows, None)
+    while True:
+        chunk = list(itertools.islice(rows, chunk_size))
+        if not chunk:
+            return
+        first_row = job.staged_rows + 1
+        with transaction.atomic(using=using):
+            if use_copy:
+                _copy_staged(job, chunk, first_row, using)
+            else:
+                StagedElement.objects.using(using).bulk_create(
+                    StagedElement(
+                        job=job, row=number, element_code=code, element_value=value
+                    )
+                    for number, (code, value) in enumerate(chunk, first_row)
+                )
+            job.staged_rows += len(chunk)
+            job.save(using=using, update_fields=["staged_rows"])
+        if progress is not None:
+            progress(job.staged_rows)
+
+
+def _insert_select(model, columns, queryset, using):
+    """INSERT INTO the model table SELECT the queryset, returns the row count."""
+    opts = model._meta
+    connection = connections[using]
+    qn = connection.ops.quote_name
+    sql, params = queryset.query.get_compiler(using).as_sql()
+    column_list = ", ".join(qn(opts.get_field(name).column) for name in columns)
+    with connection.cursor() as cursor:
+        cursor.execute(f"INSERT INTO {qn(opts.db_table)} ({column_list}) {sql}", params)
+        return cursor.rowcount
+
+
+def _reusable(job, version_id):
+    """Elements of other versions of the handbook with staged codes and values."""
+    staged = StagedElement.objects.filter(job=job)
+    return HandbookElement.objects.filter(
+        Exists(
+            staged.filter(
+                element_code=OuterRef("element_code"),
+                element_value=OuterRef("element_value"),
+            )
+        ),
+        Exists(
+            ElementVersions.objects.filter(
+                handbookelement_id=OuterRef("id"),
+                handbookversion__handbook_identifier=job.handbook_id,
+            )
+        ),
+        ~Exists(
+            ElementVersions.objects.filter(
+                handbookelement_id=OuterRef("id"), handbookversion_id=version_id
+            )
+        ),
+        # Looked up by element code first, instead of scanning all elements
+        element_code__in=staged.values("element_code"),
+    )
+
+
+def _link_existing(job, version_id, using):
+    reusable = _reusable(job, version_id).annotate(
+        created=Value(timezone.now(), output_field=DateTimeField()),
+        kind=Value(Change.MEMBERSHIP, output_field=CharField()),
+        action=Value(Change.CREATED, output_field=CharField()),
+        version_id=Value(version_id, output_field=IntegerField()),
+    )
+    # Fields are selected before annotations, columns follow that order
+    _insert_select(
+        Change,
+        ("object_id", "created", "kind", "action", "related_id"),
+        reusable.values_list("id", "created", "kind", "action", "version_id"),
+        using,
+    )
+    return _insert_select(
+        ElementVersions,
+        ("handbookelement", "handbookversion"),
+        reusable.values_list("id", "version_id"),
+        using,
+    )
+
+
+def _unlinked(job, version_id):
+    """Staged rows without an element of their code and value in the version."""
+    in_version = ElementVersions.objects.filter(
+        handbookelement_id=OuterRef("id"), handbookversion_id=version_id
+    )
+    # Looked up by element code first, versions can have millions of links
+    return StagedElement.objects.filter(job=job).filter(
+        ~Exists(
+            HandbookElement.objects.filter(
+                Exists(in_version),
+                element_code=OuterRef("element_code"),
+                element_value=OuterRef("element_value"),
+            )
+        )
+    )
+
+
+def _create_linked_returning(job, version_id, using):
+    """Creates, links and records elements of unlinked rows in one statement."""
+    unlinked = (
+        _unlinked(job, version_id)
+        .values_list("element_code", "element_value")
+        .distinct()
+    )
+    sql, params = unlinked.query.get_compiler(using).as_sql()
+    connection = connections[using]
+    qn = connection.ops.quote_name
+    elements = HandbookElement._meta
+    links = ElementVersions._meta
+    changes = Change._meta
+    element_columns = ", ".join(
+        qn(elements.get_field(name).column)
+        for name in ("element_code", "element_value")
+    )
+    element_column = qn(links.get_field("handbookelement").column)
+    change_columns = ", ".join(
+        qn(changes.get_field(name).column)
+        for name in ("created", "kind", "action", "object_id", "related_id")
+    )
+    now = timezone.now()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"WITH new_elements AS ("
+            f"INSERT INTO {qn(elements.db_table)} ({element_columns}) {sql} "
+            f"RETURNING {qn('id')}"
+            f"), new_links AS ("
+            f"INSERT INTO {qn(links.db_table)} "
+            f"({element_column}, {qn(links.get_field('handbookversion').column)}) "
+            f"SELECT {qn('id')}, %s FROM new_elements RETURNING {element_column}"
+            f") INSERT INTO {qn(changes.db_table)} ({change_columns}) "
+            f"SELECT %s, %s, %s, {qn('id')}, 0 FROM new_elements "
+            f"UNION ALL SELECT %s, %s, %s, {element_column}, %s FROM new_links",
+            [
+                *params,
+                version_id,
+                now,
+                Change.ELEMENT,
+                Change.CREATED,
+                now,
+                Change.MEMBERSHIP,
+                Change.CREATED,
+                version_id,
+            ],
+        )
+        return cursor.rowcount // 2
+
+
+def _create_linked_select(job, version_id, using):
+    # Without RETURNING, created elements are told by their ids and by having
+    # no links yet. The merge transaction has written already, so on SQLite
+    # no other writer inserts in between.
+    last_id = HandbookElement.objects.using(using).aggregate(Max("id"))["id__max"] or 0
+    created = _insert_select(
+        HandbookElement,
+        ("element_code", "element_value"),
+        _unlinked(job, version_id)
+        .values_list("element_code", "element_value")
+        .distinct(),
+        using,
+    )
+    new_elements = HandbookElement.objects.filter(
+        Exists(
+            StagedElement.objects.filter(
+                job=job,
+                element_code=OuterRef("element_code"),
+                element_value=OuterRef("element_value"),
+            )
+        ),
+        ~Exists(ElementVersions.objects.filter(handbookelement_id=OuterRef("id"))),
+        id__gt=last_id,
+    ).annotate(
+        created=Value(timezone.now(), output_field=DateTimeField()),
+        element=Value(Change.ELEMENT, output_field=CharField()),
+        membership=Value(Change.MEMBERSHIP, output_field=CharField()),
+        action=Value(Change.CREATED, output_field=CharField()),
+        no_id=Value(0, output_field=IntegerField()),
+        version_id=Value(version_id, output_field=IntegerField()),
+    )
+    change_columns = ("object_id", "created", "kind", "action", "related_id")
+    _insert_select(
+        Change,
+        change_columns,
+        new_elements.values_list("id", "created", "element", "action", "no_id"),
+        using,
+    )
+    _insert_select(
+        Change,
+        change_columns,
+        new_elements.values_list("id", "created", "membership", "action", "version_id"),
+        using,
+    )
+    _insert_select(
+        ElementVersions,
+        ("handbookelement", "handbookversion"),
+        new_elements.values_list("id", "version_id"),
+        using,
+    )
+    return created
+
+
+def merge(job):
+    """
+    Merges the staged rows of the job into its version and finishes the job.
+    Returns the counts of linked existing and created elements.
+    """
+    using = router.db_for_write(HandbookElement)
+    with transaction.atomic(using=using):
+        version = HandbookVersion.objects.filter(
+            handbook_identifier_id=job.handbook_id, version=job.version
+        ).first()
+        if version is None:
+            version = HandbookVersion(
+                handbook_identifier_id=job.handbook_id, version=job.version
+            )
+            if job.starting_date is not None:
+                version.starting_date = job.starting_date
+            version.save(using=using)
+
+        linked = _link_existing(job, version.id, using)
+        if connections[using].vendor == "postgresql":
+            created = _create_linked_returning(job, version.id, using)
+        else:
+            created = _create_linked_select(job, version.id, using)
+        reset_sharing_fingerprints(version.id)
+
+        StagedElement.objects.using(using).filter(job=job).delete()
+        job.finished = timezone.now()
+        job.save(using=using, update_fields=["finished"])
+    return {"version_id": version.id, "linked": linked, "created": created}
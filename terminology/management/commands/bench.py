@@ -0,0 +1,99 @@
+import json
+import resource
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test.runner import DiscoverRunner
+
+from terminology import bench, warmup
+
+
+class Command(BaseCommand):
+    help = (
+        "Seeds a synthetic dataset into a fresh test database and benchmarks "
+        "every endpoint through the test client. Prints JSON results, fails "
+        "when they regress from a --baseline result."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--handbooks", type=int, default=10)
+        parser.add_argument("--versions", type=int, default=3)
+        parser.add_argument(
+            "--elements", type=int, default=1000, help="Elements per version."
+        )
+        parser.add_argument(
+            "--shared",
+            type=float,
+            default=0.5,
+            help="Fraction of elements a version shares with its predecessor.",
+        )
+        parser.add_argument(
+            "--requests", type=int, default=50, help="Timed requests per endpoint."
+        )
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--output", help="Also write the results to this file.")
+        parser.add_argument("--baseline", help="Results file to compare with.")
+        parser.add_argument(
+            "--tolerance",
+            type=float,
+            default=0.25,
+            help="Allowed fraction of p50 and memory growth over the baseline.",
+        )
+
+    def handle(self, *args, **options):
+        if options["handbooks"] < 1 or options["versions"] < 1:
+            raise CommandError("--handbooks and --versions must be positive")
+        if options["elements"] < 1 or not 0 <= options["shared"] < 1:
+            raise CommandError("--elements must be positive, --shared in [0, 1)")
+        baseline = None
+        if options["baseline"]:
+            with open(options["baseline"]) as f:
+                baseline = json.load(f)
+
+        runner = DiscoverRunner(verbosity=0, interactive=False)
+        runner.setup_test_environment()
+        old_config = runner.setup_databases()
+        try:
+            results = self.run_bench(options)
+        finally:
+            runner.teardown_databases(old_config)
+            runner.teardown_test_environment()
+
+        output = json.dumps(results, indent=2)
+        self.stdout.write(output)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(output)
+
+        if baseline is not None:
+            if baseline["dataset"] != results["dataset"]:
+                raise CommandError("The baseline was measured on another dataset")
+            regressions = bench.find_regressions(
+                results, baseline, options["tolerance"]
+            )
+            if regressions:
+                raise CommandError("Regressions:\n" + "\n".join(regressions))
+
+    def run_bench(self, options):
+        dataset = bench.seed_dataset(
+            options["handbooks"],
+            options["versions"],
+            options["elements"],
+            options["shared"],
+        )
+        warmup.warm_up()
+        cases = bench.build_cases(dataset, options["seed"])
+        endpoints = bench.run_cases(cases, options["requests"])
+        return {
+            "dataset": {
+                "handbooks": options["handbooks"],
+                "versions": options["versions"],
+                "elements": options["elements"],
+                "shared": options["shared"],
+                "element_rows": dataset.element_rows,
+                "seed": options["seed"],
+            },
+            "requests": options["requests"],
+            "endpoints": endpoints,
+            "uncovered": bench.uncovered_routes(cases),
+            "max_rss_kib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        }
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from terminology import changes
+
+
+class Command(BaseCommand):
+    help = (
+        "Drops superseded changes older than CHANGE_LOG_COMPACT_AFTER and all "
+        "changes older than CHANGE_LOG_RETENTION from the change feed. Meant "
+        "to run periodically, e.g. daily from cron."
+    )
+
+    def handle(self, *args, **options):
+        compacted, pruned = changes.compact()
+        self.stdout.write(f"Compacted {compacted} changes, pruned {pruned}")
@@ -0,0 +1,96 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+
+from terminology import imports
+from terminology.models import Handbook
+
+
+class Command(BaseCommand):
+    help = (
+        "Imports the elements of a handbook version from a CSV or NDJSON file, "
+        "optionally gzipped, with element_code and element_value columns. "
+        "Creates the version unless it exists. A failed import resumes where "
+        "it stopped when run again with the same arguments."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path")
+        parser.add_argument("--handbook", type=int, required=True, help="Handbook id.")
+        parser.add_argument("--handbook-version", required=True, help="Version name.")
+        parser.add_argument(
+            "--starting-date", help="Starting date of a created version, ISO 8601."
+        )
+        parser.add_argument(
+            "--format",
+            choices=imports.FORMATS,
+            help="File format, by default named by the file extension.",
+        )
+        parser.add_argument("--chunk-size", type=int, help="Rows per round trip.")
+        parser.add_argument(
+            "--restart",
+            action="store_true",
+            help="Drops rows staged by an unfinished import of the file.",
+        )
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        file_format = options["format"] or imports.format_of(path)
+        if file_format is None:
+            raise CommandError("Unknown file format, pass --format")
+        starting_date = None
+        if options["starting_date"]:
+            starting_date = parse_datetime(options["starting_date"])
+            if starting_date is None:
+                raise CommandError("--starting-date is not a valid datetime")
+        if not Handbook.objects.filter(id=options["handbook"]).exists():
+            raise CommandError(f"No handbook {options['handbook']}")
+
+        try:
+            job = imports.get_job(
+                options["handbook"],
+                options["handbook_version"],
+                path,
+                starting_date,
+                options["restart"],
+            )
+        except OSError as e:
+            raise CommandError(e)
+        except ValueError as e:
+            raise CommandError(f"{e}, pass --restart to import it anew")
+        if job.staged_rows:
+            self.stdout.write(f"Resuming after {job.staged_rows} staged rows")
+
+        start = time.perf_counter()
+        resumed_from = job.staged_rows
+
+        def progress(staged_rows):
+            rate = (staged_rows - resumed_from) / (time.perf_counter() - start)
+            self.stdout.write(f"Staged {staged_rows} rows, {rate:.0f} rows/s")
+
+        try:
+            imports.stage(
+                job,
+                imports.read_rows(path, file_format),
+                options["chunk_size"],
+                progress,
+            )
+        except imports.InvalidRow as e:
+            raise CommandError(f"{path}: {e}")
+
+        merge_start = time.perf_counter()
+        result = imports.merge(job)
+        merge_seconds = time.perf_counter() - merge_start
+        self.stdout.write(
+            f"Merged {job.staged_rows} rows into version {result['version_id']} "
+            f"in {merge_seconds:.1f}s: {result['linked']} "
+            f"elements of other versions linked, {result['created']} created"
+        )
+        if merge_seconds > settings.CHANGE_FEED_SETTLE_SECONDS:
+            self.stderr.write(
+                f"The merge took longer than CHANGE_FEED_SETTLE_SECONDS, change "
+                f"feed readers may have skipped its changes. Resync mirrors of "
+                f"handbook {job.handbook_id} in full."
+            )
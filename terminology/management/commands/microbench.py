@@ -0,0 +1,67 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from terminology.benchmarks import BENCHMARKS, DEFAULT_SIZES
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs an in-process microbenchmark over growing problem sizes. "
+        "The ns/item column staying flat means linear scaling."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("benchmark", choices=sorted(BENCHMARKS))
+        parser.add_argument(
+            "--sizes",
+            help=(
+                "Comma separated problem sizes, 10000,20000,40000,80000 for "
+                "most benchmarks."
+            ),
+        )
+        parser.add_argument("--json", action="store_true", help="Print JSON.")
+        parser.add_argument(
+            "--max-ms",
+            type=float,
+            help="Fail when a result takes longer per item, e.g. per search query.",
+        )
+
+    def handle(self, *args, **options):
+        name = options["benchmark"]
+        if options["sizes"] is None:
+            sizes = DEFAULT_SIZES.get(name, (10000, 20000, 40000, 80000))
+        else:
+            try:
+                sizes = [int(size) for size in options["sizes"].split(",")]
+            except ValueError:
+                raise CommandError("--sizes must be comma separated integers")
+
+        try:
+            results = BENCHMARKS[name](sizes)
+        except RuntimeError as e:
+            raise CommandError(e)
+
+        if options["json"]:
+            self.stdout.write(json.dumps(results, indent=2))
+        else:
+            self.print_table(results)
+
+        if options["max_ms"] is not None:
+            slow = []
+            for result in results:
+                ms = result["seconds"] * 1e3 / result.get("items", result["size"])
+                if ms > options["max_ms"]:
+                    slow.append(f"{result['variant']} {result['size']}: {ms:.2f} ms")
+            if slow:
+                raise CommandError("Slower than --max-ms per item:\n" + "\n".join(slow))
+
+    def print_table(self, results):
+        self.stdout.write(f"{'variant':<16}{'size':>10}{'ms':>12}{'ns/item':>12}")
+        for result in results:
+            items = result.get("items", result["size"])
+            self.stdout.write(
+                f"{result['variant']:<16}{result['size']:>10}"
+                f"{result['seconds'] * 1e3:>12.2f}"
+                f"{result['seconds'] * 1e9 / items:>12.1f}"
+            )
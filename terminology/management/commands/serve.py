@@ -0,0 +1,102 @@
+import multiprocessing
+
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand
+from django.core.wsgi import get_wsgi_application
+from django.db import connections
+from gunicorn.app.base import BaseApplication
+
+from terminology import warmup
+
+
+class Server(BaseApplication):
+    """
+    gunicorn application loading and warming Django once in the master.
+
+    Workers are forked from the warmed master. On SIGHUP the master warms up
+    again and replaces workers gracefully, e.g. to refresh snapshots. Code is
+    not reloaded by SIGHUP, deploy new code with SIGUSR2 followed by SIGTERM
+    to the old master.
+    """
+
+    def __init__(self, options, asgi, warm_versions, stdout):
+        self.options = options
+        self.asgi = asgi
+        self.warm_versions = warm_versions
+        self.stdout = stdout
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+        self.cfg.set("preload_app", True)
+        self.cfg.set("on_reload", lambda arbiter: self.warm_up())
+
+    def load(self):
+        if self.asgi:
+            application = get_asgi_application()
+        else:
+            application = get_wsgi_application()
+        self.warm_up()
+        return application
+
+    def warm_up(self):
+        summary = warmup.warm_up(self.warm_versions)
+        # Workers must not share the master's connections
+        connections.close_all()
+        self.stdout.write(
+            f"Warmed up {summary['versions']} versions " f"in {summary['seconds']:.2f}s"
+        )
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs the pre-forking gunicorn server. The app is loaded and warmed up "
+        "once before workers are forked, /ready/ answers 200 after warm-up."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--bind", default="0.0.0.0:8000")
+        parser.add_argument("--workers", type=int, default=multiprocessing.cpu_count())
+        parser.add_argument(
+            "--worker-class",
+            default="uvicorn.workers.UvicornWorker",
+            help="gunicorn worker class, sync serves WSGI without /async/ gains.",
+        )
+        parser.add_argument("--timeout", type=int, default=30)
+        parser.add_argument(
+            "--graceful-timeout",
+            type=int,
+            default=30,
+            help="Seconds workers get to finish requests on reload and stop.",
+        )
+        parser.add_argument(
+            "--max-requests",
+            type=int,
+            default=0,
+            help="Replace workers after this many requests, 0 disables.",
+        )
+        parser.add_argument(
+            "--warm-versions",
+            type=int,
+            default=None,
+            help="Versions in effect to warm up, defaults to WARMUP_VERSIONS.",
+        )
+
+    def handle(self, *args, **options):
+        worker_class = options["worker_class"]
+        server_options = {
+            "bind": options["bind"],
+            "workers": options["workers"],
+            "worker_class": worker_class,
+            "timeout": options["timeout"],
+            "graceful_timeout": options["graceful_timeout"],
+            "max_requests": options["max_requests"],
+            "max_requests_jitter": options["max_requests"] // 10,
+        }
+        Server(
+            server_options,
+            asgi="uvicorn" in worker_class,
+            warm_versions=options["warm_versions"],
+            stdout=self.stdout,
+        ).run()
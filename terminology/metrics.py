@@ -0,0 +1,286 @@
+"""
+Per-route request metrics in the Prometheus text format.
+
+MetricsMiddleware records latency, status, response size, and the number and
+duration of database queries of every request, keyed by the URL route
+pattern. Queries are counted by an execute wrapper installed on every
+database connection. The wrapper finds the current request through a
+context variable, which asgiref hands over to the threads async views run
+their ORM work in.
+
+Each thread aggregates into its own table without locking. Tables are only
+merged when /metrics is rendered. Metrics are per process: with several
+server workers, each scrape sees the worker that answered it.
+"""
+
+import asyncio
+import bisect
+import contextvars
+import threading
+import time
+
+from django.conf import settings
+
+from terminology.snapshots import snapshot_store
+
+UNMATCHED_ROUTE = "<unmatched>"
+
+_current = contextvars.ContextVar("terminology_request_metrics", default=None)
+
+
+class RequestMetrics:
+    __slots__ = ("queries", "db_seconds")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+
+
+class RouteStats:
+    __slots__ = ("buckets", "count", "seconds", "queries", "db_seconds", "bytes")
+
+    def __init__(self, bucket_count):
+        self.buckets = [0] * bucket_count  # the last one is +Inf
+        self.count = 0
+        self.seconds = 0.0
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.bytes = 0
+
+
+class Registry:
+    def __init__(self, bounds):
+        self.bounds = tuple(bounds)
+        self._local = threading.local()
+        self._tables = []  # per thread {(route, method): RouteStats}
+        self._statuses = []  # per thread {(route, method, status): count}
+        self._lock = threading.Lock()  # taken once per thread
+
+    def _thread_tables(self):
+        try:
+            return self._local.tables
+        except AttributeError:
+            tables = ({}, {})
+            with self._lock:
+                self._tables.append(tables[0])
+                self._statuses.append(tables[1])
+            self._local.tables = tables
+            return tables
+
+    def record(self, route, method, status, seconds, request_metrics, size):
+        table, statuses = self._thread_tables()
+        key = (route, method)
+        stats = table.get(key)
+        if stats is None:
+            stats = table[key] = RouteStats(len(self.bounds) + 1)
+        stats.buckets[bisect.bisect_left(self.bounds, seconds)] += 1
+        stats.count += 1
+        stats.seconds += seconds
+        stats.queries += request_metrics.queries
+        stats.db_seconds += request_metrics.db_seconds
+        stats.bytes += size
+        status_key = (route, method, status)
+        statuses[status_key] = statuses.get(status_key, 0) + 1
+
+    def collect(self):
+        """Merged ({(route, method): RouteStats}, {(route, method, status): n})."""
+        with self._lock:
+            tables, status_tables = list(self._tables), list(self._statuses)
+        merged, statuses = {}, {}
+        for table in tables:
+            for key, stats in list(table.items()):
+                total = merged.get(key)
+                if total is None:
+                    total = merged[key] = RouteStats(len(self.bounds) + 1)
+                for i, count in enumerate(stats.buckets):
+                    total.buckets[i] += count
+                total.count += stats.count
+                total.seconds += stats.seconds
+                total.queries += stats.queries
+                total.db_seconds += stats.db_seconds
+                total.bytes += stats.bytes
+        for table in status_tables:
+            for key, count in list(table.items()):
+                statuses[key] = statuses.get(key, 0) + count
+        return merged, statuses
+
+    def clear(self):
+        with self._lock:
+            for table in self._tables + self._statuses:
+                table.clear()
+
+
+registry = Registry(settings.METRICS_LATENCY_BUCKETS)
+
+
+def count_queries(execute, sql, params, many, context):
+    request_metrics = _current.get()
+    if request_metrics is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        request_metrics.db_seconds += time.perf_counter() - start
+        request_metrics.queries += 1
+
+
+def install_query_counter(sender, connection, **kwargs):
+    """connection_created handler."""
+    if count_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_queries)
+
+
+def _route(request):
+    match = request.resolver_match
+    return match.route if match is not None else UNMATCHED_ROUTE
+
+
+def _record_streaming(response, request, start, request_metrics):
+    # Streams are consumed after the middleware returns, record at their end
+    content = response.streaming_content
+
+    def counted():
+        size = 0
+        _current.set(request_metrics)
+        try:
+            for chunk in content:
+                size += len(chunk)
+                yield chunk
+        finally:
+            _current.set(None)
+            registry.record(
+                _route(request),
+                request.method,
+                response.status_code,
+                time.perf_counter() - start,
+                request_metrics,
+                size,
+            )
+
+    response.streaming_content = counted()
+
+
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = settings.METRICS_ENABLED
+        if asyncio.iscoroutinefunction(get_response):
+            # Marks the instance as a coroutine function for Django
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        if not self.enabled:
+            return self.get_response(request)
+        request_metrics = RequestMetrics()
+        _current.set(request_metrics)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.set(None)
+        self.record(request, response, start, request_metrics)
+        return response
+
+    async def __acall__(self, request):
+        if not self.enabled:
+            return await self.get_response(request)
+        request_metrics = RequestMetrics()
+        _current.set(request_metrics)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.set(None)
+        self.record(request, response, start, request_metrics)
+        return response
+
+    def record(self, request, response, start, request_metrics):
+        if response.streaming:
+            _record_streaming(response, request, start, request_metrics)
+            return
+        registry.record(
+            _route(request),
+            request.method,
+            response.status_code,
+            time.perf_counter() - start,
+            request_metrics,
+            len(response.content),
+        )
+
+
+def _labels(**labels):
+    escaped = (
+        (name, str(value).replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n"))
+        for name, value in labels.items()
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+def _format_bound(bound):
+    return repr(float(bound))
+
+
+def render():
+    """Metrics of this process in the Prometheus text exposition format."""
+    merged, statuses = registry.collect()
+    lines = [
+        "# HELP terminology_request_duration_seconds Request latency.",
+        "# TYPE terminology_request_duration_seconds histogram",
+    ]
+    for (route, method), stats in sorted(merged.items()):
+        cumulative = 0
+        bounds = [_format_bound(b) for b in registry.bounds] + ["+Inf"]
+        for bound, count in zip(bounds, stats.buckets):
+            cumulative += count
+            labels = _labels(route=route, method=method, le=bound)
+            lines.append(
+                f"terminology_request_duration_seconds_bucket{labels} {cumulative}"
+            )
+        labels = _labels(route=route, method=method)
+        lines.append(
+            f"terminology_request_duration_seconds_sum{labels} {stats.seconds}"
+        )
+        lines.append(
+            f"terminology_request_duration_seconds_count{labels} {stats.count}"
+        )
+
+    lines += [
+        "# HELP terminology_requests_total Requests by response status.",
+        "# TYPE terminology_requests_total counter",
+    ]
+    for (route, method, status), count in sorted(statuses.items()):
+        labels = _labels(route=route, method=method, status=status)
+        lines.append(f"terminology_requests_total{labels} {count}")
+
+    counters = (
+        ("request_queries_total", "Database queries of requests.", "queries"),
+        ("request_db_seconds_total", "Database time of requests.", "db_seconds"),
+        ("response_bytes_total", "Response body bytes.", "bytes"),
+    )
+    for name, help_text, attribute in counters:
+        lines.append(f"# HELP terminology_{name} {help_text}")
+        lines.append(f"# TYPE terminology_{name} counter")
+        for (route, method), stats in sorted(merged.items()):
+            labels = _labels(route=route, method=method)
+            lines.append(f"terminology_{name}{labels} {getattr(stats, attribute)}")
+
+    snapshot_stats = snapshot_store.stats()
+    snapshot_metrics = (
+        ("snapshot_hits_total", "counter", "hits"),
+        ("snapshot_misses_total", "counter", "misses"),
+        ("snapshot_evictions_total", "counter", "evictions"),
+        ("snapshot_bytes", "gauge", "bytes"),
+        ("snapshot_max_bytes", "gauge", "max_bytes"),
+        ("snapshots", "gauge", "snapshots"),
+        ("snapshots_too_large", "gauge", "too_large"),
+    )
+    for name, metric_type, key in snapshot_metrics:
+        lines.append(f"# TYPE terminology_{name} {metric_type}")
+        lines.append(f"terminology_{name} {snapshot_stats[key]}")
+    return "\n".join(lines) + "\n"
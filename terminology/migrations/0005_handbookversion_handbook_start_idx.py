@@ -0,0 +1,17 @@
+# Generated by Django 3.2.4 on 2026-10-17 00:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('terminology', '0004_handbookversion_starting_date'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='handbookversion',
+            index=models.Index(fields=['handbook_identifier', 'starting_date'], name='version_handbook_start_idx'),
+        ),
+    ]
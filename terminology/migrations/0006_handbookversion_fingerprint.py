@@ -0,0 +1,18 @@
+# Generated by Django 3.2.4 on 2026-10-17 01:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('terminology', '0005_handbookversion_handbook_start_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='handbookversion',
+            name='fingerprint',
+            field=models.CharField(blank=True, default='', editable=False, max_length=64),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 3.2.4 on 2026-10-17 01:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('terminology', '0006_handbookversion_fingerprint'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='handbookelement',
+            index=models.Index(fields=['element_code', 'id'], name='element_code_idx'),
+        ),
+        # Auto-created through table has no Meta, so the index is created by hand.
+        # Covers version -> elements joins with an index-only scan.
+        migrations.RunSQL(
+            sql='CREATE INDEX element_handbook_version_idx '
+                'ON terminology_handbookelement_handbook (handbookversion_id, handbookelement_id)',
+            reverse_sql='DROP INDEX element_handbook_version_idx',
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 3.2.4 on 2026-10-17 01:20
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('terminology', '0007_element_code_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Change',
+            fields=[
+                ('seq', models.BigAutoField(primary_key=True, serialize=False, verbose_name='Номер')),
+                ('created', models.DateTimeField(db_index=True, default=django.utils.timezone.now, verbose_name='Время')),
+                ('kind', models.CharField(choices=[('handbook', 'Справочник'), ('version', 'Версия'), ('element', 'Элемент'), ('membership', 'Элемент версии')], max_length=16, verbose_name='Тип объекта')),
+                ('action', models.CharField(choices=[('created', 'Создан'), ('updated', 'Изменён'), ('deleted', 'Удалён')], max_length=16, verbose_name='Действие')),
+                ('object_id', models.BigIntegerField(verbose_name='Идентификатор объекта')),
+                ('related_id', models.BigIntegerField(default=0, verbose_name='Идентификатор версии')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ChangeFeedState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('pruned_through', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='change',
+            index=models.Index(fields=['kind', 'object_id', 'related_id', 'seq'], name='change_object_idx'),
+        ),
+    ]
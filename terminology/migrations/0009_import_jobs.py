@@ -0,0 +1,47 @@
+# Generated by Django 3.2.4 on 2026-10-17 01:29
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('terminology', '0008_change_feed'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.CharField(max_length=255, verbose_name='Версия')),
+                ('starting_date', models.DateTimeField(null=True, verbose_name='Дата начала')),
+                ('source', models.CharField(max_length=1024, verbose_name='Файл')),
+                ('source_size', models.BigIntegerField(verbose_name='Размер файла')),
+                ('staged_rows', models.BigIntegerField(default=0, verbose_name='Загружено строк')),
+                ('started', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Начат')),
+                ('finished', models.DateTimeField(null=True, verbose_name='Завершён')),
+                ('handbook', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='terminology.handbook', verbose_name='Справочник')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='StagedElement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('row', models.BigIntegerField()),
+                ('element_code', models.CharField(max_length=255)),
+                ('element_value', models.CharField(max_length=255)),
+                ('job', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='terminology.importjob')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='stagedelement',
+            index=models.Index(fields=['job', 'element_code', 'element_value'], name='staged_element_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stagedelement',
+            index=models.Index(fields=['job', 'row'], name='staged_row_idx'),
+        ),
+    ]
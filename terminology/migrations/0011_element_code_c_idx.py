@@ -0,0 +1,35 @@
+# Generated by Django 3.2.4 on 2026-10-17 03:40
+
+from django.db import migrations
+
+
+# Element pages are ordered by code point, i.e. element_code COLLATE "C", see
+# terminology.utils.ELEMENT_ORDERING. element_code_idx follows the database
+# collation, so PostgreSQL gets an expression index in the same order.
+# Other backends compare text by code point already.
+def create_code_point_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        'CREATE INDEX CONCURRENTLY IF NOT EXISTS element_code_c_idx '
+        'ON terminology_handbookelement ((element_code COLLATE "C"), id)'
+    )
+
+
+def drop_code_point_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX CONCURRENTLY IF EXISTS element_code_c_idx')
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run in a transaction
+    atomic = False
+
+    dependencies = [
+        ('terminology', '0010_element_trigram_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_code_point_index, drop_code_point_index),
+    ]
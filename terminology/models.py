@@ -1,10 +1,14 @@
 from django.db import models
 from django.db.models import (
     AutoField,
+    BigAutoField,
+    BigIntegerField,
     CharField,
     TextField,
     ForeignKey,
     ManyToManyField,
+    OuterRef,
+    Subquery,
 )
 from django.utils import timezone
 
@@ -24,6 +28,27 @@ class Handbook(models.Model):
         return self.name
 
 
+class HandbookVersionQuerySet(models.QuerySet):
+    def actual_for_date(self, date):
+        """
+        Versions in effect at the given date, at most one per handbook.
+
+        Effective dating is driven by starting_date; the version with the most
+        recent starting_date not later than the date wins. Resolved in a single
+        statement through a correlated subquery covered by the
+        (handbook_identifier, starting_date) index.
+        """
+        in_effect = (
+            HandbookVersion.objects.filter(
+                handbook_identifier=OuterRef("handbook_identifier"),
+                starting_date__lte=date,
+            )
+            .order_by("-starting_date", "-id")
+            .values("id")[:1]
+        )
+        return self.filter(starting_date__lte=date, id=Subquery(in_effect))
+
+
 class HandbookVersion(models.Model):
     id = AutoField(primary_key=True)
     handbook_identifier = ForeignKey(
@@ -41,6 +66,18 @@ class HandbookVersion(models.Model):
 
     created = models.DateTimeField(auto_now_add=True, blank=False, null=False)
     updated = models.DateTimeField(auto_now=True, blank=False, null=False)
+    # Digest of the version elements, empty until computed, see terminology.fingerprint
+    fingerprint = CharField(max_length=64, blank=True, default="", editable=False)
+
+    objects = HandbookVersionQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["handbook_identifier", "starting_date"],
+                name="version_handbook_start_idx",
+            ),
+        ]
 
     def __str__(self):
         return f"{self.handbook_identifier} версия {self.version}"
@@ -62,5 +99,89 @@ class HandbookElement(models.Model):
         verbose_name="Значение элемента", max_length=255, blank=False, null=False
     )
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["element_code", "id"], name="element_code_idx"),
+        ]
+
     def list_handbooks(self):
         return "\n, ".join([str(h) for h in self.handbook.all()])
+
+
+class Change(models.Model):
+    """Change log entry of the feed, see terminology.changes."""
+
+    HANDBOOK = "handbook"
+    VERSION = "version"
+    ELEMENT = "element"
+    MEMBERSHIP = "membership"  # object_id is an element, related_id a version
+    KINDS = (
+        (HANDBOOK, "Справочник"),
+        (VERSION, "Версия"),
+        (ELEMENT, "Элемент"),
+        (MEMBERSHIP, "Элемент версии"),
+    )
+
+    CREATED = "created"
+    UPDATED = "updated"
+    DELETED = "deleted"
+    ACTIONS = (
+        (CREATED, "Создан"),
+        (UPDATED, "Изменён"),
+        (DELETED, "Удалён"),
+    )
+
+    seq = BigAutoField(verbose_name="Номер", primary_key=True)
+    created = models.DateTimeField(
+        verbose_name="Время", default=timezone.now, db_index=True
+    )
+    kind = CharField(verbose_name="Тип объекта", max_length=16, choices=KINDS)
+    action = CharField(verbose_name="Действие", max_length=16, choices=ACTIONS)
+    object_id = BigIntegerField(verbose_name="Идентификатор объекта")
+    related_id = BigIntegerField(verbose_name="Идентификатор версии", default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["kind", "object_id", "related_id", "seq"],
+                name="change_object_idx",
+            ),
+        ]
+
+
+class ChangeFeedState(models.Model):
+    """Single row, changes up to pruned_through were dropped by retention."""
+
+    pruned_through = BigIntegerField(default=0)
+
+
+class ImportJob(models.Model):
+    """Run of the import_handbook command, see terminology.imports."""
+
+    handbook = ForeignKey(Handbook, verbose_name="Справочник", on_delete=models.CASCADE)
+    version = CharField(verbose_name="Версия", max_length=255)
+    starting_date = models.DateTimeField(verbose_name="Дата начала", null=True)
+    source = CharField(verbose_name="Файл", max_length=1024)
+    source_size = BigIntegerField(verbose_name="Размер файла")
+    # Rows of the file staged so far, a resumed run skips them
+    staged_rows = BigIntegerField(verbose_name="Загружено строк", default=0)
+    started = models.DateTimeField(verbose_name="Начат", default=timezone.now)
+    finished = models.DateTimeField(verbose_name="Завершён", null=True)
+
+
+class StagedElement(models.Model):
+    """Element row of an import, kept until the import is merged."""
+
+    job = ForeignKey(ImportJob, on_delete=models.CASCADE)
+    row = BigIntegerField()
+    element_code = CharField(max_length=255)
+    element_value = CharField(max_length=255)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["job", "element_code", "element_value"],
+                name="staged_element_idx",
+            ),
+            models.Index(fields=["job", "row"], name="staged_row_idx"),
+        ]
@@ -0,0 +1,235 @@
+"""
+Serializer-free rendering of element lists.
+
+Builds the same dicts HandbookElementSerializer produces straight from
+values() rows, with the version ids of all elements fetched by one query on
+the through table instead of one query per element.
+
+Responses are JSON unless the Accept header prefers MessagePack or CBOR and
+msgpack or cbor2 is installed. Element lists can be rendered column-wise,
+one list per field, when requested with layout=columns.
+"""
+
+import io
+import json
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+from rest_framework.renderers import BaseRenderer
+
+from terminology.models import HandbookElement
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+ELEMENT_FIELDS = ("id", "element_code", "element_value")
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+CBOR = "application/cbor"
+FORMATS = {JSON: "json", MSGPACK: "msgpack", CBOR: "cbor"}
+COLUMNS = "columns"
+
+ElementVersions = HandbookElement.handbook.through
+
+
+def element_rows(elements_qs):
+    return elements_qs.values(*ELEMENT_FIELDS)
+
+
+def with_versions(rows):
+    """Adds "handbook" version id lists to element rows, in place."""
+    handbooks = {row["id"]: [] for row in rows}
+    for i in range(0, len(rows), settings.VALIDATION_CHUNK_SIZE):
+        links_qs = (
+            ElementVersions.objects.filter(
+                handbookelement_id__in=[
+                    row["id"] for row in rows[i : i + settings.VALIDATION_CHUNK_SIZE]
+                ]
+            )
+            .order_by("id")
+            .values_list("handbookelement_id", "handbookversion_id")
+        )
+        for element_id, version_id in links_qs:
+            handbooks[element_id].append(version_id)
+    for row in rows:
+        row["handbook"] = handbooks[row["id"]]
+    return rows
+
+
+def dumps(data):
+    """
+    Encodes with orjson when it is installed and FAST_JSON_RENDERING is on.
+    Otherwise output is byte for byte what JsonResponse produces.
+    """
+    if orjson is not None and settings.FAST_JSON_RENDERING:
+        return orjson.dumps(data)
+    return json.dumps(data, cls=DjangoJSONEncoder).encode()
+
+
+def json_response(data, status=200):
+    return HttpResponse(dumps(data), status=status, content_type="application/json")
+
+
+def _default(value):
+    # Types JSON responses encode with DjangoJSONEncoder, e.g. datetimes
+    return DjangoJSONEncoder().default(value)
+
+
+def _cbor_default(encoder, value):
+    encoder.encode(_default(value))
+
+
+def encoders():
+    """{media type: dumps} of the binary formats available."""
+    available = {}
+    if msgpack is not None:
+        available[MSGPACK] = lambda data: msgpack.packb(data, default=_default)
+    if cbor2 is not None:
+        available[CBOR] = lambda data: cbor2.dumps(data, default=_cbor_default)
+    return available
+
+
+def _accepted(accept):
+    # Media ranges by descending quality, in header order among equals
+    ranges = []
+    for position, media_range in enumerate(accept.split(",")):
+        media_type, *params = (part.strip() for part in media_range.split(";"))
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if quality > 0 and media_type:
+            ranges.append((-quality, position, media_type.lower()))
+    return [media_type for _, _, media_type in sorted(ranges)]
+
+
+def negotiate(request):
+    """Media type of the response, JSON unless Accept prefers a binary format."""
+    available = encoders()
+    for media_type in _accepted(request.META.get("HTTP_ACCEPT", "")):
+        if media_type in available:
+            return media_type
+        if media_type in (JSON, "application/*", "*/*"):
+            return JSON
+    return JSON
+
+
+def is_columnar(request):
+    return request.GET.get("layout") == COLUMNS
+
+
+def variant(request):
+    """Format and layout of the response, "" for JSON objects."""
+    parts = []
+    media_type = negotiate(request)
+    if media_type != JSON:
+        parts.append(FORMATS[media_type])
+    if is_columnar(request):
+        parts.append(COLUMNS)
+    return ".".join(parts)
+
+
+def element_list(request, rows, fields):
+    """Rows as given, or as {field: [values]} when columns were requested."""
+    if is_columnar(request):
+        return {field: [row[field] for row in rows] for field in fields}
+    return rows
+
+
+def response(request, data, status=200, json_response=json_response):
+    """
+    data encoded in the negotiated format, json_response builds responses of
+    JSON clients.
+    """
+    media_type = negotiate(request)
+    if media_type == JSON:
+        http_response = json_response(data, status=status)
+    else:
+        http_response = HttpResponse(
+            encoders()[media_type](data), status=status, content_type=media_type
+        )
+    patch_vary_headers(http_response, ("Accept",))
+    return http_response
+
+
+class MessagePackRenderer(BaseRenderer):
+    """Lets DRF negotiation accept MessagePack, views encode with response()."""
+
+    media_type = MSGPACK
+    format = "msgpack"
+    charset = None
+    render_style = "binary"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return encoders()[MSGPACK](data)
+
+
+class CBORRenderer(BaseRenderer):
+    """Lets DRF negotiation accept CBOR, views encode with response()."""
+
+    media_type = CBOR
+    format = "cbor"
+    charset = None
+    render_style = "binary"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return encoders()[CBOR](data)
+
+
+class MessagePackParser(BaseParser):
+    media_type = MSGPACK
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        if msgpack is None:
+            raise ParseError("MessagePack is not supported")
+        try:
+            return msgpack.unpackb(stream.read())
+        except (ValueError, TypeError) as e:
+            raise ParseError(f"MessagePack parse error - {e}")
+
+
+class CBORParser(BaseParser):
+    media_type = CBOR
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        if cbor2 is None:
+            raise ParseError("CBOR is not supported")
+        try:
+            return cbor2.loads(stream.read())
+        except (ValueError, TypeError) as e:
+            raise ParseError(f"CBOR parse error - {e}")
+
+
+BODY_PARSERS = {MSGPACK: MessagePackParser, CBOR: CBORParser}
+
+
+def loads(request):
+    """Body of a plain Django request by its content type, raises ValueError."""
+    parser_class = BODY_PARSERS.get(request.content_type)
+    if parser_class is None:
+        return json.loads(request.body)
+    try:
+        return parser_class().parse(io.BytesIO(request.body))
+    except ParseError as e:
+        raise ValueError(e.detail)
@@ -0,0 +1,212 @@
+"""
+Routing of reads of read-only requests to database replicas.
+
+ReplicaMiddleware marks GET and HEAD requests, and POST requests of views
+with replica_reads set, as read-only. Reads of such a request go to one
+replica, picked by weight from DATABASE_REPLICAS when the request first
+reads. Everything else, writes, and reads outside of requests, go to the
+primary. A read-only request that writes anyway, e.g. a computed
+fingerprint, reads from the primary from then on.
+
+Requests that wrote set a cookie which keeps the reads of the client on the
+primary for REPLICA_STICKY_SECONDS, so clients read their own writes.
+
+Each process checks a replica at most every REPLICA_CHECK_INTERVAL seconds,
+when a request is about to use it. Replicas that fail the check or lag more
+than REPLICA_MAX_LAG_SECONDS behind the primary are out of rotation until
+a later check passes. Without healthy replicas reads go to the primary.
+
+In-process caches filled from a replica may hold data up to the replica lag
+older than the primary, which adds to their TTLs.
+"""
+
+import asyncio
+import contextvars
+import logging
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+logger = logging.getLogger(__name__)
+
+STICKY_COOKIE = "primary_reads"
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+# Seconds the standby is behind, 0 when it replayed everything it received
+POSTGRES_LAG_SQL = """
+    SELECT CASE
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+    END
+"""
+
+_current = contextvars.ContextVar("terminology_request_routing", default=None)
+
+
+class RequestRouting:
+    __slots__ = ("read_only", "replica", "wrote")
+
+    def __init__(self, read_only):
+        self.read_only = read_only
+        self.replica = None  # alias, picked on the first read
+        self.wrote = False
+
+
+def replica_lag(alias):
+    """Seconds the replica lags, 0 for databases without replication."""
+    connection = connections[alias]
+    with connection.cursor() as cursor:
+        if connection.vendor != "postgresql":
+            cursor.execute("SELECT 1")
+            return 0.0
+        cursor.execute(POSTGRES_LAG_SQL)
+        lag = cursor.fetchone()[0]
+    return float(lag or 0)
+
+
+class ReplicaPool:
+    def __init__(
+        self, weights, max_lag, check_interval, lag=replica_lag, clock=time.monotonic
+    ):
+        self.weights = dict(weights)
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.lag = lag
+        self.clock = clock
+        self.random = random.Random()
+        self._healthy = set()
+        self._checked = {}  # alias -> clock of the last check
+        self._lock = threading.Lock()
+
+    def _due(self, alias):
+        # Claims the check, so a single thread runs it
+        now = self.clock()
+        with self._lock:
+            checked = self._checked.get(alias)
+            if checked is not None and now - checked < self.check_interval:
+                return False
+            self._checked[alias] = now
+            return True
+
+    def check(self, alias):
+        try:
+            lag = self.lag(alias)
+        except DatabaseError as e:
+            logger.warning("Replica %s is out of rotation: %s", alias, e)
+            connections[alias].close()
+            healthy = False
+        else:
+            healthy = lag <= self.max_lag
+            if not healthy:
+                logger.warning("Replica %s is out of rotation, lags %.1fs", alias, lag)
+        with self._lock:
+            if healthy:
+                self._healthy.add(alias)
+            else:
+                self._healthy.discard(alias)
+        return healthy
+
+    def healthy(self):
+        for alias in self.weights:
+            if self._due(alias):
+                self.check(alias)
+        return [alias for alias in self.weights if alias in self._healthy]
+
+    def choose(self):
+        """Alias of a healthy replica picked by weight, None without one."""
+        aliases = self.healthy()
+        if not aliases:
+            return None
+        weights = [self.weights[alias] for alias in aliases]
+        return self.random.choices(aliases, weights)[0]
+
+
+replica_pool = ReplicaPool(
+    settings.DATABASE_REPLICAS,
+    settings.REPLICA_MAX_LAG_SECONDS,
+    settings.REPLICA_CHECK_INTERVAL,
+)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        routing = _current.get()
+        if routing is None or not routing.read_only or routing.wrote:
+            return DEFAULT_DB_ALIAS
+        if routing.replica is None:
+            routing.replica = replica_pool.choose() or DEFAULT_DB_ALIAS
+        return routing.replica
+
+    def db_for_write(self, model, **hints):
+        # Also for instances read from a replica
+        routing = _current.get()
+        if routing is not None:
+            routing.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *replica_pool.weights}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, **hints):
+        return False if db in replica_pool.weights else None
+
+
+def _replica_reads(view_func):
+    view = getattr(view_func, "view_class", view_func)
+    return getattr(view, "replica_reads", False)
+
+
+class ReplicaMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = bool(replica_pool.weights)
+        if asyncio.iscoroutinefunction(get_response):
+            # Marks the instance as a coroutine function for Django
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        if not self.enabled:
+            return self.get_response(request)
+        routing = RequestRouting(read_only=False)
+        token = _current.set(routing)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.stick(routing, response)
+
+    async def __acall__(self, request):
+        if not self.enabled:
+            return await self.get_response(request)
+        routing = RequestRouting(read_only=False)
+        token = _current.set(routing)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.stick(routing, response)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        routing = _current.get()
+        if routing is None or STICKY_COOKIE in request.COOKIES:
+            return None
+        routing.read_only = request.method in SAFE_METHODS or _replica_reads(view_func)
+        return None
+
+    def stick(self, routing, response):
+        if routing.wrote and not routing.read_only:
+            response.set_cookie(
+                STICKY_COOKIE, "1", max_age=settings.REPLICA_STICKY_SECONDS
+            )
+        return response
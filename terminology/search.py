@@ -0,0 +1,347 @@
+"""
+Prefix and typo tolerant search over element codes and values of a version.
+
+An element matches when its code or value starts with the query, ignoring
+case. In fuzzy mode an element also matches when its code or value has
+words similar to those of the query, by trigram word similarity as pg_trgm
+defines it. Prefix matches rank first, by element code and id, other
+matches follow by descending similarity, element code and id. Codes are
+ordered by code point, as utils.ELEMENT_ORDERING orders them.
+
+On PostgreSQL the pg_trgm GIN indexes created by migration 0010 serve both
+kinds of matches. Other backends search an in-process trigram index of the
+version, kept in a byte bounded store like snapshots and dropped with them.
+Its similarity is the share of trigrams of the query found in the code or
+value, which ranks close to pg_trgm word similarity. Versions too large for
+the store are not indexed, their elements are matched by prefix only, with
+a database query.
+"""
+
+import heapq
+import math
+import re
+from array import array
+from bisect import bisect_left
+from collections import defaultdict
+from sys import getsizeof
+
+from django.conf import settings
+from django.db.models import (
+    Case,
+    CharField,
+    FloatField,
+    Func,
+    Lookup,
+    Q,
+    Value,
+    When,
+)
+from django.db.models.functions import Greatest
+from django.db.models.lookups import IStartsWith
+
+from terminology.fingerprint import get_version_state
+from terminology.models import HandbookElement
+from terminology.snapshots import SnapshotStore, count_elements
+from terminology.utils import ELEMENT_ORDERING
+
+PREFIX = "prefix"
+FUZZY = "fuzzy"
+MODES = (PREFIX, FUZZY)
+FIELDS = ("element_code", "element_value")
+MAX_QUERY_LENGTH = 255
+
+# pg_trgm.word_similarity_threshold default, the %> operator uses it
+WORD_SIMILARITY_THRESHOLD = 0.6
+
+# pg_trgm splits text into words of alphanumeric characters
+_WORD = re.compile(r"[^\W_]+")
+
+
+class ILikePrefix(IStartsWith):
+    """
+    istartswith as pg_trgm indexes serve it, with ILIKE instead of UPPER()
+    LIKE on PostgreSQL.
+    """
+
+    lookup_name = "ilike_prefix"
+
+    def as_sql(self, compiler, connection):
+        return IStartsWith(self.lhs, self.rhs).as_sql(compiler, connection)
+
+    def as_postgresql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f"{lhs} ILIKE {rhs}", lhs_params + rhs_params
+
+
+class TrigramWordSimilar(Lookup):
+    lookup_name = "trigram_word_similar"
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f"{lhs} %%> {rhs}", lhs_params + rhs_params
+
+
+CharField.register_lookup(ILikePrefix)
+CharField.register_lookup(TrigramWordSimilar)
+
+
+class WordSimilarity(Func):
+    function = "WORD_SIMILARITY"
+    output_field = FloatField()
+
+    def __init__(self, query, field_name):
+        super().__init__(Value(query), field_name)
+
+
+def search_queryset(version_id, query, mode=FUZZY, fields=FIELDS):
+    """Ranked elements of the version matching the query, for PostgreSQL."""
+    elements_qs = HandbookElement.objects.filter(handbook__id=version_id)
+    prefix = Q()
+    for field_name in fields:
+        prefix |= Q(**{f"{field_name}__ilike_prefix": query})
+    if mode == PREFIX:
+        return elements_qs.filter(prefix).order_by(*ELEMENT_ORDERING)
+
+    similar = Q()
+    for field_name in fields:
+        similar |= Q(**{f"{field_name}__trigram_word_similar": query})
+    similarities = [WordSimilarity(query, field_name) for field_name in fields]
+    similarity = Greatest(*similarities) if len(similarities) > 1 else similarities[0]
+    return (
+        elements_qs.filter(prefix | similar)
+        .annotate(
+            # Similarities are at most 1, prefix matches rank above them
+            rank=Case(When(prefix, then=Value(2.0)), default=similarity),
+        )
+        .order_by("-rank", *ELEMENT_ORDERING)
+    )
+
+
+def _word_trigrams(word):
+    padded = f"  {word} "
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+def trigrams(text):
+    """Trigrams of the words of the text, as pg_trgm extracts them."""
+    grams = set()
+    for word in _WORD.findall(text.lower()):
+        grams |= _word_trigrams(word)
+    return grams
+
+
+class FieldIndex:
+    """
+    Sorted lowercase texts for prefix matches and an inverted index of their
+    words for trigram matches. Words repeat across elements, so trigrams are
+    indexed per distinct word rather than per text.
+    """
+
+    __slots__ = ("texts", "keys", "order", "words", "word_trigrams")
+
+    def __init__(self, texts):
+        self.texts = texts
+        # Texts which are lowercase already are shared with the keys
+        lowered = [text.lower() for text in texts]
+        lowered = [low if low != text else text for low, text in zip(lowered, texts)]
+        self.order = array("i", sorted(range(len(lowered)), key=lowered.__getitem__))
+        self.keys = [lowered[i] for i in self.order]
+
+        # word -> position of the only text having it, or array of positions
+        self.words = {}
+        for i, text in enumerate(lowered):
+            for word in set(_WORD.findall(text)):
+                found = self.words.get(word)
+                if found is None:
+                    self.words[word] = i
+                elif isinstance(found, int):
+                    self.words[word] = array("i", (found, i))
+                else:
+                    found.append(i)
+        # trigram -> words having it
+        word_trigrams = defaultdict(list)
+        for word in self.words:
+            for gram in _word_trigrams(word):
+                word_trigrams[gram].append(word)
+        self.word_trigrams = dict(word_trigrams)
+
+    def prefixed(self, prefix):
+        """Positions of the texts starting with the lowercase prefix."""
+        start = bisect_left(self.keys, prefix)
+        end = start
+        while end < len(self.keys) and self.keys[end].startswith(prefix):
+            end += 1
+        return self.order[start:end]
+
+    def _positions(self, gram):
+        positions = set()
+        for word in self.word_trigrams.get(gram, ()):
+            found = self.words[word]
+            if isinstance(found, int):
+                positions.add(found)
+            else:
+                positions.update(found)
+        return positions
+
+    def _frequency(self, gram):
+        return sum(
+            1 if isinstance(self.words[word], int) else len(self.words[word])
+            for word in self.word_trigrams.get(gram, ())
+        )
+
+    def similar(self, grams, threshold):
+        """
+        {position: share of the grams its text has} of the texts having at
+        least the threshold share of them.
+        """
+        needed = max(1, math.ceil(round(threshold * len(grams), 6)))
+        # A text lacking the rarest len(grams) - needed + 1 grams has too few
+        # of them, so only texts having one of those are counted
+        rarest = sorted(grams, key=self._frequency)[: len(grams) - needed + 1]
+        candidates = set()
+        for gram in rarest:
+            candidates |= self._positions(gram)
+        shares = {}
+        for i in candidates:
+            count = len(grams & trigrams(self.texts[i]))
+            if count >= needed:
+                shares[i] = count / len(grams)
+        return shares
+
+    def estimate_bytes(self):
+        size = getsizeof(self.order) + getsizeof(self.keys)
+        size += sum(getsizeof(key) for key in self.keys if not key.islower())
+        size += getsizeof(self.words) + getsizeof(self.word_trigrams)
+        size += sum(
+            getsizeof(word) + getsizeof(found) for word, found in self.words.items()
+        )
+        size += sum(
+            getsizeof(gram) + getsizeof(words)
+            for gram, words in self.word_trigrams.items()
+        )
+        return size
+
+
+class SearchIndex:
+    __slots__ = (
+        "version_id",
+        "fingerprint",
+        "ids",
+        "codes",
+        "values",
+        "fields",
+        "nbytes",
+    )
+
+    # Least bytes an element takes: array and list slots of both fields and
+    # their empty strings
+    MIN_ELEMENT_BYTES = 144
+
+    def __init__(self, version_id, fingerprint, rows):
+        """rows are (id, element_code, element_value) of the version."""
+        self.version_id = version_id
+        self.fingerprint = fingerprint
+        self.ids = array("q")
+        self.codes = []
+        self.values = []
+        for element_id, code, value in rows:
+            self.ids.append(element_id)
+            self.codes.append(code)
+            self.values.append(value)
+        self.fields = {
+            "element_code": FieldIndex(self.codes),
+            "element_value": FieldIndex(self.values),
+        }
+        self.nbytes = getsizeof(self.ids) + sum(
+            getsizeof(code) + getsizeof(value)
+            for code, value in zip(self.codes, self.values)
+        )
+        self.nbytes += sum(index.estimate_bytes() for index in self.fields.values())
+
+    def element(self, i):
+        return {
+            "id": self.ids[i],
+            "element_code": self.codes[i],
+            "element_value": self.values[i],
+        }
+
+    def search(self, query, mode=FUZZY, fields=FIELDS, limit=10, offset=0):
+        """Page of ranked matching elements, see the module docstring."""
+        prefixed = set()
+        for field_name in fields:
+            prefixed.update(self.fields[field_name].prefixed(query.lower()))
+
+        if mode == PREFIX:
+            candidates = prefixed
+
+            def rank(i):
+                return self.codes[i], self.ids[i]
+
+        else:
+            grams = trigrams(query)
+            similarity = {}
+            for field_name in fields:
+                shares = self.fields[field_name].similar(
+                    grams, WORD_SIMILARITY_THRESHOLD
+                )
+                for i, share in shares.items():
+                    if i not in prefixed and share > similarity.get(i, 0):
+                        similarity[i] = share
+            candidates = prefixed.union(similarity)
+
+            def rank(i):
+                return (
+                    i not in prefixed,
+                    -similarity.get(i, 0),
+                    self.codes[i],
+                    self.ids[i],
+                )
+
+        positions = heapq.nsmallest(offset + limit, candidates, key=rank)
+        return [self.element(i) for i in positions[offset:]]
+
+
+def build_index(version_id, fingerprint):
+    rows = (
+        HandbookElement.objects.filter(handbook__id=version_id)
+        .values_list("id", "element_code", "element_value")
+        .iterator(chunk_size=settings.EXPORT_CHUNK_SIZE)
+    )
+    return SearchIndex(version_id, fingerprint, rows)
+
+
+index_store = SnapshotStore(
+    max_bytes=settings.SEARCH_INDEX_MAX_BYTES, ttl=settings.SNAPSHOT_TTL
+)
+
+
+def get_index(version_id, fingerprint=None):
+    """
+    Search index of a version, built on a miss, see get_snapshot. None when
+    the version does not fit in the store.
+    """
+    index = index_store.get(version_id, fingerprint)
+    if index is None:
+        if fingerprint is None:
+            fingerprint, _ = get_version_state(version_id)
+        if not index_store.fits(
+            version_id,
+            fingerprint,
+            lambda: count_elements(version_id),
+            SearchIndex.MIN_ELEMENT_BYTES,
+        ):
+            return None
+        index = build_index(version_id, fingerprint)
+        index_store.put(index)
+    return index
+
+
+def version_deleted(sender, instance, **kwargs):
+    """post_delete of HandbookVersion."""
+    index_store.invalidate([instance.id])
+
+
+def fingerprints_reset(sender, version_ids, **kwargs):
+    index_store.invalidate(version_ids)
@@ -1,28 +1,61 @@
+from django.conf import settings
 from rest_framework import serializers
 from .models import Handbook, HandbookElement, HandbookVersion
 
 
-class HandbookModelSerializer(serializers.ModelSerializer):
+class SparseFieldsMixin:
+    """
+    Renders only the fields of a terminology.fieldsets.Fieldset passed as
+    fieldset. relations maps relation fields to (serializer class, many),
+    relations the fieldset does not expand render as ids or not at all.
+    """
+
+    relations = {}
+
+    def __init__(self, *args, fieldset=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fieldset is None:
+            return
+        for name in list(self.fields):
+            if name not in fieldset.fields:
+                del self.fields[name]
+        for name, (serializer_class, many) in self.relations.items():
+            if name not in self.fields:
+                continue
+            if name in fieldset.expand:
+                self.fields[name] = serializer_class(
+                    many=many, read_only=True, fieldset=fieldset.expand[name]
+                )
+            elif many:
+                del self.fields[name]
+            else:
+                self.fields[name] = serializers.PrimaryKeyRelatedField(read_only=True)
+
+
+class HandbookModelSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Handbook
         fields = "__all__"
 
 
-class HandbookVersionSerializerDeep(serializers.ModelSerializer):
+class HandbookVersionSerializerDeep(SparseFieldsMixin, serializers.ModelSerializer):
+    relations = {"handbook_identifier": (HandbookModelSerializer, False)}
+
     class Meta:
         model = HandbookVersion
-        fields = "__all__"
+        exclude = ("fingerprint",)
         depth = 1
 
 
-class HandbookVersionSerializer(serializers.ModelSerializer):
+class HandbookVersionSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = HandbookVersion
-        fields = "__all__"
+        exclude = ("fingerprint",)
 
 
-class HandbookFullSerializer(serializers.ModelSerializer):
+class HandbookFullSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     versions = HandbookVersionSerializer(many=True)
+    relations = {"versions": (HandbookVersionSerializer, True)}
 
     class Meta:
         model = Handbook
@@ -33,3 +66,35 @@ class HandbookElementSerializer(serializers.ModelSerializer):
     class Meta:
         model = HandbookElement
         fields = "__all__"
+
+
+class HandbookElementPatchSerializer(serializers.Serializer):
+    element_code = serializers.CharField(max_length=255)
+    element_value = serializers.CharField(max_length=255)
+
+
+class HandbookElementBulkSerializer(HandbookElementPatchSerializer):
+    """Validates a row of a bulk element upload, handbook holds version names."""
+
+    handbook = serializers.ListField(
+        child=serializers.CharField(max_length=255), allow_empty=False
+    )
+
+
+class HandbookVersionForkSerializer(serializers.Serializer):
+    from_version = serializers.CharField(max_length=255)
+    version = serializers.CharField(max_length=255)
+    starting_date = serializers.DateTimeField(required=False)
+    add = HandbookElementPatchSerializer(many=True, required=False)
+    remove = serializers.ListField(
+        child=serializers.CharField(max_length=255), required=False
+    )
+    replace = HandbookElementPatchSerializer(many=True, required=False)
+
+    def validate(self, data):
+        size = sum(len(data.get(key, ())) for key in ("add", "remove", "replace"))
+        if size > settings.FORK_MAX_PATCH_ITEMS:
+            raise serializers.ValidationError(
+                f"Patches are limited to {settings.FORK_MAX_PATCH_ITEMS} items."
+            )
+        return data
@@ -0,0 +1,350 @@
+"""
+In-process snapshots of published version elements.
+
+A snapshot holds every element of a version in parallel arrays: ids in an
+array, interned codes, values and shared tuples of the versions an element
+belongs to. Dicts over ids and codes give O(1) lookups and a precomputed
+(element_code, id) order serves pages, so element endpoints and validation
+can skip Postgres for hot versions.
+
+Snapshots are kept in a byte bounded LRU store, dropped when fingerprints of
+their versions are reset (see terminology.fingerprint) and expire after
+SNAPSHOT_TTL seconds, which bounds staleness for changes made by other
+processes. Element endpoints additionally check the snapshot fingerprint
+against the stored one.
+
+Versions too large for the store are not built: their element count is
+checked first, and versions found too large are remembered with their
+fingerprint, so they are served by the database until their content changes.
+
+Codes are ordered by code point, as database pages are ordered by
+utils.ELEMENT_ORDERING.
+"""
+
+import sys
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connections, router, transaction
+
+from terminology.fingerprint import get_version_state
+from terminology.models import HandbookElement
+from terminology.utils import (
+    decode_cursor,
+    encode_cursor,
+    get_limit_offset_by_request,
+)
+
+ElementVersions = HandbookElement.handbook.through
+
+
+class VersionSnapshot:
+    __slots__ = (
+        "version_id",
+        "fingerprint",
+        "ids",
+        "codes",
+        "values",
+        "handbooks",
+        "by_id",
+        "by_code",
+        "code_order",
+        "nbytes",
+    )
+
+    # Least bytes an element takes: array and list slots, by_id entry and its
+    # ints and an empty value string
+    MIN_ELEMENT_BYTES = 192
+
+    def __init__(self, version_id, fingerprint, rows, links):
+        """
+        rows are (id, element_code, element_value) ordered by id, links are
+        (element_id, version_id) through table rows of these elements.
+        """
+        self.version_id = version_id
+        self.fingerprint = fingerprint
+        self.ids = array("q")
+        self.codes = []
+        self.values = []
+        for element_id, code, value in rows:
+            self.ids.append(element_id)
+            self.codes.append(sys.intern(code))
+            self.values.append(value)
+        self.by_id = {element_id: i for i, element_id in enumerate(self.ids)}
+
+        memberships = [[] for _ in self.ids]
+        for element_id, member_version_id in links:
+            i = self.by_id.get(element_id)
+            # Linked after rows were read, when not read in one snapshot. The
+            # version's fingerprint is reset then, so this one is rebuilt.
+            if i is not None:
+                memberships[i].append(member_version_id)
+        shared = {}
+        self.handbooks = [shared.setdefault(tuple(m), tuple(m)) for m in memberships]
+
+        self.by_code = {}
+        for i, code in enumerate(self.codes):
+            found = self.by_code.get(code)
+            if found is None:
+                self.by_code[code] = i
+            elif isinstance(found, tuple):
+                self.by_code[code] = found + (i,)
+            else:
+                self.by_code[code] = (found, i)
+        self.code_order = array(
+            "l", sorted(range(len(self.ids)), key=lambda i: self.codes[i])
+        )  # stable sort keeps id order within a code
+        self.nbytes = self._estimate_bytes(shared)
+
+    def _estimate_bytes(self, shared):
+        getsizeof = sys.getsizeof
+        containers = (
+            self.ids,
+            self.codes,
+            self.values,
+            self.handbooks,
+            self.by_id,
+            self.by_code,
+            self.code_order,
+        )
+        size = sum(getsizeof(container) for container in containers)
+        # Key and index int objects of by_id
+        size += 2 * getsizeof(2**40) * len(self.ids)
+        size += sum(getsizeof(code) for code in self.by_code)
+        size += sum(getsizeof(value) for value in self.values)
+        size += sum(getsizeof(membership) for membership in shared)
+        return size
+
+    def __len__(self):
+        return len(self.ids)
+
+    def element(self, i):
+        return {
+            "id": self.ids[i],
+            "element_code": self.codes[i],
+            "element_value": self.values[i],
+            "handbook": list(self.handbooks[i]),
+        }
+
+    def get_by_id(self, element_id):
+        i = self.by_id.get(element_id)
+        return None if i is None else self.element(i)
+
+    def get_by_code(self, code):
+        found = self.by_code.get(code, ())
+        indices = found if isinstance(found, tuple) else (found,)
+        return [self.element(i) for i in indices]
+
+    def reference_rows(self):
+        """(id, element_code, element_value) ordered by id."""
+        return zip(self.ids, self.codes, self.values)
+
+    def _position_after(self, code, element_id):
+        # First position in code_order past (code, element_id)
+        low, high = 0, len(self.code_order)
+        while low < high:
+            middle = (low + high) // 2
+            i = self.code_order[middle]
+            if (self.codes[i], self.ids[i]) <= (code, element_id):
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def get_page_by_request(self, request):
+        """Snapshot counterpart of utils.get_page_by_request for elements."""
+        limit, offset = get_limit_offset_by_request(request)
+        cursor = request.GET.get("cursor")
+        if cursor is None:
+            positions = self.code_order[offset : offset + limit]
+            return [self.element(i) for i in positions], None
+
+        start = 0
+        if cursor:
+            code, element_id = decode_cursor(cursor, 2)
+            if not isinstance(code, str) or not isinstance(element_id, int):
+                raise ValueError(f"malformed cursor {cursor!r}")
+            start = self._position_after(code, element_id)
+        page = [self.element(i) for i in self.code_order[start : start + limit]]
+        if start + limit >= len(self.code_order):
+            return page, None
+        return page, encode_cursor([page[-1]["element_code"], page[-1]["id"]])
+
+
+@contextmanager
+def _repeatable_read(using):
+    """
+    Transaction whose queries read one database snapshot. SQLite transactions
+    are serializable already, PostgreSQL ones are raised from read committed.
+    """
+    connection = connections[using]
+    outermost = not connection.in_atomic_block
+    with transaction.atomic(using=using):
+        if outermost and connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+        yield
+
+
+def build_snapshot(version_id, fingerprint):
+    using = router.db_for_read(HandbookElement)
+    chunk_size = settings.EXPORT_CHUNK_SIZE
+    rows = (
+        HandbookElement.objects.using(using)
+        .filter(handbook__id=version_id)
+        .order_by("id")
+        .values_list("id", "element_code", "element_value")
+        .iterator(chunk_size=chunk_size)
+    )
+    links = (
+        ElementVersions.objects.using(using)
+        .filter(handbookelement__handbook__id=version_id)
+        .order_by("id")
+        .values_list("handbookelement_id", "handbookversion_id")
+        .iterator(chunk_size=chunk_size)
+    )
+    # Both queries see the same elements and links
+    with _repeatable_read(using):
+        return VersionSnapshot(version_id, fingerprint, rows, links)
+
+
+def count_elements(version_id):
+    return ElementVersions.objects.filter(handbookversion_id=version_id).count()
+
+
+class SnapshotStore:
+    def __init__(self, max_bytes, ttl, clock=time.monotonic):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.nbytes = 0
+        self._snapshots = OrderedDict()  # version id -> (snapshot, expires_at)
+        self._too_large = {}  # version id -> fingerprint
+        self._lock = threading.Lock()
+
+    def get(self, version_id, fingerprint=None):
+        """Cached snapshot, None if missing, expired or of another fingerprint."""
+        with self._lock:
+            entry = self._snapshots.get(version_id)
+            if entry is not None:
+                snapshot, expires_at = entry
+                if expires_at > self.clock() and (
+                    fingerprint is None or snapshot.fingerprint == fingerprint
+                ):
+                    self._snapshots.move_to_end(version_id)
+                    self.hits += 1
+                    return snapshot
+                self._discard(version_id)
+            self.misses += 1
+            return None
+
+    def fits(self, version_id, fingerprint, element_count, min_element_bytes):
+        """
+        False for versions of the fingerprint found too large before, or which
+        would be with element_count elements of min_element_bytes each.
+        """
+        with self._lock:
+            if version_id in self._too_large:
+                if self._too_large[version_id] == fingerprint:
+                    return False
+                del self._too_large[version_id]
+        if element_count() * min_element_bytes > self.max_bytes:
+            self.mark_too_large(version_id, fingerprint)
+            return False
+        return True
+
+    def mark_too_large(self, version_id, fingerprint):
+        with self._lock:
+            self._too_large[version_id] = fingerprint
+
+    def put(self, snapshot):
+        if snapshot.nbytes > self.max_bytes:
+            self.mark_too_large(snapshot.version_id, snapshot.fingerprint)
+            return
+        with self._lock:
+            self._discard(snapshot.version_id)
+            self._snapshots[snapshot.version_id] = (
+                snapshot,
+                self.clock() + self.ttl,
+            )
+            self.nbytes += snapshot.nbytes
+            while self.nbytes > self.max_bytes:
+                _, (evicted, _) = self._snapshots.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+                self.evictions += 1
+
+    def invalidate(self, version_ids):
+        with self._lock:
+            for version_id in version_ids:
+                self._discard(version_id)
+                self._too_large.pop(version_id, None)
+
+    def _discard(self, version_id):
+        entry = self._snapshots.pop(version_id, None)
+        if entry is not None:
+            self.nbytes -= entry[0].nbytes
+
+    def clear(self):
+        with self._lock:
+            self._snapshots.clear()
+            self._too_large.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "bytes": self.nbytes,
+                "max_bytes": self.max_bytes,
+                "snapshots": len(self._snapshots),
+                "too_large": len(self._too_large),
+            }
+
+
+snapshot_store = SnapshotStore(
+    max_bytes=settings.SNAPSHOT_MAX_BYTES, ttl=settings.SNAPSHOT_TTL
+)
+
+
+def get_snapshot(version_id, fingerprint=None):
+    """
+    Snapshot of a version, built on a miss. None when snapshots are disabled
+    or the version does not fit in the store.
+
+    Without a fingerprint a cached snapshot is trusted until dropped or
+    expired, a new one is built with the stored fingerprint.
+    """
+    if not settings.SNAPSHOTS_ENABLED:
+        return None
+    snapshot = snapshot_store.get(version_id, fingerprint)
+    if snapshot is None:
+        if fingerprint is None:
+            fingerprint, _ = get_version_state(version_id)
+        if not snapshot_store.fits(
+            version_id,
+            fingerprint,
+            lambda: count_elements(version_id),
+            VersionSnapshot.MIN_ELEMENT_BYTES,
+        ):
+            return None
+        snapshot = build_snapshot(version_id, fingerprint)
+        snapshot_store.put(snapshot)
+    return snapshot
+
+
+def version_deleted(sender, instance, **kwargs):
+    """post_delete of HandbookVersion."""
+    snapshot_store.invalidate([instance.id])
+
+
+def fingerprints_reset(sender, version_ids, **kwargs):
+    snapshot_store.invalidate(version_ids)
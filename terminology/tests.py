@@ -1,3 +1,1976 @@
-from django.test import TestCase
+import csv
+import io
+import json
+import os
+import tempfile
+from datetime import timedelta
+from unittest import skipUnless
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.http import HttpResponse, JsonResponse
+from asgiref.sync import sync_to_async
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError, connection, reset_queries, router
+from django.db.backends.postgresql.base import (
+    DatabaseWrapper as PostgreSQLDatabaseWrapper,
+)
+from django.test import (
+    AsyncClient,
+    Client,
+    RequestFactory,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.http import urlencode
+
+from terminology import (
+    bench,
+    changes,
+    diff,
+    imports,
+    metrics,
+    rendering,
+    replicas,
+    search,
+    validation,
+    views,
+    warmup,
+)
+from terminology.admin import EstimatedCountPaginator
+from terminology.models import (
+    Change,
+    Handbook,
+    HandbookElement,
+    HandbookVersion,
+    ImportJob,
+    StagedElement,
+)
+from terminology.serializers import HandbookElementSerializer
+from terminology.snapshots import (
+    SnapshotStore,
+    VersionSnapshot,
+    build_snapshot,
+    snapshot_store,
+)
+from terminology.utils import ELEMENT_ORDERING, encode_cursor
+from terminology.version_cache import (
+    VersionResolutionCache,
+    get_current_version_id,
+    get_version_id,
+    get_version_ids,
+    version_cache,
+)
+
+
+def make_handbook(name="handbook", versions=(), **kwargs):
+    handbook = Handbook.objects.create(
+        name=name, short_name=name[:10], description=f"{name} description", **kwargs
+    )
+    for version, starting_date in versions:
+        HandbookVersion.objects.create(
+            handbook_identifier=handbook,
+            version=version,
+            starting_date=starting_date,
+        )
+    return handbook
+
+
+class TerminologyTestCase(TestCase):
+    def setUp(self):
+        # Rolled back rows do not fire signals, ids may be reused between tests.
+        version_cache.clear()
+        snapshot_store.clear()
+        search.index_store.clear()
+
+
+class GetHandbooksActualForDateTest(TerminologyTestCase):
+    url = "/handbook/actual"
+
+    def setUp(self):
+        super().setUp()
+        self.now = timezone.now().replace(microsecond=0)
+        self.date_param = self.now.strftime("%Y-%m-%d %X")
+
+    def test_picks_version_by_starting_date(self):
+        handbook = make_handbook(
+            versions=(
+                ("1.0", self.now - timedelta(days=10)),
+                ("2.0", self.now - timedelta(days=1)),
+                ("3.0", self.now + timedelta(days=1)),
+            )
+        )
+        response = self.client.get(self.url, {"date": self.date_param})
+
+        versions = response.json()["handbooks_actual_for_date"]
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([v["version"] for v in versions], ["2.0"])
+        self.assertEqual(versions[0]["handbook_identifier"]["id"], handbook.id)
+
+    def test_skips_handbooks_without_version_in_effect(self):
+        make_handbook("future", versions=(("1.0", self.now + timedelta(days=1)),))
+        response = self.client.get(self.url, {"date": self.date_param})
+
+        self.assertEqual(response.json()["handbooks_actual_for_date"], [])
+
+    def test_query_count_does_not_depend_on_handbook_count(self):
+        for i in range(10):
+            make_handbook(
+                f"handbook{i}",
+                versions=(
+                    ("1.0", self.now - timedelta(days=2)),
+                    ("2.0", self.now - timedelta(days=1)),
+                ),
+            )
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, {"date": self.date_param})
+        self.assertEqual(len(response.json()["handbooks_actual_for_date"]), 10)
+
+    def test_bad_date_is_rejected(self):
+        self.assertEqual(self.client.get(self.url).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {"date": "soon"}).status_code, 400)
+
+    def test_unexpanded_handbook_is_not_joined(self):
+        handbook = make_handbook(versions=(("1.0", self.now),))
+        params = {"date": self.date_param, "fields": "id,handbook_identifier"}
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, {**params, "expand": ""})
+
+        self.assertEqual(
+            response.json()["handbooks_actual_for_date"],
+            [{"id": handbook.versions.get().id, "handbook_identifier": handbook.id}],
+        )
+        self.assertNotIn("JOIN", queries[0]["sql"])
+        self.assertNotIn("starting_date", queries[0]["sql"].split("FROM")[0])
+
+    def test_fields_of_expanded_handbook(self):
+        make_handbook("sparse", versions=(("1.0", self.now),))
+        response = self.client.get(
+            self.url,
+            {"date": self.date_param, "fields": "version,handbook_identifier.name"},
+        )
+
+        self.assertEqual(
+            response.json()["handbooks_actual_for_date"],
+            [{"version": "1.0", "handbook_identifier": {"name": "sparse"}}],
+        )
+
+
+class GetHandbooksFullTest(TerminologyTestCase):
+    url = "/handbook/"
+
+    def make_handbooks(self, count):
+        now = timezone.now()
+        for i in range(count):
+            make_handbook(
+                f"handbook{i}",
+                versions=(("1.0", now - timedelta(days=1)), ("2.0", now)),
+            )
+
+    def test_versions_are_nested(self):
+        self.make_handbooks(3)
+        handbooks = self.client.get(self.url).json()["handbooks"]
+
+        self.assertEqual(len(handbooks), 3)
+        for handbook in handbooks:
+            self.assertEqual(
+                [v["version"] for v in handbook["versions"]], ["1.0", "2.0"]
+            )
+
+    def test_query_count_does_not_depend_on_page_size(self):
+        self.make_handbooks(1)
+        with self.assertNumQueries(2):
+            self.client.get(self.url)
+
+        self.make_handbooks(9)
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url)
+        self.assertEqual(len(response.json()["handbooks"]), 10)
+
+    def test_sparse_fields_skip_versions(self):
+        self.make_handbooks(2)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, {"fields": "id,name"})
+
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn("description", queries[0]["sql"])
+        self.assertEqual(
+            [set(handbook) for handbook in response.json()["handbooks"]],
+            [{"id", "name"}] * 2,
+        )
+
+    def test_fields_of_versions(self):
+        self.make_handbooks(1)
+        response = self.client.get(self.url, {"fields": "name,versions.version"})
+
+        self.assertEqual(
+            response.json()["handbooks"],
+            [
+                {
+                    "name": "handbook0",
+                    "versions": [{"version": "1.0"}, {"version": "2.0"}],
+                }
+            ],
+        )
+
+    def test_expand_keeps_all_fields(self):
+        self.make_handbooks(1)
+        handbook = self.client.get(self.url, {"expand": "versions"}).json()[
+            "handbooks"
+        ][0]
+        full = self.client.get(self.url).json()["handbooks"][0]
+
+        self.assertEqual(handbook, full)
+        self.assertNotIn(
+            "versions", self.client.get(self.url, {"expand": ""}).json()["handbooks"][0]
+        )
+
+    def test_unknown_fields_are_rejected(self):
+        for params in (
+            {"fields": "id,secret"},
+            {"fields": "versions.secret"},
+            {"expand": "elements"},
+            {"fields": "versions.version", "expand": ""},
+        ):
+            self.assertEqual(self.client.get(self.url, params).status_code, 400)
+
+
+class KeysetPaginationTest(TerminologyTestCase):
+    def setUp(self):
+        super().setUp()
+        self.handbook = make_handbook(versions=(("1.0", timezone.now()),))
+        version = self.handbook.versions.get()
+        for code in ("c", "a", "b", "a", "d"):
+            element = HandbookElement.objects.create(
+                element_code=code, element_value=f"value {code}"
+            )
+            element.handbook.add(version)
+
+    def fetch_all(self, url, key, **params):
+        pages, cursor = [], ""
+        while cursor is not None:
+            body = self.client.get(url, {"cursor": cursor, **params}).json()
+            pages.append(body[key])
+            cursor = body["next"]
+        return pages
+
+    def test_walks_elements_in_code_order(self):
+        url = f"/element/version/{self.handbook.id}/"
+        pages = self.fetch_all(
+            url, "requested_version_elements", version="1.0", limit=2
+        )
+
+        self.assertEqual([len(page) for page in pages], [2, 2, 1])
+        codes = [e["element_code"] for page in pages for e in page]
+        self.assertEqual(codes, ["a", "a", "b", "c", "d"])
+        ids = [e["id"] for page in pages for e in page]
+        self.assertEqual(len(set(ids)), 5)
+
+    def test_limit_offset_still_supported(self):
+        url = f"/element/actual/{self.handbook.id}/"
+        body = self.client.get(url, {"limit": 2, "offset": 3}).json()
+
+        codes = [e["element_code"] for e in body["recent_handbook_elements"]]
+        self.assertEqual(codes, ["c", "d"])
+        self.assertNotIn("next", body)
+
+    def test_limit_is_capped(self):
+        for i in range(4):
+            make_handbook(f"extra{i}")
+        with self.settings(MAX_PAGE_SIZE=3):
+            body = self.client.get("/handbook/short/", {"limit": 100}).json()
+        self.assertEqual(len(body["handbooks_short"]), 3)
+
+    def test_malformed_cursor_is_rejected(self):
+        response = self.client.get("/handbook/", {"cursor": "not a cursor"})
+        self.assertEqual(response.status_code, 400)
+
+
+class VersionResolutionCacheTest(TerminologyTestCase):
+    def test_lru_eviction(self):
+        cache = VersionResolutionCache(maxsize=2, ttl=60)
+        cache.set(("current", 1), 10)
+        cache.set(("current", 2), 20)
+        cache.get(("current", 1))
+        cache.set(("current", 3), 30)
+
+        self.assertEqual(cache.get(("current", 1)), 10)
+        self.assertIsNone(cache.get(("current", 2)))
+
+    def test_entries_expire(self):
+        now = [1000.0]
+        cache = VersionResolutionCache(maxsize=10, ttl=60, clock=lambda: now[0])
+        cache.set(("current", 1), 10)
+        cache.set(("current", 2), 20, expires_at=1010.0)
+
+        now[0] = 1010.0
+        self.assertEqual(cache.get(("current", 1)), 10)
+        self.assertIsNone(cache.get(("current", 2)))
+        now[0] = 1060.0
+        self.assertIsNone(cache.get(("current", 1)))
+
+    def test_resolution_is_cached_until_version_is_saved(self):
+        now = timezone.now()
+        handbook = make_handbook(versions=(("1.0", now - timedelta(days=1)),))
+        first = handbook.versions.get()
+
+        self.assertEqual(get_current_version_id(handbook.id), first.id)
+        self.assertEqual(get_version_id(handbook.id, "1.0"), first.id)
+        with self.assertNumQueries(0):
+            get_current_version_id(handbook.id)
+            get_version_id(handbook.id, "1.0")
+
+        second = HandbookVersion.objects.create(
+            handbook_identifier=handbook, version="2.0", starting_date=now
+        )
+        self.assertEqual(get_current_version_id(handbook.id), second.id)
+
+        first.delete()
+        with self.assertRaises(HandbookVersion.DoesNotExist):
+            get_version_id(handbook.id, "1.0")
+
+    def test_duplicate_version_names_resolve_to_oldest(self):
+        now = timezone.now()
+        handbook = make_handbook(
+            versions=(("1.0", now - timedelta(days=1)), ("1.0", now))
+        )
+        oldest = handbook.versions.order_by("id").first()
+
+        self.assertEqual(get_version_id(handbook.id, "1.0"), oldest.id)
+        version_cache.clear()
+        key = (handbook.id, "1.0")
+        self.assertEqual(get_version_ids([key]), {key: oldest.id})
+
+    def test_scheduled_version_expires_current_entry(self):
+        now = timezone.now()
+        handbook = make_handbook(
+            versions=(
+                ("1.0", now - timedelta(days=1)),
+                ("2.0", now + timedelta(seconds=30)),
+            )
+        )
+        get_current_version_id(handbook.id)
+
+        _, expires_at = version_cache._entries[("current", handbook.id)]
+        self.assertAlmostEqual(
+            expires_at, (now + timedelta(seconds=30)).timestamp(), places=3
+        )
+
+
+class ValidateElementsTest(TestCase):
+    reference_rows = [(1, "a", "A"), (2, "b", "B"), (3, "c", "C"), (5, "e", "E")]
+
+    def received(self):
+        return [
+            {"id": 3, "element_code": "c", "element_value": "changed"},
+            {"id": 4, "element_code": "d", "element_value": "D"},
+            {"id": 1, "element_code": "b", "element_value": "A"},
+            {"id": 2, "element_code": "b", "element_value": "B"},
+        ]
+
+    def test_strategies_compare_elements_with_same_id(self):
+        for strategy in (validation.HASH, validation.MERGE):
+            with self.subTest(strategy=strategy):
+                report = validation.validate_elements(
+                    iter(self.reference_rows), self.received(), strategy
+                )
+                self.assertEqual(report.missing_ids, [4])
+                self.assertEqual(report.unexpected_ids, [5])
+                self.assertEqual(report.matched_count, 3)
+                # Code "b" of element 1 is in the payload, but not under id 1.
+                self.assertEqual(report.code_error_ids, [1])
+                self.assertEqual(report.value_error_ids, [3])
+
+    def test_malformed_element(self):
+        with self.assertRaises(KeyError):
+            validation.validate_elements(iter(self.reference_rows), [{"id": 1}])
+
+
+class RecentHandbookElementsValidationTest(TerminologyTestCase):
+    def setUp(self):
+        super().setUp()
+        self.handbook = make_handbook(versions=(("1.0", timezone.now()),))
+        version = self.handbook.versions.get()
+        self.elements = []
+        for code in ("a", "b"):
+            element = HandbookElement.objects.create(
+                element_code=code, element_value=code.upper()
+            )
+            element.handbook.add(version)
+            self.elements.append(element)
+        self.url = f"/element/validate_recent/{self.handbook.id}/"
+
+    def post(self, elements):
+        return self.client.post(
+            self.url, {"elements": elements}, content_type="application/json"
+        )
+
+    def test_reports_errors_with_reference_element(self):
+        first, second = self.elements
+        response = self.post(
+            [
+                {"id": first.id, "element_code": "b", "element_value": "A"},
+                {"id": second.id + 100, "element_code": "b", "element_value": "B"},
+            ]
+        )
+
+        errors = response.json()["validation_errors"]
+        self.assertEqual(errors["missing_id"], [second.id + 100])
+        self.assertEqual(errors["unexpected_id"], [second.id])
+        self.assertEqual(
+            errors["code_errors"],
+            [
+                {
+                    "element_code_error": {
+                        "id": first.id,
+                        "element_code": "a",
+                        "element_value": "A",
+                        "handbook": [self.handbook.versions.get().id],
+                    }
+                }
+            ],
+        )
+        self.assertNotIn("value_errors", errors)
+
+    def test_no_matching_ids(self):
+        response = self.post([{"id": 0, "element_code": "a", "element_value": "A"}])
+
+        self.assertEqual(
+            response.json()["validation_errors"]["id_error"], "no matching id's"
+        )
+
+    def test_malformed_payload(self):
+        self.assertEqual(self.post({"id": 1}).status_code, 400)
+        self.assertEqual(self.post([{"id": self.elements[0].id}]).status_code, 400)
+
+
+class ElementValidationTest(TerminologyTestCase):
+    def setUp(self):
+        super().setUp()
+        now = timezone.now()
+        self.handbook = make_handbook(versions=(("1.0", now), ("2.0", now)))
+        self.v1, self.v2 = self.handbook.versions.order_by("version")
+        self.element = HandbookElement.objects.create(
+            element_code="a", element_value="A"
+        )
+        self.element.handbook.add(self.v1)
+
+    def item(self, version, element_id, code="a", value="A"):
+        return {
+            "handbook_id": self.handbook.id,
+            "version": version,
+            "element": {
+                "id": element_id,
+                "element_code": code,
+                "element_value": value,
+            },
+        }
+
+    def test_single_element(self):
+        response = self.client.post(
+            f"/element/validate/{self.handbook.id}/",
+            {
+                "version": "1.0",
+                "element": self.item("1.0", self.element.id, value="B")["element"],
+            },
+            content_type="application/json",
+        )
+
+        self.assertEqual(
+            response.json(), {"validation_errors": {"element_value_error": "A"}}
+        )
+
+    def test_batch_keeps_request_order(self):
+        items = [
+            self.item("2.0", self.element.id),
+            self.item("1.0", self.element.id, code="b"),
+            self.item("3.0", self.element.id),
+            self.item("1.0", self.element.id),
+            self.item("1.0", 0),
+        ]
+        with self.assertNumQueries(2):
+            response = self.client.post(
+                "/element/validate_batch/",
+                {"items": items},
+                content_type="application/json",
+            )
+
+        self.assertEqual(
+            [result["validation_errors"] for result in response.json()["results"]],
+            [
+                {"id_error": f"no such id {self.element.id}"},
+                {"element_code_error": "a"},
+                {"version_error": "no such version 3.0"},
+                {},
+                {"id_error": "no such id 0"},
+            ],
+        )
+
+    def test_batch_malformed_item(self):
+        response = self.client.post(
+            "/element/validate_batch/",
+            {"items": [{"handbook_id": self.handbook.id}]},
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+class PostHandbookElementsTest(TerminologyTestCase):
+    url = "/element/bulk/"
+
+    def setUp(self):
+        super().setUp()
+        now = timezone.now()
+        self.handbook = make_handbook(versions=(("1.0", now), ("2.0", now)))
+
+    def post(self, elements):
+        return self.client.post(
+            self.url, {"handbook_elements": elements}, content_type="application/json"
+        )
+
+    def test_creates_elements_with_versions(self):
+        response = self.post(
+            [
+                {"handbook": ["1.0"], "element_code": "a", "element_value": "A"},
+                {"handbook": ["1.0", "2.0"], "element_code": "b", "element_value": "B"},
+            ]
+        )
+
+        self.assertEqual(response.status_code, 201)
+        first, second = [
+            HandbookElement.objects.get(id=element_id)
+            for element_id in response.json()["ids"]
+        ]
+        self.assertEqual(first.element_code, "a")
+        self.assertEqual(
+            sorted(second.handbook.values_list("version", flat=True)), ["1.0", "2.0"]
+        )
+
+    def test_nothing_is_created_on_errors(self):
+        response = self.post(
+            [
+                {"handbook": ["1.0"], "element_code": "a", "element_value": "A"},
+                {"handbook": ["9.9"], "element_code": "b", "element_value": "B"},
+                {"handbook": ["1.0"], "element_code": "c", "element_value": "C"},
+            ]
+        )
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            response.json()["errors"],
+            [{"index": 1, "errors": {"handbook": ["No such versions."]}}],
+        )
+        self.assertFalse(HandbookElement.objects.exists())
+
+    def test_field_errors_are_reported_per_row(self):
+        response = self.post(
+            [
+                {"handbook": ["1.0"], "element_code": "a", "element_value": "A"},
+                {"handbook": [], "element_code": "b"},
+            ]
+        )
+
+        errors = response.json()["errors"]
+        self.assertEqual([error["index"] for error in errors], [1])
+        self.assertEqual(sorted(errors[0]["errors"]), ["element_value", "handbook"])
+
+
+class ExportVersionHandbookElementsTest(TerminologyTestCase):
+    def setUp(self):
+        super().setUp()
+        self.handbook = make_handbook(versions=(("1.0", timezone.now()),))
+        version = self.handbook.versions.get()
+        self.elements = []
+        for code, value in (("a", "Ä"), ("b", 'quoted "b", with comma')):
+            element = HandbookElement.objects.create(
+                element_code=code, element_value=value
+            )
+            element.handbook.add(version)
+            self.elements.append(element)
+        self.url = f"/element/export/{self.handbook.id}/"
+
+    def test_ndjson(self):
+        response = self.client.get(self.url, {"version": "1.0"})
+
+        self.assertTrue(response.streaming)
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(
+            [json.loads(line) for line in lines],
+            [
+                {
+                    "id": e.id,
+                    "element_code": e.element_code,
+                    "element_value": e.element_value,
+                }
+                for e in self.elements
+            ],
+        )
+
+    def test_csv(self):
+        response = self.client.get(self.url, {"output": "csv"})
+
+        content = b"".join(response.streaming_content).decode()
+        rows = list(csv.reader(io.StringIO(content)))
+        self.assertEqual(rows[0], ["id", "element_code", "element_value"])
+        self.assertEqual(
+            rows[2], [str(self.elements[1].id), "b", 'quoted "b", with comma']
+        )
+
+    def test_unknown_format(self):
+        response = self.client.get(self.url, {"output": "xml"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_unknown_version(self):
+        response = self.client.get(self.url, {"version": "2.0"})
+        self.assertEqual(response.status_code, 404)
+
+    def test_unknown_handbook(self):
+        response = self.client.get(f"/element/export/{self.handbook.id + 1}/")
+        self.assertEqual(response.status_code, 404)
+
+
+class ConditionalGetTest(TerminologyTestCase):
+    def setUp(self):
+        super().setUp()
+        self.handbook = make_handbook(versions=(("1.0", timezone.now()),))
+        self.version = self.handbook.versions.get()
+        self.element = HandbookElement.objects.create(
+            element_code="a", element_value="A"
+        )
+        self.element.handbook.add(self.version)
+        self.url = f"/element/version/{self.handbook.id}/"
+
+    def get(self, **headers):
+        return self.client.get(self.url, {"version": "1.0"}, **headers)
+
+    def test_not_modified_without_touching_elements(self):
+        etag = self.get()["ETag"]
+        self.get()  # fingerprint is stored by now
+
+        with self.assertNumQueries(1):
+            response = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_etag_changes_with_elements(self):
+        etag = self.get()["ETag"]
+
+        self.element.element_value = "B"
+        self.element.save()
+        self.assertNotEqual(self.get()["ETag"], etag)
+        etag = self.get()["ETag"]
+
+        other_version = HandbookVersion.objects.create(
+            handbook_identifier=self.handbook, version="2.0"
+        )
+        self.element.handbook.add(other_version)
+        response = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("Last-Modified", response)
+
+    def test_scheduled_version_switch_is_modified(self):
+        now = timezone.now()
+        HandbookVersion.objects.filter(id=self.version.id).update(
+            starting_date=now - timedelta(hours=2), updated=now - timedelta(hours=1)
+        )
+        # Scheduled before the elements of 1.0 last changed
+        scheduled = HandbookVersion.objects.create(
+            handbook_identifier=self.handbook,
+            version="2.0",
+            starting_date=now + timedelta(hours=1),
+        )
+        HandbookVersion.objects.filter(id=scheduled.id).update(
+            updated=now - timedelta(days=1)
+        )
+        url = f"/element/actual/{self.handbook.id}/"
+        last_modified = self.client.get(url)["Last-Modified"]
+
+        # Time passes until 2.0 starts
+        HandbookVersion.objects.filter(id=scheduled.id).update(
+            starting_date=now - timedelta(minutes=1)
+        )
+        version_cache.clear()
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["recent_handbook_elements"], [])
+
+    def test_handbook_list_gets_etag(self):
+        etag = self.client.get("/handbook/")["ETag"]
+
+        response = self.client.get("/handbook/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+
+class ElementRenderingTest(TerminologyTestCase):
+    def setUp(self):
+        super().setUp()
+        now = timezone.now()
+        self.handbook = make_handbook(versions=(("1.0", now), ("2.0", now)))
+        versions = list(self.handbook.versions.order_by("id"))
+        for i in range(20):
+            element = HandbookElement.objects.create(
+                element_code=f"code{i:02d}", element_value=f"значение {i}"
+            )
+            element.handbook.add(*versions[: i % 2 + 1])
+        self.url = f"/element/version/{self.handbook.id}/"
+
+    def test_matches_serializer_output(self):
+        elements_qs = HandbookElement.objects.filter(
+            handbook__id=self.handbook.versions.get(version="1.0").id
+        ).order_by("element_code", "id")[:10]
+        expected = JsonResponse(
+            {
+                "requested_version_elements": HandbookElementSerializer(
+                    elements_qs, many=True
+                ).data
+            }
+        ).content
+
+        response = self.client.get(self.url, {"version": "1.0"})
+        self.assertEqual(response.content, expected)
+
+    @skipUnless(rendering.orjson, "orjson is not installed")
+    @override_settings(FAST_JSON_RENDERING=True)
+    def test_fast_rendering_changes_only_encoding(self):
+        expected = self.client.get(self.url, {"version": "1.0"}).content
+        with self.settings(FAST_JSON_RENDERING=False):
+            compatible = self.client.get(self.url, {"version": "1.0"}).content
+
+        self.assertNotEqual(expected, compatible)
+        self.assertEqual(json.loads(expected), json.loads(compatible))
+        # Compact separators and raw UTF-8 instead of \u escapes
+        self.assertNotIn(b", ", expected)
+        self.assertIn("значение".encode(), expected)
+        self.assertIn(b"\\u0437", compatible)
+
+    def test_offset_pages_are_ordered_by_code(self):
+        response = self.client.get(
+            self.url, {"version": "1.0", "limit": 5, "offset": 5}
+        )
+        self.assertEqual(
+            [e["element_code"] for e in response.json()["requested_version_elements"]],
+            [f"code{i:02d}" for i in range(5, 10)],
+        )
+
+    @override_settings(SNAPSHOTS_ENABLED=False)
+    def test_query_count_does_not_depend_on_page_size(self):
+        self.client.get(self.url, {"version": "1.0"})  # fingerprint is stored
+        with self.assertNumQueries(3):
+            self.client.get(self.url, {"version": "1.0", "limit": 1})
+        with self.assertNumQueries(3):
+            self.client.get(self.url, {"version": "1.0", "limit": 20})
+
+
+@skipUnless(
+    rendering.msgpack and rendering.cbor2, "msgpack and cbor2 are not installed"
+)
+class BinaryRenderingTest(TerminologyTestCase):
+    def setUp(self):
+        super().setUp()
+        self.handbook = make_handbook(versions=(("1.0", timezone.now()),))
+        version = self.handbook.versions.get()
+        self.element = HandbookElement.objects.create(
+            element_code="a", element_value="A"
+        )
+        self.element.handbook.add(version)
+        self.url = f"/element/version/{self.handbook.id}/"
+
+    def get(self, accept=None, **headers):
+        if accept:
+            headers["HTTP_ACCEPT"] = accept
+        return self.client.get(self.url, {"version": "1.0"}, **headers)
+
+    def test_negotiates_binary_formats(self):
+        expected = self.get().json()
+        for accept, loads in (
+            ("application/msgpack", rendering.msgpack.unpackb),
+            ("application/cbor", rendering.cbor2.loads),
+        ):
+            with self.subTest(accept=accept):
+                response = self.get(accept)
+                self.assertEqual(response["Content-Type"], accept)
+                self.assertIn("Accept", response["Vary"])
+                self.assertEqual(loads(response.content), expected)
+
+    def test_quality_values(self):
+        response = self.get("application/msgpack;q=0.5, application/json")
+        self.assertEqual(response["Content-Type"], "application/json")
+        response = self.get("application/json;q=0.5, application/cbor")
+        self.assertEqual(response["Content-Type"], rendering.CBOR)
+        response = self.get("application/cbor;q=0")
+        self.assertEqual(response["Content-Type"], "application/json")
+
+    def test_columnar_layout(self):
+        response = self.client.get(self.url, {"version": "1.0", "layout": "columns"})
+        self.assertEqual(
+            response.json()["requested_version_elements"],
+            {
+                "id": [self.element.id],
+                "element_code": ["a"],
+                "element_value": ["A"],
+                "handbook": [[self.handbook.versions.get().id]],
+            },
+        )
+        self.assertNotEqual(response["ETag"], self.get()["ETag"])
+
+    def test_etag_per_variant(self):
+        etag = self.get()["ETag"]
+        binary = self.get(rendering.MSGPACK)
+        self.assertNotEqual(binary["ETag"], etag)
+
+        response = self.get(rendering.MSGPACK, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        response = self.get(rendering.MSGPACK, HTTP_IF_NONE_MATCH=binary["ETag"])
+        self.assertEqual(response.status_code, 304)
+
+    def test_binary_request_body(self):
+        body = {
+            "version": "1.0",
+            "element": {
+                "id": self.element.id,
+                "element_code": "a",
+                "element_value": "B",
+            },
+        }
+        for media_type, dumps in (
+            (rendering.MSGPACK, rendering.msgpack.packb),
+            (rendering.CBOR, rendering.cbor2.dumps),
+        ):
+            with self.subTest(media_type=media_type):
+                response = self.client.post(
+                    f"/element/validate/{self.handbook.id}/",
+                    dumps(body),
+                    content_type=media_type,
+                )
+                self.assertEqual(
+                    response.json(), {"validation_errors": {"element_value_error": "A"}}
+                )
+
+        response = self.client.post(
+            f"/element/validate/{self.handbook.id}/",
+            b"\xc1",
+            content_type=rendering.MSGPACK,
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+class LookupHandbookElementsTest(TerminologyTestCase):
+    def setUp(self):
+        super().setUp()
+        now = timezone.now()
+        self.handbook = make_handbook(
+            versions=(("1.0", now - timedelta(days=10)), ("2.0", now))
+        )
+        self.v1, self.v2 = self.handbook.versions.order_by("id")
+        for code, value, versions in (
+            ("a", "old A", [self.v1]),
+            ("a", "new A", [self.v2]),
+            ("b", "B", [self.v1, self.v2]),
+        ):
+            element = HandbookElement.objects.create(
+                element_code=code, element_value=value
+            )
+            element.handbook.add(*versions)
+        self.url = f"/element/lookup/{self.handbook.id}/"
+
+    def post(self, data):
+        return self.client.post(self.url, data, content_type="application/json")
+
+    @override_settings(SNAPSHOTS_ENABLED=False)
+    def test_current_version(self):
+        with self.assertNumQueries(3):  # two for version resolution
+            body = self.post({"codes": ["b", "a", "z"]}).json()
+
+        self.assertEqual(body["version_id"], self.v2.id)
+        self.assertEqual(
+            [(e["element_code"], e["element_value"]) for e in body["elements"]],
+            [("a", "new A"), ("b", "B")],
+        )
+        self.assertEqual(body["missing_codes"], ["z"])
+
+    def test_as_of_date(self):
+        date = (timezone.now() - timedelta(days=5)).strftime("%Y-%m-%d %X")
+        body = self.post({"codes": ["a"], "date": date}).json()
+
+        self.assertEqual(body["version_id"], self.v1.id)
+        self.assertEqual(body["elements"][0]["element_value"], "old A")
+
+    def test_errors(self):
+        self.assertEqual(self.post({"codes": "a"}).status_code, 400)
+        self.assertEqual(
+            self.post({"codes": ["a"], "date": "2000-01-01 00:00:00"}).status_code,
+            404,
+        )
+
+
+class SearchHandbookElementsTest(TerminologyTestCase):
+    def setUp(self):
+        super().setUp()
+        self.handbook = make_handbook(versions=(("1.0", timezone.now()),))
+        self.version = self.handbook.versions.get()
+        for code, value in (
+            ("J18.9", "Пневмония неуточнённая"),
+            ("J12", "Вирусная пневмония"),
+            ("J20", "Острый бронхит"),
+            ("PN1", "Плеврит"),
+        ):
+            element = HandbookElement.objects.create(
+                element_code=code, element_value=value
+            )
+            element.handbook.add(self.version)
+        self.url = f"/element/search/{self.handbook.id}/"
+
+    def search(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        return [element["element_code"] for element in response.json()["elements"]]
+
+    def test_prefix(self):
+        self.assertEqual(self.search(q="пнев", mode="prefix"), ["J18.9"])
+        self.assertEqual(self.search(q="j1", mode="prefix"), ["J12", "J18.9"])
+        self.assertEqual(self.search(q="п", mode="prefix"), ["J18.9", "PN1"])
+        self.assertEqual(
+            self.search(q="p", mode="prefix", field="element_code"), ["PN1"]
+        )
+
+    def test_fuzzy_ranks_prefix_matches_first(self):
+        # Missing and swapped letters
+        self.assertEqual(self.search(q="пнемония"), ["J12", "J18.9"])
+        self.assertEqual(self.search(q="пневмания"), ["J12", "J18.9"])
+        self.assertEqual(self.search(q="пневм"), ["J18.9", "J12"])
+        self.assertEqual(self.search(q="бронхт"), ["J20"])
+        self.assertEqual(self.search(q="пневмания", field="element_code"), [])
+
+    def test_pagination(self):
+        self.assertEqual(self.search(q="j", mode="prefix", limit=2), ["J12", "J18.9"])
+        self.assertEqual(self.search(q="j", mode="prefix", limit=2, offset=2), ["J20"])
+
+    def test_sees_new_elements(self):
+        self.search(q="плев")  # builds the index
+        element = HandbookElement.objects.create(
+            element_code="PN2", element_value="Плевральный выпот"
+        )
+        element.handbook.add(self.version)
+        self.assertEqual(self.search(q="плев"), ["PN1", "PN2"])
+
+    def test_too_large_versions_are_matched_by_prefix(self):
+        index_store = search.index_store
+        self.addCleanup(setattr, index_store, "max_bytes", index_store.max_bytes)
+        index_store.max_bytes = search.SearchIndex.MIN_ELEMENT_BYTES * 3
+
+        self.assertEqual(self.search(q="j1"), ["J12", "J18.9"])
+        self.assertEqual(self.search(q="пнемония"), [])
+        stats = index_store.stats()
+        self.assertEqual((stats["snapshots"], stats["too_large"]), (0, 1))
+
+    def test_invalid_params(self):
+        for params in (
+            {},
+            {"q": ""},
+            {"q": "x" * 256},
+            {"q": "a", "mode": "exact"},
+            {"q": "a", "field": "id"},
+        ):
+            with self.subTest(params=params):
+                self.assertEqual(self.client.get(self.url, params).status_code, 400)
+        response = self.client.get(self.url, {"q": "a", "version": "9.9"})
+        self.assertEqual(response.status_code, 404)
+
+    def test_trigrams_of_pg_trgm(self):
+        self.assertEqual(search.trigrams("Cat"), {"  c", " ca", "cat", "at "})
+        self.assertEqual(search.trigrams("a-b"), {"  a", " a ", "  b", " b "})
+
+    def test_postgres_query(self):
+        # Compiled only, the wrapper does not connect
+        postgresql = PostgreSQLDatabaseWrapper(connection.settings_dict, "postgresql")
+        sql, params = (
+            search.search_queryset(self.version.id, "50%")
+            .query.get_compiler(connection=postgresql)
+            .as_sql()
+        )
+        self.assertIn('"element_code" ILIKE %s', sql)
+        self.assertIn('"element_value" %%> %s', sql)
+        self.assertIn("50\\%%", params)
+        self.assertIn('"element_code" COLLATE "C"', sql.split("ORDER BY")[1])
+
+
+class SnapshotTest(TerminologyTestCase):
+    def setUp(self):
+        super().setUp()
+        self.handbook = make_handbook(versions=(("1.0", timezone.now()),))
+        self.version = self.handbook.versions.get()
+        other = HandbookVersion.objects.create(
+            handbook_identifier=self.handbook, version="0.9"
+        )
+        self.elements = []
+        for code in ("b", "a", "c", "a", "b"):
+            element = HandbookElement.objects.create(
+                element_code=code, element_value=code.upper()
+            )
+            element.handbook.add(self.version, *([other] if code == "b" else []))
+            self.elements.append(element)
+        self.url = f"/element/version/{self.handbook.id}/"
+
+    def pages(self, **params):
+        pages, cursor = [], ""
+        while cursor is not None:
+            body = self.client.get(
+                self.url, {"version": "1.0", "cursor": cursor, **params}
+            ).json()
+            pages.append(body["requested_version_elements"])
+            cursor = body["next"]
+        return pages
+
+    def test_pages_match_database_pages(self):
+        with self.settings(SNAPSHOTS_ENABLED=False):
+            expected = self.pages(limit=2)
+            expected_offset = self.client.get(
+                self.url, {"version": "1.0", "limit": 2, "offset": 3}
+            ).json()
+
+        self.assertEqual(self.pages(limit=2), expected)
+        with self.assertNumQueries(1):  # fingerprint check only
+            response = self.client.get(
+                self.url, {"version": "1.0", "limit": 2, "offset": 3}
+            )
+        self.assertEqual(response.json(), expected_offset)
+
+    def test_malformed_cursor_values_are_rejected(self):
+        for values in ([["a"], 1], [{"a": 1}, 1], ["a", "b"], [1, True], ["a", None]):
+            for enabled in (True, False):
+                with self.settings(SNAPSHOTS_ENABLED=enabled):
+                    response = self.client.get(
+                        self.url, {"version": "1.0", "cursor": encode_cursor(values)}
+                    )
+                self.assertEqual(response.status_code, 400, (values, enabled))
+
+    def test_database_pages_are_ordered_by_code_point(self):
+        # Compiled only, the wrapper does not connect
+        postgresql = PostgreSQLDatabaseWrapper(connection.settings_dict, "postgresql")
+        sql, _ = (
+            HandbookElement.objects.filter(element_code__codepoint__gt="a")
+            .order_by(*ELEMENT_ORDERING)
+            .query.get_compiler(connection=postgresql)
+            .as_sql()
+        )
+        self.assertIn('"element_code" COLLATE "C" > %s', sql)
+        self.assertIn(
+            'ORDER BY "terminology_handbookelement"."element_code" COLLATE "C"', sql
+        )
+
+    def test_lookups(self):
+        snapshot = build_snapshot(self.version.id, "")
+        first = self.elements[0]
+
+        self.assertEqual(snapshot.get_by_id(first.id)["element_code"], "b")
+        self.assertIsNone(snapshot.get_by_id(0))
+        self.assertEqual(
+            [e["id"] for e in snapshot.get_by_code("a")],
+            [self.elements[1].id, self.elements[3].id],
+        )
+        self.assertEqual(snapshot.get_by_code("z"), [])
+
+    def test_links_of_elements_not_read_are_skipped(self):
+        # Element 2 linked between reading elements and links
+        snapshot = VersionSnapshot(1, "", [(1, "a", "A")], [(1, 1), (2, 1)])
+        self.assertEqual(snapshot.get_by_id(1)["handbook"], [1])
+        self.assertIsNone(snapshot.get_by_id(2))
+
+    def test_dropped_when_elements_change(self):
+        self.client.get(self.url, {"version": "1.0"})
+        self.assertEqual(snapshot_store.stats()["snapshots"], 1)
+
+        self.elements[0].handbook.remove(self.version)
+        self.assertEqual(snapshot_store.stats()["snapshots"], 0)
+        body = self.client.get(self.url, {"version": "1.0", "limit": 100}).json()
+        self.assertEqual(len(body["requested_version_elements"]), 4)
+
+    def test_validation_uses_snapshot(self):
+        self.client.get(self.url, {"version": "1.0"})
+        element = self.elements[0]
+        with self.assertNumQueries(1):  # fingerprint check only
+            response = self.client.post(
+                f"/element/validate/{self.handbook.id}/",
+                {
+                    "version": "1.0",
+                    "element": {
+                        "id": element.id,
+                        "element_code": "b",
+                        "element_value": "X",
+                    },
+                },
+                content_type="application/json",
+            )
+        self.assertEqual(
+            response.json(), {"validation_errors": {"element_value_error": "B"}}
+        )
+
+    def test_lookup_drops_stale_snapshot(self):
+        def lookup():
+            response = self.client.post(
+                f"/element/lookup/{self.handbook.id}/",
+                {"codes": ["b"]},
+                content_type="application/json",
+            )
+            return [e["element_value"] for e in response.json()["elements"]]
+
+        self.assertEqual(lookup(), ["B", "B"])
+        # Changed by another process, whose signals reset the fingerprint
+        HandbookElement.objects.filter(id=self.elements[0].id).update(element_value="X")
+        HandbookVersion.objects.filter(handbook_identifier=self.handbook).update(
+            fingerprint=""
+        )
+        self.assertEqual(lookup(), ["X", "B"])
+
+    def set_max_bytes(self, max_bytes):
+        self.addCleanup(setattr, snapshot_store, "max_bytes", snapshot_store.max_bytes)
+        snapshot_store.max_bytes = max_bytes
+
+    def database_queries(self, **params):
+        with self.settings(SNAPSHOTS_ENABLED=False):
+            self.client.get(self.url, {"version": "1.0", **params})  # fingerprint
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get(self.url, {"version": "1.0", **params})
+        return len(queries)
+
+    def test_too_many_elements_are_not_built(self):
+        expected_queries = self.database_queries()
+        self.set_max_bytes(VersionSnapshot.MIN_ELEMENT_BYTES * 4)
+
+        # Counting elements once, then served by the database
+        with self.assertNumQueries(expected_queries + 1):
+            self.client.get(self.url, {"version": "1.0"})
+        with self.assertNumQueries(expected_queries):
+            self.client.get(self.url, {"version": "1.0"})
+        self.assertEqual(snapshot_store.stats()["snapshots"], 0)
+        self.assertEqual(snapshot_store.stats()["too_large"], 1)
+
+    def test_too_large_is_remembered_until_changed(self):
+        expected_queries = self.database_queries()
+        nbytes = build_snapshot(self.version.id, "").nbytes
+        self.assertGreater(nbytes, VersionSnapshot.MIN_ELEMENT_BYTES * 5)
+        self.set_max_bytes(nbytes - 1)
+
+        self.client.get(self.url, {"version": "1.0"})
+        self.assertEqual(snapshot_store.stats()["too_large"], 1)
+        with self.assertNumQueries(expected_queries):
+            body = self.client.get(self.url, {"version": "1.0", "limit": 10}).json()
+        self.assertEqual(len(body["requested_version_elements"]), 5)
+
+        self.elements[0].handbook.remove(self.version)
+        self.assertEqual(snapshot_store.stats()["too_large"], 0)
+        self.client.get(self.url, {"version": "1.0"})
+        self.assertEqual(snapshot_store.stats()["snapshots"], 1)
+
+    def test_store_is_bounded_by_bytes(self):
+        snapshots = [build_snapshot(self.version.id, "") for _ in range(3)]
+        store = SnapshotStore(max_bytes=snapshots[0].nbytes * 2, ttl=60)
+        for version_id, snapshot in enumerate(snapshots, start=1):
+            snapshot.version_id = version_id
+            store.put(snapshot)
+
+        self.assertIsNone(store.get(1))
+        self.assertIs(store.get(3), snapshots[2])
+        stats = store.stats()
+        self.assertLessEqual(stats["bytes"], stats["max_bytes"])
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 1))
+        self.assertEqual(stats["evictions"], 1)
+
+
+class WarmUpTest(TerminologyTestCase):
+    def setUp(self):
+        super().setUp()
+        now = timezone.now()
+        self.handbook = make_handbook(
+            versions=(
+                ("1.0", now - timedelta(days=1)),
+                ("2.0", now + timedelta(days=1)),
+            )
+        )
+        self.version = self.handbook.versions.get(version="1.0")
+        element = HandbookElement.objects.create(element_code="a", element_value="A")
+        element.handbook.add(self.version)
+
+    def tearDown(self):
+        warmup._ready = False
+
+    def test_ready_after_warm_up(self):
+        self.assertEqual(self.client.get("/ready/").status_code, 503)
+
+        summary = warmup.warm_up()
+
+        self.assertEqual(summary["versions"], 1)
+        self.assertEqual(self.client.get("/ready/").json(), {"ready": True})
+
+    def test_warms_versions_in_effect(self):
+        warmup.warm_versions(10)
+
+        self.assertEqual(
+            version_cache.get(("current", self.handbook.id)), self.version.id
+        )
+        self.assertEqual(snapshot_store.stats()["snapshots"], 1)
+        self.version.refresh_from_db()
+        self.assertNotEqual(self.version.fingerprint, "")
+        with self.assertNumQueries(1):  # fingerprint check only
+            self.client.get(f"/element/actual/{self.handbook.id}/")
+
+
+class BenchTest(TerminologyTestCase):
+    def test_seeded_versions_share_elements(self):
+        dataset = bench.seed_dataset(handbooks=2, versions=3, elements=4, shared=0.5)
+
+        self.assertEqual(dataset.element_rows, 2 * 8)
+        for version in HandbookVersion.objects.exclude(version=bench.WRITES_VERSION):
+            self.assertEqual(version.handbookelement_set.count(), 4)
+        self.assertEqual(
+            [code for _, code, _ in dataset.actual_elements],
+            ["C00000004", "C00000005", "C00000006", "C00000007"],
+        )
+        shared = HandbookElement.objects.filter(
+            element_code="C00000002",
+            handbook__handbook_identifier=dataset.handbook_ids[0],
+        ).distinct()
+        self.assertEqual(
+            sorted(shared.get().handbook.values_list("version", flat=True)),
+            ["1.0", "2.0"],
+        )
+
+    def test_cases_succeed(self):
+        dataset = bench.seed_dataset(handbooks=1, versions=2, elements=10)
+        cases = bench.build_cases(dataset)
+
+        for case in cases:
+            if case.route.startswith("async/"):
+                continue  # other connections, outside of the test transaction
+            result = bench.run_case(self.client, case, requests=1)
+            self.assertEqual(result["errors"], 0, case.name)
+        self.assertEqual(bench.uncovered_routes(cases), ["admin/*"])
+
+    def test_find_regressions(self):
+        endpoint = {
+            "name": "a",
+            "queries": 2,
+            "p50_ms": 10,
+            "peak_kib": 100,
+            "errors": 0,
+        }
+        baseline = {"endpoints": [endpoint]}
+        same = {"endpoints": [dict(endpoint, p50_ms=12)]}
+        worse = {"endpoints": [dict(endpoint, p50_ms=13, queries=3)]}
+
+        self.assertEqual(bench.find_regressions(same, baseline, 0.25), [])
+        self.assertEqual(len(bench.find_regressions(worse, baseline, 0.25)), 2)
+
+
+class MetricsTest(TerminologyTestCase):
+    def setUp(self):
+        super().setUp()
+        metrics.registry.clear()
+        self.handbook = make_handbook(versions=(("1.0", timezone.now()),))
+        element = HandbookElement.objects.create(element_code="a", element_value="A")
+        element.handbook.add(self.handbook.versions.get())
+
+    def route_stats(self, route):
+        merged, _ = metrics.registry.collect()
+        return merged[(route, "GET")]
+
+    def test_records_queries_and_sizes(self):
+        url = f"/element/actual/{self.handbook.id}/"
+        reset_queries()  # as request_started does
+        with CaptureQueriesContext(connection) as queries:
+            first = self.client.get(url)
+        first_queries = len(queries)
+        self.client.get(url)
+
+        stats = self.route_stats("element/actual/<int:handbook_id>/")
+        self.assertEqual(stats.count, 2)
+        self.assertEqual(sum(stats.buckets), 2)
+        self.assertEqual(stats.queries, first_queries + 1)  # then from snapshot
+        self.assertEqual(stats.bytes, 2 * len(first.content))
+
+    def test_records_streams_when_consumed(self):
+        response = self.client.get(
+            f"/element/export/{self.handbook.id}/", {"version": "1.0"}
+        )
+        content = b"".join(response.streaming_content)
+
+        stats = self.route_stats("element/export/<int:handbook_id>/")
+        self.assertEqual(stats.bytes, len(content))
+        self.assertGreater(stats.queries, 0)
+
+    def test_prometheus_format(self):
+        self.client.get("/handbook/")
+        self.client.get("/no/such/url/")
+
+        response = self.client.get("/metrics")
+
+        self.assertTrue(response["Content-Type"].startswith("text/plain"))
+        lines = response.content.decode().splitlines()
+        self.assertIn(
+            'terminology_request_duration_seconds_bucket{route="handbook/",'
+            'method="GET",le="+Inf"} 1',
+            lines,
+        )
+        self.assertIn(
+            'terminology_requests_total{route="<unmatched>",method="GET",'
+            'status="404"} 1',
+            lines,
+        )
+        self.assertIn("terminology_snapshots 0", lines)
+
+
+class HandbookVersionDiffTest(TerminologyTestCase):
+    def setUp(self):
+        super().setUp()
+        now = timezone.now()
+        self.handbook = make_handbook(
+            versions=(("1.0", now - timedelta(days=1)), ("2.0", now))
+        )
+        old = self.handbook.versions.get(version="1.0")
+        new = self.handbook.versions.get(version="2.0")
+        self.elements = {}
+        for key, code, value, versions in (
+            ("shared", "s", "S", (old, new)),
+            ("removed", "r", "R", (old,)),
+            ("added", "a", "A", (new,)),
+            ("changed_old", "c", "old", (old,)),
+            ("changed_new", "c", "new", (new,)),
+            ("recreated_old", "x", "X", (old,)),
+            ("recreated_new", "x", "X", (new,)),
+        ):
+            element = HandbookElement.objects.create(
+                element_code=code, element_value=value
+            )
+            element.handbook.add(*versions)
+            self.elements[key] = element
+        self.url = f"/element/diff/{self.handbook.id}/"
+
+    def test_changes(self):
+        response = self.client.get(self.url, {"from": "1.0", "to": "2.0"})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.json()["changes"],
+            [
+                {
+                    "change": "added",
+                    "id": self.elements["added"].id,
+                    "element_code": "a",
+                    "element_value": "A",
+                },
+                {
+                    "change": "changed",
+                    "id": self.elements["changed_new"].id,
+                    "element_code": "c",
+                    "element_value": "new",
+                    "previous": [
+                        {"id": self.elements["changed_old"].id, "element_value": "old"}
+                    ],
+                },
+                {
+                    "change": "removed",
+                    "id": self.elements["removed"].id,
+                    "element_code": "r",
+                    "element_value": "R",
+                },
+            ],
+        )
+
+    def test_postgres_query_uses_anti_joins(self):
+        # Compiled only, the wrapper does not connect
+        postgresql = PostgreSQLDatabaseWrapper(connection.settings_dict, "postgresql")
+        for queryset in (
+            diff.version_diff(1, 2),
+            diff._only_in(1, 2).filter(element_code__in=["a"]),
+        ):
+            sql, _ = queryset.query.get_compiler(connection=postgresql).as_sql()
+            # NOT (id IN (SELECT ...)) as exclude(id__in=...) compiles it
+            self.assertNotIn("IN (SELECT", sql)
+            self.assertNotIn("NOT IN", sql)
+            self.assertIn("NOT EXISTS", sql)
+
+    def test_reverse_and_same_version(self):
+        reverse = self.client.get(self.url, {"from": "2.0", "to": "1.0"}).json()
+        same = self.client.get(self.url, {"from": "1.0", "to": "1.0"}).json()
+
+        self.assertEqual(
+            [(c["change"], c["element_code"]) for c in reverse["changes"]],
+            [("removed", "a"), ("changed", "c"), ("added", "r")],
+        )
+        self.assertEqual(same["changes"], [])
+
+    def test_cursor_pages(self):
+        codes, cursor = [], ""
+        while cursor is not None:
+            body = self.client.get(
+                self.url, {"from": "1.0", "to": "2.0", "limit": 1, "cursor": cursor}
+            ).json()
+            codes += [change["element_code"] for change in body["changes"]]
+            cursor = body["next"]
+
+        self.assertEqual(codes, ["a", "c", "r"])
+
+    def test_errors_and_conditional_get(self):
+        self.assertEqual(self.client.get(self.url, {"from": "1.0"}).status_code, 400)
+        self.assertEqual(
+            self.client.get(self.url, {"from": "1.0", "to": "9.9"}).status_code, 404
+        )
+
+        etag = self.client.get(self.url, {"from": "1.0", "to": "2.0"})["ETag"]
+        response = self.client.get(
+            self.url, {"from": "1.0", "to": "2.0"}, HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, 304)
+
+        self.elements["shared"].handbook.remove(
+            self.handbook.versions.get(version="2.0")
+        )
+        response = self.client.get(
+            self.url, {"from": "1.0", "to": "2.0"}, HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()["changes"]), 4)
+
+
+class PostHandbookVersionForkTest(TerminologyTestCase):
+    def setUp(self):
+        super().setUp()
+        self.handbook = make_handbook(
+            versions=(("1.0", timezone.now() - timedelta(days=1)),)
+        )
+        self.source = self.handbook.versions.get()
+        for code in ("a", "b", "c"):
+            element = HandbookElement.objects.create(
+                element_code=code, element_value=code.upper()
+            )
+            element.handbook.add(self.source)
+        self.url = f"/version/fork/{self.handbook.id}/"
+
+    def fork(self, **data):
+        return self.client.post(
+            self.url,
+            {"from_version": "1.0", "version": "2.0", **data},
+            content_type="application/json",
+        )
+
+    def version_elements(self, version):
+        body = self.client.get(
+            f"/element/version/{self.handbook.id}/", {"version": version}
+        ).json()
+        return body["requested_version_elements"]
+
+    def test_fork_with_patch(self):
+        before = self.version_elements("1.0")
+
+        response = self.fork(
+            remove=["a"],
+            replace=[{"element_code": "b", "element_value": "B2"}],
+            add=[{"element_code": "d", "element_value": "D"}],
+        )
+
+        self.assertEqual(response.status_code, 201)
+        body = response.json()
+        self.assertEqual((body["copied"], body["removed"], body["added"]), (3, 2, 2))
+        self.assertEqual(
+            [
+                (e["element_code"], e["element_value"])
+                for e in self.version_elements("2.0")
+            ],
+            [("b", "B2"), ("c", "C"), ("d", "D")],
+        )
+        after = self.version_elements("1.0")
+        self.assertEqual([e["id"] for e in after], [e["id"] for e in before])
+        shared = after[2]
+        self.assertEqual(shared["handbook"], [self.source.id, body["version_id"]])
+
+    def test_change_feed(self):
+        since = self.client.get("/changes").json()["next_since"]
+
+        version_id = self.fork(remove=["a"]).json()["version_id"]
+
+        changes = self.client.get("/changes", {"since": since}).json()["changes"]
+        ids = dict(HandbookElement.objects.values_list("element_code", "id"))
+        self.assertEqual(changes[0]["kind"], "version")
+        self.assertEqual(changes[0]["id"], version_id)
+        copied = changes[1:4]
+        self.assertEqual(
+            sorted((c["kind"], c["action"], c["id"], c["version_id"]) for c in copied),
+            [("membership", "created", ids[code], version_id) for code in "abc"],
+        )
+        self.assertEqual(
+            [(c["kind"], c["action"], c["id"]) for c in changes[4:]],
+            [("membership", "deleted", ids["a"])],
+        )
+
+    def test_errors(self):
+        self.assertEqual(self.fork(from_version="9.9").status_code, 404)
+        self.assertEqual(self.fork(add=[{"element_code": "x"}]).status_code, 400)
+        self.assertEqual(self.fork(version="1.0").status_code, 400)
+        with self.settings(FORK_MAX_PATCH_ITEMS=1):
+            self.assertEqual(self.fork(remove=["a", "b"]).status_code, 400)
+        self.assertEqual(HandbookVersion.objects.count(), 1)
+
+
+class ChangeFeedTest(TerminologyTestCase):
+    def feed(self, **params):
+        return self.client.get("/changes", params)
+
+    def test_records_changes(self):
+        handbook = make_handbook(versions=(("1.0", timezone.now()),))
+        version = handbook.versions.get()
+        element = HandbookElement.objects.create(element_code="a", element_value="A")
+        element.handbook.add(version)
+        element.element_value = "B"
+        element.save()
+        element.handbook.clear()
+        element_id = element.id
+        element.delete()
+
+        body = self.feed().json()
+
+        self.assertEqual(
+            [(c["kind"], c["action"], c["id"]) for c in body["changes"]],
+            [
+                ("handbook", "created", handbook.id),
+                ("version", "created", version.id),
+                ("element", "created", element_id),
+                ("membership", "created", element_id),
+                ("element", "updated", element_id),
+                ("membership", "deleted", element_id),
+                ("element", "deleted", element_id),
+            ],
+        )
+        self.assertEqual(body["changes"][3]["version_id"], version.id)
+        self.assertEqual(body["next_since"], body["changes"][-1]["seq"])
+        self.assertFalse(body["more"])
+
+    def test_bulk_elements(self):
+        make_handbook(versions=(("1.0", timezone.now()),))
+        since = self.feed().json()["next_since"]
+
+        self.client.post(
+            "/element/bulk/",
+            {
+                "handbook_elements": [
+                    {"handbook": ["1.0"], "element_code": "a", "element_value": "A"}
+                ]
+            },
+            content_type="application/json",
+        )
+
+        body = self.feed(since=since).json()
+        self.assertEqual(
+            [(c["kind"], c["action"]) for c in body["changes"]],
+            [("element", "created"), ("membership", "created")],
+        )
+
+    def test_batches(self):
+        for name in ("a", "b", "c"):
+            make_handbook(name)
+
+        first = self.feed(limit=2).json()
+        second = self.feed(since=first["next_since"], limit=2).json()
+
+        self.assertEqual(len(first["changes"]), 2)
+        self.assertTrue(first["more"])
+        self.assertEqual(len(second["changes"]), 1)
+        self.assertFalse(second["more"])
+        self.assertEqual(self.feed(since="x").status_code, 400)
+
+    def test_waits_for_recent_gaps(self):
+        for name in ("a", "b", "c"):
+            make_handbook(name)
+        seqs = list(Change.objects.order_by("seq").values_list("seq", flat=True))
+        Change.objects.filter(seq=seqs[1]).delete()  # as if not yet committed
+
+        body = self.feed().json()
+        self.assertEqual([c["seq"] for c in body["changes"]], seqs[:1])
+        self.assertTrue(body["more"])
+
+        Change.objects.update(created=timezone.now() - timedelta(hours=1))
+        body = self.feed().json()
+        self.assertEqual([c["seq"] for c in body["changes"]], [seqs[0], seqs[2]])
+
+    def test_compaction_and_retention(self):
+        handbook = make_handbook()
+        handbook.name = "renamed"
+        handbook.save()
+        other = make_handbook("other")
+        old = timezone.now() - timedelta(days=2)
+        Change.objects.update(created=old)
+        recent = make_handbook("recent")
+        recent = Change.objects.get(object_id=recent.id, kind=Change.HANDBOOK).seq
+
+        compacted, pruned = changes.compact()
+
+        self.assertEqual((compacted, pruned), (1, 0))
+        self.assertEqual(
+            [(c["id"], c["action"]) for c in self.feed().json()["changes"][:2]],
+            [(handbook.id, "updated"), (other.id, "created")],
+        )
+
+        last_old = Change.objects.filter(object_id=other.id).get().seq
+        compacted, pruned = changes.compact(now=old + timedelta(days=31))
+
+        self.assertEqual((compacted, pruned), (0, 2))
+        self.assertEqual(self.feed(since=last_old).json()["changes"][0]["seq"], recent)
+        response = self.feed(since=0)
+        self.assertEqual(response.status_code, 410)
+        # The recent change may still have earlier ones in flight
+        self.assertEqual(
+            response.json(), {"pruned_through": last_old, "head_seq": last_old}
+        )
+
+        Change.objects.update(created=timezone.now() - timedelta(hours=1))
+        self.assertEqual(self.feed(since=0).json()["head_seq"], recent)
+
+
+class ImportHandbookTest(TerminologyTestCase):
+    def setUp(self):
+        super().setUp()
+        self.handbook = make_handbook()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def write(self, name, rows):
+        path = os.path.join(self.directory, name)
+        with open(path, "w", newline="") as f:
+            if name.endswith(".csv"):
+                writer = csv.writer(f)
+                writer.writerow(("id", "element_code", "element_value"))
+                writer.writerows((i, *row) for i, row in enumerate(rows))
+            else:
+                for code, value in rows:
+                    f.write(json.dumps({"element_code": code, "element_value": value}))
+                    f.write("\n")
+        return path
+
+    def import_file(self, path, version, **options):
+        call_command(
+            "import_handbook",
+            path,
+            handbook=self.handbook.id,
+            handbook_version=version,
+            stdout=io.StringIO(),
+            **options,
+        )
+        return HandbookVersion.objects.get(version=version)
+
+    def elements(self, version):
+        return sorted(
+            version.handbookelement_set.values_list("element_code", "element_value")
+        )
+
+    def test_imports_release_sharing_elements_of_other_versions(self):
+        first = [("a", "A"), ("b", "B"), ("c", "C")]
+        second = [("a", "A"), ("b", "B2"), ("d", "D"), ("d", "D")]
+        version = self.import_file(self.write("1.csv", first), "1.0")
+        shared = HandbookElement.objects.get(element_code="a")
+        new_version = self.import_file(
+            self.write("2.ndjson", second), "2.0", chunk_size=2
+        )
+
+        self.assertEqual(self.elements(version), first)
+        self.assertEqual(self.elements(new_version), sorted(set(second)))
+        self.assertEqual(
+            sorted(shared.handbook.values_list("id", flat=True)),
+            [version.id, new_version.id],
+        )
+        self.assertEqual(HandbookElement.objects.count(), 5)
+        self.assertFalse(StagedElement.objects.exists())
+        self.assertFalse(ImportJob.objects.filter(finished=None).exists())
+        memberships = Change.objects.filter(
+            kind=Change.MEMBERSHIP, related_id=new_version.id
+        )
+        self.assertEqual(memberships.count(), 3)
+
+    def test_warns_of_merges_longer_than_feed_settling(self):
+        stderr = io.StringIO()
+        with self.settings(CHANGE_FEED_SETTLE_SECONDS=-1):
+            self.import_file(self.write("1.csv", [("a", "A")]), "1.0", stderr=stderr)
+        self.assertIn(
+            f"Resync mirrors of handbook {self.handbook.id}", stderr.getvalue()
+        )
+
+    def test_imports_are_idempotent(self):
+        path = self.write("1.csv", [("a", "A")])
+        self.import_file(path, "1.0")
+        version = self.import_file(path, "1.0")
+
+        self.assertEqual(self.elements(version), [("a", "A")])
+        self.assertEqual(HandbookElement.objects.count(), 1)
+
+    def test_resumes_after_last_staged_chunk(self):
+        rows = [(f"c{i}", "v") for i in range(5)]
+        path = self.write("1.csv", rows)
+        job = imports.get_job(self.handbook.id, "1.0", path)
+
+        def failing():
+            yield from rows[:3]
+            raise OSError("disk gone")
+
+        with self.assertRaises(OSError):
+            imports.stage(job, failing(), chunk_size=2)
+        self.assertEqual(job.staged_rows, 2)
+
+        version = self.import_file(path, "1.0", chunk_size=2)
+        self.assertEqual(self.elements(version), rows)
+        self.assertEqual(ImportJob.objects.get().id, job.id)
+
+    def test_changed_file_needs_restart(self):
+        path = self.write("1.csv", [("a", "A")])
+        imports.get_job(self.handbook.id, "1.0", path)
+        self.write("1.csv", [("a", "A"), ("b", "B")])
+
+        with self.assertRaises(CommandError):
+            self.import_file(path, "1.0")
+        version = self.import_file(path, "1.0", restart=True)
+        self.assertEqual(self.elements(version), [("a", "A"), ("b", "B")])
+
+    def test_invalid_rows_are_rejected(self):
+        path = self.write("1.ndjson", [("a", "A"), ("b", "")])
+
+        with self.assertRaises(CommandError):
+            self.import_file(path, "1.0")
+        self.assertFalse(HandbookVersion.objects.exists())
+
+
+class ReplicaPoolTest(TestCase):
+    def make_pool(self, lags, **weights):
+        self.now = 0.0
+
+        def lag(alias):
+            if isinstance(lags[alias], Exception):
+                raise lags[alias]
+            return lags[alias]
+
+        return replicas.ReplicaPool(
+            weights, max_lag=5, check_interval=10, lag=lag, clock=lambda: self.now
+        )
+
+    def test_picks_by_weight(self):
+        pool = self.make_pool({"a": 0, "b": 0}, a=3, b=1)
+        pool.random.seed(0)
+        picks = [pool.choose() for _ in range(4000)]
+
+        self.assertAlmostEqual(picks.count("a") / len(picks), 0.75, delta=0.03)
+
+    def test_lagging_replica_is_out_of_rotation_until_next_check(self):
+        lags = {"a": 0, "b": 60}
+        pool = self.make_pool(lags, a=1, b=1)
+        with self.assertLogs("terminology.replicas", "WARNING"):
+            self.assertEqual(pool.healthy(), ["a"])
+
+        lags["b"] = 1
+        self.now = 5
+        self.assertEqual(pool.healthy(), ["a"])
+        self.now = 10
+        self.assertEqual(pool.healthy(), ["a", "b"])
+
+    def test_failing_replicas_are_skipped(self):
+        lags = {"default": DatabaseError("down")}
+        pool = self.make_pool(lags, default=1)
+
+        with self.assertLogs("terminology.replicas", "WARNING"):
+            self.assertIsNone(pool.choose())
+        self.now = 10
+        lags["default"] = 0
+        self.assertEqual(pool.choose(), "default")
+
+
+class ReplicaRoutingTest(TestCase):
+    def setUp(self):
+        pool = replicas.ReplicaPool(
+            {"replica": 1}, max_lag=5, check_interval=10, lag=lambda alias: 0
+        )
+        self.addCleanup(setattr, replicas, "replica_pool", replicas.replica_pool)
+        replicas.replica_pool = pool
+
+    def route(self, method, view, cookies=None, write=False):
+        """Response with the database reads of the request went to as content."""
+        request = RequestFactory().generic(method, "/")
+        request.COOKIES.update(cookies or {})
+
+        def get_response(request):
+            middleware.process_view(request, view, (), {})
+            if write:
+                router.db_for_write(Handbook)
+            return HttpResponse(router.db_for_read(Handbook))
+
+        middleware = replicas.ReplicaMiddleware(get_response)
+        return middleware(request)
+
+    def test_reads_of_read_only_requests_go_to_replica(self):
+        get_view = views.GetHandbooksFull.as_view()
+        validation_view = views.ElementHandbookValidation.as_view()
+
+        self.assertEqual(self.route("GET", get_view).content, b"replica")
+        self.assertEqual(self.route("POST", validation_view).content, b"replica")
+        self.assertEqual(router.db_for_read(Handbook), "default")
+
+    def test_writes_stick_to_primary(self):
+        write_view = views.PostHandbook.as_view()
+        response = self.route("POST", write_view, write=True)
+
+        self.assertEqual(response.content, b"default")
+        self.assertIn(replicas.STICKY_COOKIE, response.cookies)
+        cookies = {replicas.STICKY_COOKIE: "1"}
+        response = self.route("GET", views.GetHandbooksFull.as_view(), cookies)
+        self.assertEqual(response.content, b"default")
+
+    def test_reads_after_write_go_to_primary(self):
+        response = self.route("GET", views.GetHandbooksFull.as_view(), write=True)
+
+        self.assertEqual(response.content, b"default")
+        self.assertNotIn(replicas.STICKY_COOKIE, response.cookies)
+
+    def test_instances_of_replicas_are_saved_to_primary(self):
+        handbook = Handbook(name="h", short_name="h", description="-")
+        handbook._state.db = "replica"
+
+        self.assertEqual(router.db_for_write(Handbook, instance=handbook), "default")
+        self.assertFalse(router.allow_migrate("replica", "terminology"))
+
+
+class AsyncViewsTest(TransactionTestCase):
+    # Pool threads use their own connections, so data has to be committed.
+
+    def setUp(self):
+        version_cache.clear()
+        snapshot_store.clear()
+        self.handbook = make_handbook(versions=(("1.0", timezone.now()),))
+        self.element = HandbookElement.objects.create(
+            element_code="a", element_value="A"
+        )
+        self.element.handbook.add(self.handbook.versions.get())
+        self.client = AsyncClient()
+
+    async def test_reads_match_sync_views(self):
+        for url, params in (
+            ("/handbook/", {}),
+            (f"/element/version/{self.handbook.id}/", {"version": "1.0"}),
+            (f"/element/actual/{self.handbook.id}/", {"cursor": ""}),
+        ):
+            with self.subTest(url=url):
+                # AsyncClient of Django 3.2 drops GET data
+                response = await self.client.get(f"/async{url}?{urlencode(params)}")
+                expected = await sync_to_async(Client().get)(url, params)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.json(), expected.json())
+
+    async def test_recent_validation(self):
+        payload = {
+            "elements": [
+                {"id": self.element.id, "element_code": "b", "element_value": "A"}
+            ]
+        }
+        url = f"/async/element/validate_recent/{self.handbook.id}/"
+        for options in (
+            {"ASYNC_CPU_MIN_ELEMENTS": 0},  # process pool
+            {"ASYNC_CPU_MIN_ELEMENTS": 5000},  # DB threads over the snapshot
+            {"ASYNC_CPU_MIN_ELEMENTS": 0, "ASYNC_CPU_MAX_REFERENCE_ROWS": 0},
+            {"ASYNC_CPU_MIN_ELEMENTS": 0, "SNAPSHOTS_ENABLED": False},  # cursor
+        ):
+            with self.subTest(**options):
+                with self.settings(**options):
+                    response = await self.client.post(
+                        url, payload, content_type="application/json"
+                    )
+                errors = response.json()["validation_errors"]
+                self.assertEqual(
+                    errors["code_errors"][0]["element_code_error"]["element_code"],
+                    "a",
+                )
+
+        response = await self.client.post(url, {}, content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+
+
+class AdminTest(TerminologyTestCase):
+    def setUp(self):
+        super().setUp()
+        now = timezone.now()
+        self.handbook = make_handbook(versions=(("1.0", now), ("2.0", now)))
+        self.v1, self.v2 = self.handbook.versions.order_by("version")
+        self.client.force_login(
+            User.objects.create_superuser("admin", "admin@example.com", "admin")
+        )
+        self.url = "/admin/terminology/handbookelement/"
+
+    def add_elements(self, count, versions):
+        for i in range(count):
+            element = HandbookElement.objects.create(
+                element_code=f"J{HandbookElement.objects.count():02d}",
+                element_value=f"значение {i}",
+            )
+            element.handbook.add(*versions)
+
+    def test_changelist_query_count_does_not_depend_on_rows(self):
+        self.add_elements(2, [self.v1, self.v2])
+        with CaptureQueriesContext(connection) as few:
+            self.assertEqual(self.client.get(self.url).status_code, 200)
+        self.add_elements(20, [self.v1, self.v2])
+        with CaptureQueriesContext(connection) as many:
+            response = self.client.get(self.url)
+        self.assertContains(response, str(self.v2))
+        self.assertEqual(len(many), len(few))
+
+    def test_version_filter_and_search(self):
+        self.add_elements(3, [self.v1])
+        self.add_elements(2, [self.v2])
+
+        response = self.client.get(self.url, {"version": self.v2.id})
+        self.assertEqual(
+            [element.element_code for element in response.context["cl"].result_list],
+            ["J04", "J03"],
+        )
+        response = self.client.get(self.url, {"q": "j0"})
+        self.assertEqual(response.context["cl"].result_count, 5)
+        response = self.client.get(self.url, {"q": "значение j01"})
+        self.assertEqual(response.context["cl"].result_count, 1)
+
+    @override_settings(ADMIN_VERSION_FILTER_CHOICES=1)
+    def test_version_filter_choices_are_bounded(self):
+        other = make_handbook("other", versions=(("1.0", timezone.now()),))
+        latest = other.versions.get()
+
+        def choices(**params):
+            response = self.client.get(self.url, params)
+            return [
+                str(version)
+                for _, version in response.context["cl"].filter_specs[0].lookup_choices
+            ]
+
+        self.assertEqual(choices(), [str(latest)])
+        # Versions of the selected one's handbook
+        self.assertEqual(choices(version=self.v1.id), [str(self.v1), str(self.v2)])
+        response = self.client.get(self.url, {"version": "x"})
+        self.assertRedirects(response, f"{self.url}?e=1", fetch_redirect_response=False)
+
+    def test_counts_other_backends(self):
+        self.add_elements(3, [self.v1])
+        paginator = EstimatedCountPaginator(HandbookElement.objects.order_by("id"), 2)
+        self.assertEqual(paginator.count, 3)
+
+    def test_versions_are_autocompleted(self):
+        self.add_elements(1, [self.v1])
+        element = HandbookElement.objects.get()
+        response = self.client.get(f"{self.url}{element.id}/change/")
+        self.assertContains(response, "admin-autocomplete")
+        self.assertContains(response, str(self.v1))
+        self.assertNotContains(response, str(self.v2))
+
+        response = self.client.get(
+            "/admin/autocomplete/",
+            {
+                "term": "2.0",
+                "app_label": "terminology",
+                "model_name": "handbookelement",
+                "field_name": "handbook",
+            },
+        )
+        self.assertEqual(
+            response.json()["results"], [{"id": str(self.v2.id), "text": str(self.v2)}]
+        )
@@ -1,8 +1,131 @@
+import base64
+import json
+
+from django.conf import settings
+from django.db.models import CharField, Q, Transform
+from django.db.models.constants import LOOKUP_SEP
+from django.utils import timezone
+from django.utils.datetime_safe import datetime
+
+DEFAULT_LIMIT = 10
+
+
+class CodePoint(Transform):
+    """
+    Text compared by code point, as Python and SQLite compare it, instead of
+    by the database collation. Snapshot pages and database pages of elements
+    are ordered the same way by it.
+    """
+
+    lookup_name = "codepoint"
+
+    def as_sql(self, compiler, connection):
+        return compiler.compile(self.lhs)
+
+    def as_postgresql(self, compiler, connection):
+        lhs, params = compiler.compile(self.lhs)
+        return f'{lhs} COLLATE "C"', params
+
+
+CharField.register_lookup(CodePoint)
+
+# Elements by code and id, served by element_code_c_idx on PostgreSQL
+ELEMENT_ORDERING = ("element_code__codepoint", "id")
+
+
 def get_limit_offset_by_request(request):
+    limit = _get_int_param(request, "limit", DEFAULT_LIMIT, minimum=1)
+    offset = _get_int_param(request, "offset", 0, minimum=0)
+    return min(limit, settings.MAX_PAGE_SIZE), offset
+
+
+def _get_int_param(request, name, default, minimum):
     try:
-        limit = request.GET["limit"]
-        offset = request.GET["offset"]
-    except KeyError:
-        limit = 10
-        offset = 0
-    return limit, offset
+        value = int(request.GET[name])
+    except (KeyError, ValueError):
+        return default
+    return value if value >= minimum else default
+
+
+def parse_date_param(date_string):
+    """Aware datetime from "%Y-%m-%d %X" params, raises ValueError."""
+    dt_date = datetime.strptime(date_string, "%Y-%m-%d %X")
+    if timezone.is_naive(dt_date):
+        dt_date = timezone.make_aware(dt_date)
+    return dt_date
+
+
+def encode_cursor(values):
+    raw = json.dumps(values, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor, size):
+    """
+    Raises ValueError on cursors not produced by encode_cursor, which hold
+    ints and strings only.
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (TypeError, ValueError):
+        raise ValueError(f"malformed cursor {cursor!r}")
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError(f"malformed cursor {cursor!r}")
+    for value in values:
+        if isinstance(value, bool) or not isinstance(value, (int, str)):
+            raise ValueError(f"malformed cursor {cursor!r}")
+    return values
+
+
+def _keyset_filter(ordering, values):
+    # (a, b) > (x, y)  <=>  a > x OR (a = x AND b > y)
+    condition = Q()
+    for i, field in enumerate(ordering):
+        step = Q(**{f"{field}__gt": values[i]})
+        for prev_field, prev_value in zip(ordering[:i], values[:i]):
+            step &= Q(**{prev_field: prev_value})
+        condition |= step
+    return condition
+
+
+def _row_value(row, field):
+    # Transforms of the ordering, e.g. __codepoint, keep field values
+    field = field.split(LOOKUP_SEP)[0]
+    return row[field] if isinstance(row, dict) else getattr(row, field)
+
+
+def get_page_by_request(request, queryset, ordering):
+    """
+    Slices queryset according to request pagination params.
+
+    Keyset mode is used when a "cursor" param is present (empty for the first
+    page): rows strictly after the cursor position in the given ordering are
+    returned, without OFFSET scans. Otherwise falls back to limit/offset.
+
+    Returns (rows, next_cursor). next_cursor is None in limit/offset mode and
+    on the last page. Raises ValueError on a malformed cursor.
+    """
+    limit, offset = get_limit_offset_by_request(request)
+    queryset = queryset.order_by(*ordering)
+
+    cursor = request.GET.get("cursor")
+    if cursor is None:
+        return list(queryset[offset : offset + limit]), None
+
+    if cursor:
+        queryset = queryset.filter(
+            _keyset_filter(ordering, decode_cursor(cursor, len(ordering)))
+        )
+    rows = list(queryset[: limit + 1])
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor([_row_value(rows[-1], f) for f in ordering])
+
+
+def with_next_cursor(request, response_data, next_cursor):
+    """Adds "next" to the response body of keyset paginated requests only."""
+    if "cursor" in request.GET:
+        response_data["next"] = next_cursor
+    return response_data
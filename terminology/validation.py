@@ -0,0 +1,118 @@
+"""
+Validation of received handbook elements against reference elements.
+
+Received elements are matched to reference elements by id and their
+element_code/element_value are compared with the matched reference element
+only. Reference rows are consumed as a stream of (id, element_code,
+element_value) tuples, so they can come straight from a database cursor.
+
+Two strategies give identical reports:
+    "hash"  - indexes received elements in a dict, reference rows in any order.
+    "merge" - sorts received elements in place and merge-joins them with
+              reference rows, which must be ordered by id. No index is built,
+              so memory stays bounded by the payload itself.
+"""
+from dataclasses import dataclass, field
+from operator import itemgetter
+
+HASH = "hash"
+MERGE = "merge"
+
+
+@dataclass
+class ValidationReport:
+    # Received ids absent from the reference
+    missing_ids: list = field(default_factory=list)
+    # Reference ids absent from the received elements
+    unexpected_ids: list = field(default_factory=list)
+    matched_count: int = 0
+    code_error_ids: list = field(default_factory=list)
+    value_error_ids: list = field(default_factory=list)
+
+
+def validate_elements(reference_rows, received_elements, strategy=HASH):
+    """
+    Raises KeyError/TypeError on received elements lacking id, element_code
+    or element_value.
+    """
+    if strategy == HASH:
+        return _validate_hashed(reference_rows, received_elements)
+    if strategy == MERGE:
+        return _validate_merged(reference_rows, received_elements)
+    raise ValueError(f"unknown validation strategy {strategy!r}")
+
+
+def element_errors(received, reference):
+    """
+    Errors of a single received element against the reference
+    (element_code, element_value) pair with its id, None if there is none.
+    """
+    if reference is None:
+        return {"id_error": f'no such id {received["id"]}'}
+    code, value = reference
+    errors = {}
+    if code != received["element_code"]:
+        errors.update({"element_code_error": code})
+    if value != received["element_value"]:
+        errors.update({"element_value_error": value})
+    return errors
+
+
+def _compare(report, element_id, code, value, received):
+    report.matched_count += 1
+    if received["element_code"] != code:
+        report.code_error_ids.append(element_id)
+    if received["element_value"] != value:
+        report.value_error_ids.append(element_id)
+
+
+def _validate_hashed(reference_rows, received_elements):
+    report = ValidationReport()
+    received_by_id = {element["id"]: element for element in received_elements}
+
+    for element_id, code, value in reference_rows:
+        received = received_by_id.pop(element_id, None)
+        if received is None:
+            report.unexpected_ids.append(element_id)
+        else:
+            _compare(report, element_id, code, value, received)
+
+    report.missing_ids.extend(sorted(received_by_id))
+    return report
+
+
+def _validate_merged(reference_rows, received_elements):
+    report = ValidationReport()
+    received_elements.sort(key=itemgetter("id"))
+    received_count = len(received_elements)
+    position = 0
+
+    for element_id, code, value in reference_rows:
+        while (
+            position < received_count
+            and received_elements[position]["id"] < element_id
+        ):
+            report.missing_ids.append(received_elements[position]["id"])
+            position = _skip_duplicates(received_elements, position)
+        if (
+            position < received_count
+            and received_elements[position]["id"] == element_id
+        ):
+            position = _skip_duplicates(received_elements, position)
+            _compare(report, element_id, code, value, received_elements[position - 1])
+        else:
+            report.unexpected_ids.append(element_id)
+
+    while position < received_count:
+        report.missing_ids.append(received_elements[position]["id"])
+        position = _skip_duplicates(received_elements, position)
+    return report
+
+
+def _skip_duplicates(elements, position):
+    """Position past the run of elements sharing the id at position."""
+    element_id = elements[position]["id"]
+    position += 1
+    while position < len(elements) and elements[position]["id"] == element_id:
+        position += 1
+    return position
@@ -0,0 +1,178 @@
+"""
+In-process cache of handbook -> version id resolution.
+
+Resolving which version of a handbook is current, or which id a named
+version has, is done on almost every element request while the mapping only
+changes when a version is published. Entries live for VERSION_CACHE_TTL
+seconds at most and the least recently used ones are evicted past
+VERSION_CACHE_SIZE. post_save/post_delete of HandbookVersion drop the
+affected entries of the current process, other workers catch up on TTL.
+"""
+import threading
+import time
+from collections import OrderedDict
+from functools import reduce
+from operator import or_
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from terminology.models import HandbookVersion
+
+
+class VersionResolutionCache:
+    def __init__(self, maxsize, ttl, clock=time.time):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self._entries = OrderedDict()  # key -> (version_id, expires_at)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            try:
+                version_id, expires_at = self._entries[key]
+            except KeyError:
+                return None
+            if expires_at <= self.clock():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return version_id
+
+    def set(self, key, version_id, expires_at=None):
+        ttl_expiry = self.clock() + self.ttl
+        if expires_at is None or expires_at > ttl_expiry:
+            expires_at = ttl_expiry
+        with self._lock:
+            self._entries[key] = (version_id, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, handbook_id, version_id=None):
+        """Drops entries of the handbook and entries resolving to version_id."""
+        with self._lock:
+            stale = [
+                key
+                for key, (cached_id, _) in self._entries.items()
+                if key[1] == handbook_id
+                or (version_id is not None and cached_id == version_id)
+            ]
+            for key in stale:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+version_cache = VersionResolutionCache(
+    maxsize=settings.VERSION_CACHE_SIZE, ttl=settings.VERSION_CACHE_TTL
+)
+
+
+def get_current_version_id(handbook_id):
+    """
+    Id of the version in effect now, i.e. with the latest starting_date in the
+    past. The entry expires when the next scheduled version starts, so a
+    future version switches in on time.
+
+    Raises HandbookVersion.DoesNotExist if no version is in effect.
+    """
+    key = ("current", handbook_id)
+    version_id = version_cache.get(key)
+    if version_id is not None:
+        return version_id
+
+    now = timezone.now()
+    versions_qs = HandbookVersion.objects.filter(handbook_identifier=handbook_id)
+    version_id = (
+        versions_qs.filter(starting_date__lte=now)
+        .order_by("-starting_date", "-id")
+        .values_list("id", flat=True)
+        .first()
+    )
+    if version_id is None:
+        raise HandbookVersion.DoesNotExist(
+            f"handbook {handbook_id} has no version in effect"
+        )
+    next_start = (
+        versions_qs.filter(starting_date__gt=now)
+        .order_by("starting_date")
+        .values_list("starting_date", flat=True)
+        .first()
+    )
+    version_cache.set(
+        key, version_id, next_start.timestamp() if next_start else None
+    )
+    return version_id
+
+
+def get_version_id(handbook_id, version):
+    """
+    Raises HandbookVersion.DoesNotExist for unknown versions. Duplicate
+    version names of a handbook resolve to the oldest one.
+    """
+    key = ("version", handbook_id, version)
+    version_id = version_cache.get(key)
+    if version_id is None:
+        version_id = (
+            HandbookVersion.objects.filter(
+                handbook_identifier=handbook_id, version=version
+            )
+            .order_by("id")
+            .values_list("id", flat=True)
+            .first()
+        )
+        if version_id is None:
+            raise HandbookVersion.DoesNotExist(
+                f"handbook {handbook_id} has no version {version!r}"
+            )
+        version_cache.set(key, version_id)
+    return version_id
+
+
+def get_version_ids(handbook_versions):
+    """
+    Resolves many (handbook_id, version) pairs with at most one query.
+
+    Returns a dict of pair -> version id, unknown versions are left out.
+    """
+    resolved, missing = {}, set()
+    for handbook_id, version in handbook_versions:
+        version_id = version_cache.get(("version", handbook_id, version))
+        if version_id is None:
+            missing.add((handbook_id, version))
+        else:
+            resolved[(handbook_id, version)] = version_id
+    if not missing:
+        return resolved
+
+    condition = reduce(
+        or_,
+        (
+            Q(handbook_identifier=handbook_id, version=version)
+            for handbook_id, version in missing
+        ),
+    )
+    versions_qs = (
+        HandbookVersion.objects.filter(condition)
+        .order_by("-id")
+        .values_list("handbook_identifier", "version", "id")
+    )
+    # Duplicate version names of a handbook resolve to the oldest one.
+    for handbook_id, version, version_id in versions_qs:
+        resolved[(handbook_id, version)] = version_id
+    for key in missing:
+        if key in resolved:
+            version_cache.set(("version",) + key, resolved[key])
+    return resolved
+
+
+def invalidate_version(sender, instance, **kwargs):
+    version_cache.invalidate(instance.handbook_identifier_id, instance.id)
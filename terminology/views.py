@@ -1,27 +1,158 @@
-from django.core.exceptions import ObjectDoesNotExist
-from django.http import JsonResponse, HttpResponse
-from django.utils.datetime_safe import datetime
+from django.conf import settings
+from django.db import connections, router
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
 from drf_yasg.utils import swagger_auto_schema
 from rest_framework.views import APIView
+from terminology import (
+    changes,
+    diff,
+    export,
+    fieldsets,
+    metrics,
+    rendering,
+    search,
+    validation,
+    warmup,
+)
+from terminology.bulk import bulk_create_elements
+from terminology.fork import fork_version
 from terminology.models import Handbook, HandbookVersion, HandbookElement
 from terminology.serializers import (
     HandbookModelSerializer,
     HandbookFullSerializer,
     HandbookElementSerializer,
+    HandbookElementBulkSerializer,
+    HandbookVersionForkSerializer,
     HandbookVersionSerializer,
     HandbookVersionSerializerDeep,
 )
 import logging
-from terminology.utils import get_limit_offset_by_request
+from terminology.fingerprint import get_version_state
+from terminology.snapshots import get_snapshot, snapshot_store
+from terminology.version_cache import (
+    get_current_version_id,
+    get_version_id,
+    get_version_ids,
+)
+from terminology.utils import (
+    ELEMENT_ORDERING,
+    get_limit_offset_by_request,
+    get_page_by_request,
+    parse_date_param,
+    with_next_cursor,
+)
+
+ELEMENT_COLUMNS = (*rendering.ELEMENT_FIELDS, "handbook")
+
+
+def _get_version_state(request, version_id):
+    # etag and last_modified functions of condition() share one lookup
+    states = request.__dict__.setdefault("_version_states", {})
+    if version_id not in states:
+        states[version_id] = get_version_state(version_id)
+    return states[version_id]
+
+
+def _recent_version_state(request, handbook_id):
+    return _get_version_state(request, get_current_version_id(handbook_id))
+
+
+def _requested_version_state(request, handbook_id):
+    try:
+        version_id = get_version_id(handbook_id, request.GET["version"])
+    except (KeyError, HandbookVersion.DoesNotExist):
+        return None, None
+    return _get_version_state(request, version_id)
+
+
+def _variant_etag(request, etag):
+    # Formats and layouts of the same content are distinct representations
+    variant = rendering.variant(request)
+    return f"{etag}.{variant}" if etag and variant else etag
+
+
+def _recent_version_etag(request, handbook_id):
+    return _variant_etag(request, _recent_version_state(request, handbook_id)[0])
+
+
+def _recent_version_last_modified(request, handbook_id):
+    return _recent_version_state(request, handbook_id)[1]
+
+
+def _requested_version_etag(request, handbook_id):
+    return _variant_etag(request, _requested_version_state(request, handbook_id)[0])
+
+
+def _requested_version_last_modified(request, handbook_id):
+    return _requested_version_state(request, handbook_id)[1]
+
+
+def _diff_version_states(request, handbook_id):
+    try:
+        return [
+            _get_version_state(request, get_version_id(handbook_id, request.GET[p]))
+            for p in ("from", "to")
+        ]
+    except (KeyError, HandbookVersion.DoesNotExist):
+        return None
+
+
+def _diff_etag(request, handbook_id):
+    states = _diff_version_states(request, handbook_id)
+    return states and _variant_etag(
+        request, ".".join(fingerprint for fingerprint, _ in states)
+    )
+
+
+def _diff_last_modified(request, handbook_id):
+    states = _diff_version_states(request, handbook_id)
+    return states and max(updated for _, updated in states)
+
+
+def get_version_snapshot(request, version_id):
+    """Snapshot of the version if enabled, checked against its fingerprint."""
+    if not settings.SNAPSHOTS_ENABLED:
+        return None
+    fingerprint, _ = _get_version_state(request, version_id)
+    return get_snapshot(version_id, fingerprint)
+
+
+def _get_elements_page(request, version_id):
+    """Page of rendered version elements, served from a snapshot if possible."""
+    snapshot = get_version_snapshot(request, version_id)
+    if snapshot is not None:
+        return snapshot.get_page_by_request(request)
+
+    elements_list, next_cursor = get_page_by_request(
+        request,
+        rendering.element_rows(HandbookElement.objects.filter(handbook__id=version_id)),
+        ELEMENT_ORDERING,
+    )
+    return rendering.with_versions(elements_list), next_cursor
 
 
 # Not in use
 class GetHandbooksShort(APIView):
     def get(self, request):
-        limit, offset = get_limit_offset_by_request(request)
-        handbooks_list = Handbook.objects.all()[offset : offset + limit]
-        serialized_data = HandbookModelSerializer(handbooks_list, many=True)
-        return JsonResponse({"handbooks_short": serialized_data.data}, status=200)
+        try:
+            fieldset = fieldsets.parse_fieldset(request, fieldsets.HANDBOOK_FIELDS)
+            handbooks_list, next_cursor = get_page_by_request(
+                request, fieldsets.handbooks_queryset(fieldset), ("id",)
+            )
+        except ValueError:
+            return HttpResponse(status=400)
+        serialized_data = HandbookModelSerializer(
+            handbooks_list, many=True, fieldset=fieldset
+        )
+        return rendering.response(
+            request,
+            with_next_cursor(
+                request, {"handbooks_short": serialized_data.data}, next_cursor
+            ),
+            json_response=JsonResponse,
+        )
 
 
 class GetHandbooksFull(APIView):
@@ -29,8 +160,13 @@ class GetHandbooksFull(APIView):
         operation_summary="Getting list of handbooks.",
         operation_description="""
             Optional query params:
-            limit: num, default=10
+            limit: num, default=10, max=1000
             offset: num, default=0
+            cursor: str, enables keyset pagination instead of offset, empty for the first page.
+                Response then also contains "next": str|null, cursor of the following page.
+            fields: str, comma separated fields to return, "versions.<field>" for fields of versions
+            expand: str, comma separated relations to embed, "versions" or empty.
+                Defaults to the relations fields mentions, or all of them without fields.
 
             Returns list of handbooks and their versions in the amount depends on limit and offset params.
             "handbooks": [{
@@ -52,10 +188,23 @@ class GetHandbooksFull(APIView):
             """,
     )
     def get(self, request):
-        limit, offset = get_limit_offset_by_request(request)
-        handbooks_list = Handbook.objects.all()[offset : offset + limit]
-        serialized_data = HandbookFullSerializer(handbooks_list, many=True)
-        return JsonResponse({"handbooks": serialized_data.data}, status=200)
+        try:
+            fieldset = fieldsets.parse_fieldset(
+                request, fieldsets.HANDBOOK_FIELDS, fieldsets.HANDBOOK_RELATIONS
+            )
+            handbooks_list, next_cursor = get_page_by_request(
+                request, fieldsets.handbooks_queryset(fieldset), ("id",)
+            )
+        except ValueError:
+            return HttpResponse(status=400)
+        serialized_data = HandbookFullSerializer(
+            handbooks_list, many=True, fieldset=fieldset
+        )
+        return rendering.response(
+            request,
+            with_next_cursor(request, {"handbooks": serialized_data.data}, next_cursor),
+            json_response=JsonResponse,
+        )
 
 
 class GetHandbooksActualForDate(APIView):
@@ -66,8 +215,15 @@ class GetHandbooksActualForDate(APIView):
             date: str  datetime format
 
             Optional query params:
-            limit: num, default=10
+            limit: num, default=10, max=1000
             offset: num, default=0
+            cursor: str, enables keyset pagination instead of offset, empty for the first page.
+                Response then also contains "next": str|null, cursor of the following page.
+            fields: str, comma separated fields to return,
+                "handbook_identifier.<field>" for fields of the handbook
+            expand: str, comma separated relations to embed, "handbook_identifier" or empty.
+                Defaults to the relations fields mentions, or all of them without fields.
+                handbook_identifier is the handbook id when not embedded.
 
             Returns list of handbooks versions, in the amount depends on limit and offset params.
             "handbooks_actual_for_date": [{
@@ -90,24 +246,46 @@ class GetHandbooksActualForDate(APIView):
             date_string = request.GET["date"]
         except KeyError:
             return HttpResponse(status=400)
-        limit, offset = get_limit_offset_by_request(request)
-
-        handbooks_list = Handbook.objects.all()[offset : offset + limit]
-        versions_qs = HandbookVersion.objects.none()
-
-        dt_date = datetime.strptime(date_string, "%Y-%m-%d %X")
-        for handbook in handbooks_list:
-            version = (
-                HandbookVersion.objects.filter(handbook_identifier=handbook.id)
-                .filter(created__lte=dt_date)
-                .order_by("-created")[0:1]
-                # union() demands both sides to be queryset. Slice the only way i found to do so here.
+        try:
+            dt_date = parse_date_param(date_string)
+            fieldset = fieldsets.parse_fieldset(
+                request, fieldsets.VERSION_FIELDS, fieldsets.VERSION_RELATIONS
             )
-            versions_qs = versions_qs.union(version)
+        except ValueError:
+            return HttpResponse(status=400)
 
-        serialized_data = HandbookVersionSerializerDeep(versions_qs, many=True)
-        return JsonResponse(
-            {"handbooks_actual_for_date": serialized_data.data}, status=200
+        versions_qs = fieldsets.versions_queryset(
+            HandbookVersion.objects.actual_for_date(dt_date), fieldset
+        )
+        if "cursor" in request.GET:
+            # Keyset mode pages over the versions in effect, one per handbook.
+            try:
+                versions_list, next_cursor = get_page_by_request(
+                    request, versions_qs, ("handbook_identifier_id",)
+                )
+            except ValueError:
+                return HttpResponse(status=400)
+        else:
+            limit, offset = get_limit_offset_by_request(request)
+            handbook_ids = Handbook.objects.order_by("id").values("id")[
+                offset : offset + limit
+            ]
+            versions_list = versions_qs.filter(
+                handbook_identifier__in=handbook_ids
+            ).order_by("handbook_identifier")
+            next_cursor = None
+
+        serialized_data = HandbookVersionSerializerDeep(
+            versions_list, many=True, fieldset=fieldset
+        )
+        return rendering.response(
+            request,
+            with_next_cursor(
+                request,
+                {"handbooks_actual_for_date": serialized_data.data},
+                next_cursor,
+            ),
+            json_response=JsonResponse,
         )
 
 
@@ -116,8 +294,11 @@ class GetRecentHandbookElements(APIView):
         operation_summary="Getting specified handbook elements of actual version.",
         operation_description="""
             Optional query params:
-            limit: num, default=10
+            limit: num, default=10, max=1000
             offset: num, default=0
+            cursor: str, enables keyset pagination instead of offset, empty for the first page.
+                Response then also contains "next": str|null, cursor of the following page.
+            layout: "columns" returns elements as {field: [values]}, one list per field.
 
             Returns list of elements, in the amount depends on limit and offset params.
             "recent_handbook_elements": [{
@@ -126,23 +307,36 @@ class GetRecentHandbookElements(APIView):
                 'element_value': str,
                 'handbook': [num]
             }]
+
+            Supports conditional requests, ETag is the fingerprint of the version.
+            Responds with MessagePack or CBOR for Accept: application/msgpack or application/cbor.
         """,
     )
-    def get(self, request, handbook_id):
-
-        limit, offset = get_limit_offset_by_request(request)
-
-        recent_handbook = HandbookVersion.objects.filter(
-            handbook_identifier=handbook_id
-        ).latest("created")
-        recent_handbook_elements_list = HandbookElement.objects.filter(
-            handbook__id=recent_handbook.id
-        )[offset : offset + limit]
-        serialized_data = HandbookElementSerializer(
-            recent_handbook_elements_list, many=True
+    @method_decorator(
+        condition(
+            etag_func=_recent_version_etag,
+            last_modified_func=_recent_version_last_modified,
         )
-        return JsonResponse(
-            {"recent_handbook_elements": serialized_data.data}, status=200
+    )
+    def get(self, request, handbook_id):
+        recent_handbook_id = get_current_version_id(handbook_id)
+        try:
+            recent_handbook_elements_list, next_cursor = _get_elements_page(
+                request, recent_handbook_id
+            )
+        except ValueError:
+            return HttpResponse(status=400)
+        return rendering.response(
+            request,
+            with_next_cursor(
+                request,
+                {
+                    "recent_handbook_elements": rendering.element_list(
+                        request, recent_handbook_elements_list, ELEMENT_COLUMNS
+                    )
+                },
+                next_cursor,
+            ),
         )
 
 
@@ -154,8 +348,11 @@ class GetVersionHandbookElements(APIView):
             version: str
 
             Optional query params:
-            limit: num, default=10
+            limit: num, default=10, max=1000
             offset: num, default=0
+            cursor: str, enables keyset pagination instead of offset, empty for the first page.
+                Response then also contains "next": str|null, cursor of the following page.
+            layout: "columns" returns elements as {field: [values]}, one list per field.
 
             Returns list of elements, in the amount depends on limit and offset params.
             "requested_version_elements": [{
@@ -164,29 +361,323 @@ class GetVersionHandbookElements(APIView):
                 'element_value': str,
                 'handbook': [num]
             }]
+
+            Supports conditional requests, ETag is the fingerprint of the version.
+            Responds with MessagePack or CBOR for Accept: application/msgpack or application/cbor.
             """,
     )
+    @method_decorator(
+        condition(
+            etag_func=_requested_version_etag,
+            last_modified_func=_requested_version_last_modified,
+        )
+    )
     def get(self, request, handbook_id):
         try:
             handbook_version = request.GET["version"]
         except KeyError:
             return HttpResponse(status=400)
-        limit, offset = get_limit_offset_by_request(request)
 
-        requested_version = HandbookVersion.objects.filter(
-            handbook_identifier=handbook_id
-        ).get(version=handbook_version)
-        requested_elements_list = HandbookElement.objects.filter(
-            handbook__id=requested_version.id
-        )[offset : offset + limit]
+        requested_version_id = get_version_id(handbook_id, handbook_version)
+        try:
+            requested_elements_list, next_cursor = _get_elements_page(
+                request, requested_version_id
+            )
+        except ValueError:
+            return HttpResponse(status=400)
+
+        return rendering.response(
+            request,
+            with_next_cursor(
+                request,
+                {
+                    "requested_version_elements": rendering.element_list(
+                        request, requested_elements_list, ELEMENT_COLUMNS
+                    )
+                },
+                next_cursor,
+            ),
+        )
+
+
+class GetHandbookVersionDiff(APIView):
+    @swagger_auto_schema(
+        operation_summary="Getting changes of elements between two handbook versions.",
+        operation_description="""
+                Required query params:
+            from: str, old version
+            to: str, new version
+
+            Optional query params:
+            limit: num, default=10, max=1000
+            offset: num, default=0
+            cursor: str, enables keyset pagination instead of offset, empty for the first page.
+                Response then also contains "next": str|null, cursor of the following page.
+
+            Returns elements added, removed or changed between the versions,
+            ordered by element_code. Elements of both versions are left out.
+            "from_version_id": num,
+            "to_version_id": num,
+            "changes": [{
+                'change': 'added'|'removed'|'changed',
+                'id': num,
+                'element_code': str,
+                'element_value': str,  new value, old one for removed elements
+                'previous': [{'id': num, 'element_value': str}],  changed only
+            }]
+
+            Supports conditional requests, ETag combines fingerprints of the versions.
+            """,
+    )
+    @method_decorator(
+        condition(etag_func=_diff_etag, last_modified_func=_diff_last_modified)
+    )
+    def get(self, request, handbook_id):
+        try:
+            old_version = request.GET["from"]
+            new_version = request.GET["to"]
+        except KeyError:
+            return HttpResponse(status=400)
+        try:
+            old_version_id = get_version_id(handbook_id, old_version)
+            new_version_id = get_version_id(handbook_id, new_version)
+        except HandbookVersion.DoesNotExist:
+            return HttpResponse(status=404)
+
+        try:
+            rows, next_cursor = get_page_by_request(
+                request,
+                diff.version_diff(old_version_id, new_version_id),
+                ELEMENT_ORDERING,
+            )
+        except ValueError:
+            return HttpResponse(status=400)
+        return rendering.response(
+            request,
+            with_next_cursor(
+                request,
+                {
+                    "from_version_id": old_version_id,
+                    "to_version_id": new_version_id,
+                    "changes": diff.render_changes(
+                        rows, old_version_id, new_version_id
+                    ),
+                },
+                next_cursor,
+            ),
+            status=200,
+        )
+
+
+class ExportVersionHandbookElements(APIView):
+    @swagger_auto_schema(
+        operation_summary="Streaming all elements of specified handbook version.",
+        operation_description="""
+            Optional query params:
+            version: str, default is the actual version
+            output: ndjson|csv, default=ndjson
+
+            Returns all elements of the version ordered by id, without pagination.
+            ndjson: one {"id": num, "element_code": str, "element_value": str} per line
+            csv: header line id,element_code,element_value followed by element rows
+            """,
+    )
+    def get(self, request, handbook_id):
+        # "format" is taken by DRF for its own content negotiation
+        export_format = request.GET.get("output", "ndjson")
+        try:
+            encode, content_type = export.FORMATS[export_format]
+        except KeyError:
+            return HttpResponse(status=400)
+
+        handbook_version = request.GET.get("version", "actual")
+        try:
+            if "version" in request.GET:
+                version_id = get_version_id(handbook_id, handbook_version)
+            else:
+                version_id = get_current_version_id(handbook_id)
+        except HandbookVersion.DoesNotExist:
+            return HttpResponse(status=404)
+
+        rows = (
+            HandbookElement.objects.filter(handbook__id=version_id)
+            .order_by("id")
+            .values_list(*export.FIELDS)
+            .iterator(chunk_size=settings.EXPORT_CHUNK_SIZE)
+        )
+        response = StreamingHttpResponse(encode(rows), content_type=content_type)
+        response["Content-Disposition"] = (
+            f'attachment; filename="handbook_{handbook_id}_{handbook_version}'
+            f'.{export_format}"'
+        )
+        return response
+
+
+class LookupHandbookElements(APIView):
+    # Reads only, see terminology.replicas
+    replica_reads = True
+
+    def post(self, request, handbook_id):
+        """
+            Looking up elements of specified handbook by their codes.
+
+            Expecting json in request body containing:
+            'codes': [str],  up to 5000 codes
+            'date': str,  optional, datetime format, default is now
+
+            Returns elements of the version in effect at the date
+            "version_id": num,
+            "elements": [{
+                'id': num,
+                'element_code': str,
+                'element_value': str,
+            }],
+            "missing_codes": [str]
+
+            Optional query param:
+            layout: "columns" returns elements as {field: [values]}, one list per field.
+
+            Takes and responds with MessagePack or CBOR too, see Content-Type and Accept.
+        """
+        try:
+            codes = request.data["codes"]
+        except KeyError:
+            return HttpResponse(status=400)
+        if (
+            not isinstance(codes, list)
+            or not all(isinstance(code, str) for code in codes)
+            or len(codes) > settings.LOOKUP_MAX_CODES
+        ):
+            return HttpResponse(status=400)
+
+        try:
+            if "date" in request.data:
+                version_id = (
+                    HandbookVersion.objects.filter(
+                        handbook_identifier=handbook_id,
+                        starting_date__lte=parse_date_param(request.data["date"]),
+                    )
+                    .order_by("-starting_date", "-id")
+                    .values_list("id", flat=True)
+                    .first()
+                )
+            else:
+                version_id = get_current_version_id(handbook_id)
+        except HandbookVersion.DoesNotExist:
+            version_id = None
+        except (TypeError, ValueError):
+            return HttpResponse(status=400)
+        if version_id is None:
+            return HttpResponse(status=404)
+
+        snapshot = get_version_snapshot(request, version_id)
+        if snapshot is not None:
+            elements_list = [
+                {field: element[field] for field in rendering.ELEMENT_FIELDS}
+                for code in sorted(set(codes))
+                for element in snapshot.get_by_code(code)
+            ]
+        else:
+            elements_list = list(
+                HandbookElement.objects.filter(
+                    handbook__id=version_id, element_code__in=set(codes)
+                )
+                .order_by(*ELEMENT_ORDERING)
+                .values(*rendering.ELEMENT_FIELDS)
+            )
+        found_codes = {element["element_code"] for element in elements_list}
+        return rendering.response(
+            request,
+            {
+                "version_id": version_id,
+                "elements": rendering.element_list(
+                    request, elements_list, rendering.ELEMENT_FIELDS
+                ),
+                "missing_codes": [code for code in codes if code not in found_codes],
+            }
+        )
+
+
+class SearchHandbookElements(APIView):
+    @swagger_auto_schema(
+        operation_summary="Searching specified handbook version elements by code and value.",
+        operation_description="""
+                Required query param:
+            q: str, up to 255 characters
+
+            Optional query params:
+            version: str, default is the actual version
+            mode: fuzzy|prefix, default=fuzzy
+                prefix matches elements whose code or value starts with q, ignoring case,
+                fuzzy also those whose code or value has words similar to q, tolerating typos.
+            field: element_code|element_value, searches one field only, default is both
+            limit: num, default=10, max=1000
+            offset: num, default=0
+            layout: "columns" returns elements as {field: [values]}, one list per field.
+
+            Returns matching elements, in the amount depends on limit and offset params.
+            Prefix matches go first ordered by element_code, the others follow by descending similarity.
+            "version_id": num,
+            "elements": [{
+                'id': num,
+                'element_code': str,
+                'element_value': str,
+            }]
+
+            Responds with MessagePack or CBOR for Accept: application/msgpack or application/cbor.
+            """,
+    )
+    def get(self, request, handbook_id):
+        query = request.GET.get("q", "")
+        mode = request.GET.get("mode", search.FUZZY)
+        field_name = request.GET.get("field")
+        if (
+            not 0 < len(query) <= search.MAX_QUERY_LENGTH
+            or mode not in search.MODES
+            or field_name not in (None, *search.FIELDS)
+        ):
+            return HttpResponse(status=400)
+        fields = search.FIELDS if field_name is None else (field_name,)
+
+        try:
+            if "version" in request.GET:
+                version_id = get_version_id(handbook_id, request.GET["version"])
+            else:
+                version_id = get_current_version_id(handbook_id)
+        except HandbookVersion.DoesNotExist:
+            return HttpResponse(status=404)
 
-        serialized_data = HandbookElementSerializer(requested_elements_list, many=True)
-        return JsonResponse(
-            {"requested_version_elements": serialized_data.data}, status=200
+        limit, offset = get_limit_offset_by_request(request)
+        index = None
+        if connections[router.db_for_read(HandbookElement)].vendor != "postgresql":
+            fingerprint, _ = _get_version_state(request, version_id)
+            index = search.get_index(version_id, fingerprint)
+            if index is None:
+                # Too large for an in-process index, matched by prefix only
+                mode = search.PREFIX
+        if index is not None:
+            elements_list = index.search(query, mode, fields, limit, offset)
+        else:
+            elements_list = list(
+                search.search_queryset(version_id, query, mode, fields).values(
+                    *rendering.ELEMENT_FIELDS
+                )[offset : offset + limit]
+            )
+        return rendering.response(
+            request,
+            {
+                "version_id": version_id,
+                "elements": rendering.element_list(
+                    request, elements_list, rendering.ELEMENT_FIELDS
+                ),
+            },
         )
 
 
 class RecentHandbookElementsValidation(APIView):
+    # Reads only, see terminology.replicas
+    replica_reads = True
+
     def post(self, request, handbook_id):
         """
             Validating specified handbook elements of recent version.
@@ -222,73 +713,97 @@ class RecentHandbookElementsValidation(APIView):
             received_elements = request.data["elements"]
         except KeyError:
             return HttpResponse(status=400)
+        if not isinstance(received_elements, list):
+            return HttpResponse(status=400)
 
-        handbook_element_list = self._get_handbook_element_list(handbook_id)
-
-        error_dict = {}
+        version_id = get_current_version_id(handbook_id)
+        snapshot = get_version_snapshot(request, version_id)
+        try:
+            report = validation.validate_elements(
+                self.get_reference_rows(version_id, snapshot),
+                received_elements,
+                self.get_strategy(received_elements),
+            )
+        except (KeyError, TypeError):
+            return HttpResponse(status=400)
 
-        id_error, correct_elements = self._id_check(
-            received_elements, handbook_element_list
+        return rendering.response(
+            request,
+            {"validation_errors": self.get_errors(report, snapshot)},
+            json_response=JsonResponse,
         )
-        if id_error:
-            error_dict.update(id_error)
-        if not correct_elements:
-            error_dict.update({"id_error": "no matching id's"})
-            return JsonResponse({"validation_errors": error_dict}, status=200)
-
-        id_validated_list = []
-        for element in handbook_element_list:
-            if element["id"] in correct_elements:
-                id_validated_list.append(element)
-
-        element_code_received_list = [x["element_code"] for x in received_elements]
-        element_value_received_list = [x["element_value"] for x in received_elements]
-
-        element_code_errors = []
-        element_value_errors = []
-        for element in id_validated_list:
-            if element["element_code"] not in element_code_received_list:
-                element_code_errors.append({"element_code_error": element})
-            if element["element_value"] not in element_value_received_list:
-                element_value_errors.append({"element_value_error": element})
-
-        if element_code_errors:
-            error_dict.update({"code_errors": element_code_errors})
-        if element_value_errors:
-            error_dict.update({"value_errors": element_value_errors})
-
-        return JsonResponse({"validation_errors": error_dict}, status=200)
-
-    def _get_handbook_element_list(self, handbook_id):
-        recent_handbook = HandbookVersion.objects.filter(
-            handbook_identifier=handbook_id
-        ).latest("created")
-        handbook_element_qs = HandbookElement.objects.filter(
-            handbook__id=recent_handbook.id
-        )
-        handbook_element_list = HandbookElementSerializer(
-            handbook_element_qs, many=True
-        ).data
 
-        return handbook_element_list
+    def get_strategy(self, received_elements):
+        if len(received_elements) > settings.VALIDATION_MERGE_THRESHOLD:
+            return validation.MERGE
+        return validation.HASH
 
-    def _id_check(self, received_elements, handbook_element_list):
-        received_set = set([x["id"] for x in received_elements])
-        validation_set = set([x["id"] for x in handbook_element_list])
+    def get_reference_rows(self, version_id, snapshot=None):
+        if snapshot is not None:
+            return snapshot.reference_rows()
+        return (
+            HandbookElement.objects.filter(handbook__id=version_id)
+            .order_by("id")
+            .values_list("id", "element_code", "element_value")
+            .iterator(chunk_size=settings.VALIDATION_CHUNK_SIZE)
+        )
 
-        missing_elements = list(received_set - validation_set)
-        unexpected_elements = list(validation_set - received_set)
-        correct_elements = list(validation_set & received_set)
+    def get_errors(self, report, snapshot=None):
+        error_dict = {}
+        if report.missing_ids:
+            error_dict.update({"missing_id": report.missing_ids})
+        if report.unexpected_ids:
+            error_dict.update({"unexpected_id": report.unexpected_ids})
+        if not report.matched_count:
+            error_dict.update({"id_error": "no matching id's"})
+            return error_dict
 
-        result = {}
-        if missing_elements:
-            result.update({"missing_id": missing_elements})
-        if unexpected_elements:
-            result.update({"unexpected_id": unexpected_elements})
-        return result, correct_elements
+        error_ids = set(report.code_error_ids) | set(report.value_error_ids)
+        if snapshot is not None:
+            error_elements = {
+                element_id: snapshot.get_by_id(element_id) for element_id in error_ids
+            }
+        else:
+            error_elements = self._get_elements_data(error_ids)
+        if report.code_error_ids:
+            error_dict.update(
+                {
+                    "code_errors": [
+                        {"element_code_error": error_elements[element_id]}
+                        for element_id in report.code_error_ids
+                    ]
+                }
+            )
+        if report.value_error_ids:
+            error_dict.update(
+                {
+                    "value_errors": [
+                        {"element_value_error": error_elements[element_id]}
+                        for element_id in report.value_error_ids
+                    ]
+                }
+            )
+        return error_dict
+
+    def _get_elements_data(self, element_ids):
+        element_ids = sorted(element_ids)
+        elements_data = {}
+        chunk_size = settings.VALIDATION_CHUNK_SIZE
+        for i in range(0, len(element_ids), chunk_size):
+            elements_qs = HandbookElement.objects.filter(
+                id__in=element_ids[i : i + chunk_size]
+            )
+            for element in rendering.with_versions(
+                list(rendering.element_rows(elements_qs))
+            ):
+                elements_data[element["id"]] = element
+        return elements_data
 
 
 class ElementHandbookValidation(APIView):
+    # Reads only, see terminology.replicas
+    replica_reads = True
+
     def post(self, request, handbook_id):
         """
             Validating specified handbook element of specified version.
@@ -314,25 +829,102 @@ class ElementHandbookValidation(APIView):
         except KeyError:
             return HttpResponse(status=400)
 
-        raw_handbook = HandbookVersion.objects.filter(
-            handbook_identifier=handbook_id
-        ).get(version=handbook_version)
+        version_id = get_version_id(handbook_id, handbook_version)
 
-        error_dict = {}
+        snapshot = get_version_snapshot(request, version_id)
+        if snapshot is not None:
+            element = snapshot.get_by_id(received_element["id"])
+            reference = element and (element["element_code"], element["element_value"])
+        else:
+            reference = (
+                HandbookElement.objects.filter(
+                    handbook__id=version_id, pk=received_element["id"]
+                )
+                .values_list("element_code", "element_value")
+                .first()
+            )
+        error_dict = validation.element_errors(received_element, reference)
+        return rendering.response(
+            request, {"validation_errors": error_dict}, json_response=JsonResponse
+        )
+
+
+class BatchElementHandbookValidation(APIView):
+    # Reads only, see terminology.replicas
+    replica_reads = True
+
+    def post(self, request):
+        """
+            Validating elements of specified handbook versions in one request.
+
+            Expecting json in request body containing up to 10000 items:
+            'items': [{
+                'handbook_id': num,
+                'version': str,
+                'element': {
+                    id: num,
+                    element_code: str,
+                    element_value: str,
+                }
+            }]
+
+            Returns results in the order of items, each of them in the form of
+            ElementHandbookValidation response
+            "results": [{
+                "validation_errors": {
+                    'version_error': str,
+                    'id_error': str,
+                    'element_code_error': str,
+                    'element_value_error': str,
+                }
+            }]
+        """
         try:
-            validating_element = HandbookElement.objects.filter(
-                handbook__id=raw_handbook.id
-            ).get(pk=received_element["id"])
-        except ObjectDoesNotExist:
-            error_dict.update({"id_error": f'no such id {received_element["id"]}'})
-            return JsonResponse({"validation_errors": error_dict}, status=200)
+            items = request.data["items"]
+            keys = [
+                (int(item["handbook_id"]), item["version"], int(item["element"]["id"]))
+                for item in items
+            ]
+        except (KeyError, TypeError, ValueError):
+            return HttpResponse(status=400)
+        if len(keys) > settings.VALIDATION_BATCH_MAX_ITEMS:
+            return HttpResponse(status=400)
 
-        if validating_element.element_code != received_element["element_code"]:
-            error_dict.update({"element_code_error": validating_element.element_code})
-        if validating_element.element_value != received_element["element_value"]:
-            error_dict.update({"element_value_error": validating_element.element_value})
+        version_ids = get_version_ids({(h_id, version) for h_id, version, _ in keys})
+        reference = self._get_reference(
+            set(version_ids.values()), {element_id for _, _, element_id in keys}
+        )
+
+        results = []
+        for item, (h_id, version, element_id) in zip(items, keys):
+            version_id = version_ids.get((h_id, version))
+            if version_id is None:
+                error_dict = {"version_error": f"no such version {version}"}
+            else:
+                try:
+                    error_dict = validation.element_errors(
+                        item["element"], reference.get((version_id, element_id))
+                    )
+                except KeyError:
+                    return HttpResponse(status=400)
+            results.append({"validation_errors": error_dict})
+
+        return rendering.response(
+            request, {"results": results}, json_response=JsonResponse
+        )
 
-        return JsonResponse({"validation_errors": error_dict}, status=200)
+    def _get_reference(self, version_ids, element_ids):
+        """Maps (version id, element id) -> (element_code, element_value)."""
+        reference = {}
+        element_ids = sorted(element_ids)
+        chunk_size = settings.VALIDATION_CHUNK_SIZE
+        for i in range(0, len(element_ids), chunk_size):
+            elements_qs = HandbookElement.objects.filter(
+                handbook__id__in=version_ids, id__in=element_ids[i : i + chunk_size]
+            ).values_list("handbook__id", "id", "element_code", "element_value")
+            for version_id, element_id, code, value in elements_qs:
+                reference[(version_id, element_id)] = (code, value)
+        return reference
 
 
 class PostHandbook(APIView):
@@ -401,3 +993,221 @@ class PostHandbookElement(APIView):
             return HttpResponse(status=201)
         else:
             return HttpResponse(status=400)
+
+
+class PostHandbookElements(APIView):
+    def post(self, request):
+        """
+            Creating many handbook elements at once, all or nothing.
+
+            Expecting json in request body containing up to 100000 elements:
+            'handbook_elements': [{
+                'handbook': [str],  version names
+                'element_code': str,
+                'element_value': str,
+            }]
+
+            Returns 201 with ids of created elements in the order of request
+            "ids": [num]
+
+            Or 400 with errors of invalid elements, nothing is created then
+            "errors": [{
+                'index': num,
+                'errors': {field: [str]},
+            }]
+        """
+        try:
+            received_elements = request.data["handbook_elements"]
+        except KeyError:
+            return HttpResponse(status=400)
+        if (
+            not isinstance(received_elements, list)
+            or len(received_elements) > settings.BULK_MAX_ELEMENTS
+        ):
+            return HttpResponse(status=400)
+
+        serialized_elements = HandbookElementBulkSerializer(
+            data=received_elements, many=True
+        )
+        if not serialized_elements.is_valid():
+            return self._errors_response(serialized_elements.errors)
+        validated_elements = serialized_elements.validated_data
+
+        version_names = {
+            name for element in validated_elements for name in element["handbook"]
+        }
+        versions_id = {}
+        for v_id, name in HandbookVersion.objects.filter(
+            version__in=version_names
+        ).values_list("id", "version"):
+            versions_id.setdefault(name, []).append(v_id)
+
+        rows, row_errors = [], []
+        for element in validated_elements:
+            prepared_id = [
+                v_id
+                for name in element["handbook"]
+                for v_id in versions_id.get(name, [])
+            ]
+            rows.append(
+                (element["element_code"], element["element_value"], prepared_id)
+            )
+            row_errors.append(
+                {} if prepared_id else {"handbook": ["No such versions."]}
+            )
+        if any(row_errors):
+            return self._errors_response(row_errors)
+
+        return JsonResponse({"ids": bulk_create_elements(rows)}, status=201)
+
+    def _errors_response(self, row_errors):
+        errors = [
+            {"index": index, "errors": element_errors}
+            for index, element_errors in enumerate(row_errors)
+            if element_errors
+        ]
+        return JsonResponse({"errors": errors}, status=400)
+
+
+class PostHandbookVersionFork(APIView):
+    def post(self, request, handbook_id):
+        """
+            Creating a handbook version from an existing one.
+
+            The new version gets the elements of from_version without copying
+            them, then the patch is applied, all or nothing.
+            Expecting json in request body containing:
+            'from_version': str,
+            'version': str,  name of the new version
+            'starting_date': str,  optional, ISO 8601, default is now
+            'add': [{'element_code': str, 'element_value': str}],  optional
+            'remove': [str],  optional, codes of elements to leave out
+            'replace': [{'element_code': str, 'element_value': str}],  optional,
+                new values of codes
+
+            Patches are limited to 10000 items in total.
+            Returns 201 with the id of the version and counts of its links
+            "version_id": num,
+            "copied": num,
+            "removed": num,
+            "added": num
+
+            Or 400 with errors, 404 if from_version does not exist
+            "errors": {field: [str]}
+        """
+        serialized_fork = HandbookVersionForkSerializer(data=request.data)
+        if not serialized_fork.is_valid():
+            return JsonResponse({"errors": serialized_fork.errors}, status=400)
+        data = serialized_fork.validated_data
+
+        try:
+            source_version_id = get_version_id(handbook_id, data["from_version"])
+        except HandbookVersion.DoesNotExist:
+            return HttpResponse(status=404)
+        if HandbookVersion.objects.filter(
+            handbook_identifier=handbook_id, version=data["version"]
+        ).exists():
+            return JsonResponse(
+                {"errors": {"version": ["Version already exists."]}}, status=400
+            )
+
+        version = HandbookVersion(
+            handbook_identifier_id=handbook_id, version=data["version"]
+        )
+        if "starting_date" in data:
+            version.starting_date = data["starting_date"]
+        counts = fork_version(
+            source_version_id,
+            version,
+            add=[(e["element_code"], e["element_value"]) for e in data.get("add", ())],
+            remove=data.get("remove", ()),
+            replace=[
+                (e["element_code"], e["element_value"])
+                for e in data.get("replace", ())
+            ],
+        )
+        return JsonResponse({"version_id": version.id, **counts}, status=201)
+
+
+class GetChanges(APIView):
+    @swagger_auto_schema(
+        operation_summary="Getting changes of handbooks, versions and elements.",
+        operation_description="""
+            Optional query params:
+            since: num, default=0, seq of the last change seen
+            limit: num, default=1000, max=1000
+
+            Returns changes after since in seq order. Mirrors refetch the named
+            objects, created and updated both mean upsert. Membership changes
+            are additions and removals of elements to and from versions.
+            "changes": [{
+                'seq': num,
+                'kind': 'handbook'|'version'|'element'|'membership',
+                'action': 'created'|'updated'|'deleted',
+                'id': num,
+                'version_id': num,  membership only
+            }],
+            "next_since": num, since of the following request
+            "more": bool, whether further changes are ready
+
+            Returns 410 when changes after since are no longer retained:
+            "pruned_through": num, seq through which changes were dropped
+            "head_seq": num, seq through which all changes are committed
+            Mirrors resync then: keep head_seq, refetch all handbooks,
+            versions and elements, and continue with since=head_seq.
+
+            Writes are expected to commit within CHANGE_FEED_SETTLE_SECONDS.
+            Changes of longer transactions may be skipped by readers which
+            went past them, such mirrors resync in full to see them.
+            """,
+    )
+    def get(self, request):
+        try:
+            since = int(request.GET.get("since", 0))
+            limit = int(request.GET.get("limit", settings.CHANGE_FEED_BATCH_SIZE))
+        except ValueError:
+            return HttpResponse(status=400)
+        if since < 0 or limit < 1:
+            return HttpResponse(status=400)
+        limit = min(limit, settings.CHANGE_FEED_BATCH_SIZE)
+
+        try:
+            records, more = changes.get_changes(since, limit)
+        except changes.ResyncRequired as e:
+            return rendering.json_response(
+                {"pruned_through": e.pruned_through, "head_seq": e.head_seq},
+                status=410,
+            )
+        return rendering.json_response(
+            {
+                "changes": records,
+                "next_since": records[-1]["seq"] if records else since,
+                "more": more,
+            }
+        )
+
+
+class GetSnapshotStats(APIView):
+    def get(self, request):
+        return JsonResponse({"snapshots": snapshot_store.stats()}, status=200)
+
+
+class GetMetrics(APIView):
+    def get(self, request):
+        return HttpResponse(
+            metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8"
+        )
+
+
+class GetReadiness(APIView):
+    @swagger_auto_schema(
+        operation_summary="Readiness probe.",
+        operation_description="""
+            Answers 200 once the serving process is warmed up and 503 before.
+            Processes not started by the serve command never become ready.
+            """,
+        responses={200: "ready", 503: "warming up"},
+    )
+    def get(self, request):
+        ready = warmup.is_ready()
+        return JsonResponse({"ready": ready}, status=200 if ready else 503)
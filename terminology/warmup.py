@@ -0,0 +1,68 @@
+"""
+Warm-up of a process before it accepts traffic.
+
+Pays the first request costs up front: database connection, model and query
+machinery, URL patterns, swagger schema introspection, and version caches,
+fingerprints and snapshots of the handbook versions currently in effect. The
+serve command runs it in the gunicorn master before workers are forked, so
+every worker starts warm and shares the warmed memory copy-on-write.
+"""
+
+import time
+
+from django.apps import apps
+from django.conf import settings
+from django.urls import get_resolver
+from django.utils import timezone
+from drf_yasg import openapi
+from drf_yasg.generators import OpenAPISchemaGenerator
+
+from terminology.fingerprint import get_version_state
+from terminology.models import HandbookVersion
+from terminology.snapshots import get_snapshot
+from terminology.version_cache import get_current_version_id
+
+_ready = False
+
+
+def is_ready():
+    """True once warm_up completed in this process or its parent."""
+    return _ready
+
+
+def warm_versions(max_versions):
+    """
+    Warms up to max_versions versions in effect, most recently started first.
+    These serve /element/actual/ and recent element validation.
+    """
+    rows = (
+        HandbookVersion.objects.actual_for_date(timezone.now())
+        .order_by("-starting_date", "-id")
+        .values_list("id", "handbook_identifier_id")[:max_versions]
+    )
+    version_ids = []
+    for version_id, handbook_id in rows:
+        get_current_version_id(handbook_id)
+        fingerprint, _ = get_version_state(version_id)
+        get_snapshot(version_id, fingerprint)
+        version_ids.append(version_id)
+    return version_ids
+
+
+def warm_up(max_versions=None):
+    """Warms the process and marks it ready, returns a summary."""
+    global _ready
+    if max_versions is None:
+        max_versions = settings.WARMUP_VERSIONS
+    start = time.perf_counter()
+
+    for model in apps.get_app_config("terminology").get_models():
+        list(model.objects.all()[:1])
+    get_resolver().reverse_dict  # compiles every URL pattern
+    OpenAPISchemaGenerator(openapi.Info(title="", default_version="")).get_schema(
+        public=True
+    )
+    version_ids = warm_versions(max_versions)
+
+    _ready = True
+    return {"versions": len(version_ids), "seconds": time.perf_counter() - start}